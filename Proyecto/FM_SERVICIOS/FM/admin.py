@@ -1,9 +1,11 @@
 ﻿from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
 from .models import (
     User, Servicio, ServicioImagen, ServicioFAQ,
     Edificio, Cotizacion, CotizacionItem, Trabajo, ContactoWeb,
-    Documento,
+    Documento, Etiqueta, VisitaRecurrente, Comuna, Cobertura,
 )
+from .busqueda import buscar
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -19,13 +21,34 @@ class ServicioFAQInline(admin.TabularInline):
     model = ServicioFAQ
     extra = 1
 
+class CoberturaInline(admin.TabularInline):
+    model = Cobertura
+    extra = 0
+    autocomplete_fields = ("comuna",)
+
 @admin.register(Servicio)
 class ServicioAdmin(admin.ModelAdmin):
     list_display = ("titulo", "slug", "publicado", "orden", "creado_en")
     list_filter = ("publicado",)
     search_fields = ("titulo", "resumen")
     prepopulated_fields = {"slug": ("titulo",)}
-    inlines = [ServicioImagenInline, ServicioFAQInline]
+    inlines = [ServicioImagenInline, ServicioFAQInline, CoberturaInline]
+
+@admin.register(Comuna)
+class ComunaAdmin(admin.ModelAdmin):
+    list_display = ("nombre", "region")
+    list_filter = ("region",)
+    search_fields = ("nombre", "region__nombre")
+    list_select_related = ("region",)
+
+@admin.register(Cobertura)
+class CoberturaAdmin(admin.ModelAdmin):
+    list_display = ("comuna", "servicio", "cubierta", "motivo", "actualizado_en")
+    list_editable = ("cubierta", "motivo")
+    list_filter = ("cubierta", "servicio", "comuna__region")
+    search_fields = ("comuna__nombre", "comuna__region__nombre", "motivo")
+    list_select_related = ("comuna__region", "servicio")
+    autocomplete_fields = ("comuna",)
 
 @admin.register(Edificio)
 class EdificioAdmin(admin.ModelAdmin):
@@ -36,14 +59,34 @@ class CotizacionItemInline(admin.TabularInline):
     model = CotizacionItem
     extra = 1
 
+class BusquedaChangeList(ChangeList):
+    """Con un termino de busqueda y sin orden elegido en la tabla, los resultados van por relevancia."""
+
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        # El orden se aplica antes de la busqueda, asi que "rango" recien existe aca
+        if "rango" in qs.query.annotations and ORDER_VAR not in self.params:
+            qs = qs.order_by("-rango", "-pk")
+        return qs
+
 @admin.register(Cotizacion)
 class CotizacionAdmin(admin.ModelAdmin):
     list_display = ("id", "usuario", "servicio", "estado", "presupuesto_estimado", "creado_en", "resuelto_en")
     list_filter = ("estado", "servicio")
     date_hierarchy = "creado_en"
+    # La busqueda usa el indice de texto completo (FM/busqueda.py) y ordena por relevancia
     search_fields = ("asunto", "mensaje", "usuario__username", "usuario__email")
+    search_help_text = "Busca en asunto, mensaje, lugar, comuna y nombre o correo del cliente."
     inlines = [CotizacionItemInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return buscar(queryset, search_term), False
+
+    def get_changelist(self, request, **kwargs):
+        return BusquedaChangeList
+
 @admin.register(Trabajo)
 class TrabajoAdmin(admin.ModelAdmin):
     list_display = ("titulo", "edificio", "servicio", "estado", "fecha_programada")
@@ -51,6 +94,14 @@ class TrabajoAdmin(admin.ModelAdmin):
     date_hierarchy = "fecha_programada"
     search_fields = ("titulo", "descripcion", "edificio__nombre")
 
+@admin.register(VisitaRecurrente)
+class VisitaRecurrenteAdmin(admin.ModelAdmin):
+    list_display = ("edificio", "servicio", "tecnico", "frecuencia", "intervalo", "hora", "fecha_inicio", "fecha_fin", "activa")
+    list_filter = ("activa", "frecuencia", "servicio")
+    search_fields = ("edificio__nombre", "notas")
+    list_select_related = ("edificio", "servicio", "tecnico")
+    readonly_fields = ("rrule",)
+
 @admin.register(ContactoWeb)
 class ContactoWebAdmin(admin.ModelAdmin):
     list_display = ("nombre", "apellido", "email", "tipo_servicio", "creado_en")
@@ -62,3 +113,8 @@ class DocumentoAdmin(admin.ModelAdmin):
     list_filter = ("publico",)
     search_fields = ("titulo",)
 
+@admin.register(Etiqueta)
+class EtiquetaAdmin(admin.ModelAdmin):
+    list_display = ("nombre", "clave")
+    search_fields = ("clave",)
+
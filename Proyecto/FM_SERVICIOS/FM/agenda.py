@@ -0,0 +1,292 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import time, timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Tecnico, VisitaTecnica
+
+
+VENTANA = VisitaTecnica.VENTANA_CONFLICTO
+# Nombre de la restriccion de exclusion de Postgres (VisitaTecnica.Meta.constraints)
+RESTRICCION_SIN_SOLAPE = "fm_visita_sin_solape"
+MENSAJE_CONFLICTO = "El técnico ya tiene una hora tomada dentro de 3 horas de ese horario."
+
+# Jornada de inicio de visitas (08:00 a 20:00) en bloques de 30 minutos: bit i = 08:00 + 30*i
+JORNADA_INICIO = time(8, 0)
+JORNADA_FIN = time(20, 0)
+MINUTOS_SLOT = 30
+SLOTS_DIA = (JORNADA_FIN.hour * 60 + JORNADA_FIN.minute - JORNADA_INICIO.hour * 60 - JORNADA_INICIO.minute) // MINUTOS_SLOT
+MASCARA_DIA = (1 << SLOTS_DIA) - 1
+
+# Fallback para motores sin restricciones de exclusion (SQLite): serializa las reservas del proceso
+_reservas_lock = threading.RLock()
+
+
+class ConflictoAgenda(Exception):
+    """El horario solicitado choca con otra visita del mismo tecnico."""
+
+    def __init__(self, message=MENSAJE_CONFLICTO):
+        super().__init__(message)
+
+
+@contextmanager
+def reserva_atomica():
+    """
+    Bloque transaccional para reservar horas sin carreras.
+    En Postgres la restriccion de exclusion resuelve la concurrencia; en otros motores se
+    serializan las reservas con un lock de proceso tomado antes de abrir la transaccion
+    (SQLite usa transacciones IMMEDIATE, asi que tambien queda serializado entre procesos).
+    """
+    if connection.vendor == "postgresql":
+        with transaction.atomic():
+            yield
+        return
+    with _reservas_lock:
+        with transaction.atomic():
+            yield
+
+
+def guardar_visita(visita, update_fields=None):
+    """
+    Crea o actualiza una visita validando la agenda del tecnico de forma atomica.
+    Lanza ConflictoAgenda si el horario choca con otra visita.
+    """
+    try:
+        with reserva_atomica():
+            visita.resolver_tecnico()
+            if tecnico_tiene_conflicto(visita.tecnico_id, visita.fecha, visita.hora, exclude_id=visita.pk):
+                raise ConflictoAgenda()
+            visita.save(update_fields=update_fields)
+    except IntegrityError as exc:
+        if RESTRICCION_SIN_SOLAPE in str(exc):
+            raise ConflictoAgenda() from exc
+        raise
+    return visita
+
+
+def tecnico_tiene_conflicto(tecnico_id, fecha, hora, exclude_id=None) -> bool:
+    """
+    Indica si el tecnico (id) ya tiene una visita a menos de 3 horas de fecha/hora.
+    Resuelve con un EXISTS sobre el indice (tecnico, inicio) sin materializar filas.
+    """
+    if not (tecnico_id and fecha and hora):
+        return False
+    inicio, fin = VisitaTecnica.intervalo_para(fecha, hora)
+    visitas = VisitaTecnica.objects.filter(tecnico_id=tecnico_id, inicio__lte=fin, fin__gte=inicio)
+    if exclude_id:
+        visitas = visitas.exclude(pk=exclude_id)
+    return visitas.exists()
+
+
+def conflictos_en_lote(candidatos, entre_si=False) -> set[int]:
+    """
+    Revisa muchos horarios candidatos con una sola consulta.
+    candidatos: lista de tuplas (tecnico_id, fecha, hora) o (tecnico_id, fecha, hora, exclude_id).
+    Retorna los indices de los candidatos que chocan con la agenda. Con entre_si=True tambien
+    marca los candidatos que chocan con otro candidato anterior (ya aceptado) del mismo lote.
+    """
+    normalizados = []
+    rangos = {}
+    for idx, cand in enumerate(candidatos):
+        tecnico_id, fecha, hora = cand[0], cand[1], cand[2]
+        exclude_id = cand[3] if len(cand) > 3 else None
+        inicio, _ = VisitaTecnica.intervalo_para(fecha, hora)
+        if not (tecnico_id and inicio):
+            continue
+        normalizados.append((idx, tecnico_id, inicio, exclude_id))
+        bajo, alto = rangos.get(tecnico_id, (inicio, inicio))
+        rangos[tecnico_id] = (min(bajo, inicio), max(alto, inicio))
+    if not normalizados:
+        return set()
+
+    filtro = Q()
+    for tecnico_id, (bajo, alto) in rangos.items():
+        filtro |= Q(tecnico_id=tecnico_id, inicio__lte=alto + VENTANA, fin__gte=bajo)
+    ocupados = defaultdict(list)
+    for pk, tecnico_id, inicio in VisitaTecnica.objects.filter(filtro).values_list("id", "tecnico_id", "inicio"):
+        ocupados[tecnico_id].append((inicio, pk))
+    for lista in ocupados.values():
+        lista.sort()
+
+    conflictos = set()
+    aceptados = defaultdict(list)
+    for idx, tecnico_id, inicio, exclude_id in normalizados:
+        if _choca(ocupados.get(tecnico_id, []), inicio, exclude_id) or (
+            entre_si and _choca(aceptados[tecnico_id], inicio)
+        ):
+            conflictos.add(idx)
+            continue
+        if entre_si:
+            pos = bisect_left(aceptados[tecnico_id], (inicio, idx))
+            aceptados[tecnico_id].insert(pos, (inicio, idx))
+    return conflictos
+
+
+def _choca(ocupados, inicio, exclude_id=None) -> bool:
+    # ocupados: lista ordenada de (inicio, id); hay choque si algun inicio cae en [inicio - VENTANA, inicio + VENTANA]
+    pos = bisect_left(ocupados, (inicio - VENTANA,))
+    limite = inicio + VENTANA
+    while pos < len(ocupados) and ocupados[pos][0] <= limite:
+        if ocupados[pos][1] != exclude_id:
+            return True
+        pos += 1
+    return False
+
+
+def _minutos(hora) -> int:
+    return hora.hour * 60 + hora.minute
+
+
+def slot_a_hora(indice: int) -> time:
+    minutos = _minutos(JORNADA_INICIO) + indice * MINUTOS_SLOT
+    return time(minutos // 60, minutos % 60)
+
+
+def hora_a_slot(hora):
+    """Indice del bloque que empieza exactamente a esa hora, o None si no calza con la grilla."""
+    delta = _minutos(hora) - _minutos(JORNADA_INICIO)
+    if delta < 0 or delta % MINUTOS_SLOT or delta // MINUTOS_SLOT >= SLOTS_DIA:
+        return None
+    return delta // MINUTOS_SLOT
+
+
+def mascara_bloqueo(hora) -> int:
+    """Bloques de inicio que quedan tomados por una visita a esa hora (ventana de +-3 horas)."""
+    ventana = int(VENTANA.total_seconds() // 60)
+    base = _minutos(JORNADA_INICIO)
+    desde = -(-(_minutos(hora) - ventana - base) // MINUTOS_SLOT)  # techo
+    hasta = (_minutos(hora) + ventana - base) // MINUTOS_SLOT
+    desde, hasta = max(desde, 0), min(hasta, SLOTS_DIA - 1)
+    if desde > hasta:
+        return 0
+    return ((1 << (hasta - desde + 1)) - 1) << desde
+
+
+def ventanas_libres(libres: int) -> list[tuple[time, time]]:
+    """
+    Convierte una mascara de bloques libres en tramos (primera hora, ultima hora de inicio posible).
+    Cada tramo sale de aislar el bit bajo y medir la racha de unos con operaciones de bits.
+    """
+    tramos = []
+    while libres:
+        inicio = (libres & -libres).bit_length() - 1
+        racha = libres >> inicio
+        largo = (racha ^ (racha + 1)).bit_length() - 1
+        tramos.append((slot_a_hora(inicio), slot_a_hora(inicio + largo - 1)))
+        libres &= ~(((1 << largo) - 1) << inicio)
+    return tramos
+
+
+class Disponibilidad:
+    """
+    Ocupacion de los tecnicos activos entre dos fechas, cargada con una sola consulta de visitas.
+    Por tecnico y dia guarda un entero cuyos bits marcan los bloques de 30 minutos donde
+    ya no se puede iniciar otra visita sin violar la regla de 3 horas.
+    """
+
+    def __init__(self, desde, hasta, tecnicos=None):
+        self.desde = desde
+        self.hasta = hasta
+        if tecnicos is None:
+            tecnicos = Tecnico.objects.filter(activo=True, slug__isnull=False).order_by("nombre", "apellido", "id")
+        self.tecnicos = [t for t in tecnicos if t.slug]
+        self.ocupado = {t.slug: defaultdict(int) for t in self.tecnicos}
+        # Horas tomadas por dia (base de datos + reservas en memoria) y dias bloqueados, para poder liberar
+        self.horas = {t.slug: defaultdict(list) for t in self.tecnicos}
+        self.bloqueados = defaultdict(set)
+        # Bloques que ya pasaron (dias anteriores completos y lo transcurrido de hoy): no se ofrecen a nadie
+        self.cerrado = {}
+        ahora = timezone.localtime()
+        if desde <= ahora.date():
+            self.cerrado = {dia: MASCARA_DIA for dia in self.dias() if dia < ahora.date()}
+            transcurridos = -(-(_minutos(ahora.time()) - _minutos(JORNADA_INICIO) + 1) // MINUTOS_SLOT)
+            self.cerrado[ahora.date()] = (1 << min(max(transcurridos, 0), SLOTS_DIA)) - 1
+        slugs = {t.pk: t.slug for t in self.tecnicos}
+        visitas = VisitaTecnica.objects.filter(
+            tecnico_id__in=list(slugs),
+            fecha__gte=desde,
+            fecha__lte=hasta,
+            hora__isnull=False,
+        ).values_list("tecnico_id", "fecha", "hora")
+        for tecnico_id, fecha, hora in visitas:
+            self.ocupado[slugs[tecnico_id]][fecha] |= mascara_bloqueo(hora)
+            self.horas[slugs[tecnico_id]][fecha].append(hora)
+
+    @classmethod
+    def mes(cls, primer_dia, tecnicos=None):
+        siguiente = (primer_dia.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return cls(primer_dia, siguiente - timedelta(days=1), tecnicos=tecnicos)
+
+    def dias(self):
+        dia = self.desde
+        while dia <= self.hasta:
+            yield dia
+            dia += timedelta(days=1)
+
+    def libres(self, slug, fecha) -> int:
+        return ~(self.ocupado.get(slug, {}).get(fecha, 0) | self.cerrado.get(fecha, 0)) & MASCARA_DIA
+
+    def ventanas(self, slug, fecha):
+        return ventanas_libres(self.libres(slug, fecha))
+
+    def esta_libre(self, slug, fecha, hora) -> bool:
+        """Solo responde por horas de la grilla; las demas se validan con tecnico_tiene_conflicto."""
+        slot = hora_a_slot(hora)
+        if slot is None:
+            return False
+        return bool(self.libres(slug, fecha) >> slot & 1)
+
+    def reservar(self, slug, fecha, hora):
+        """Marca una reserva en memoria (p. ej. durante una asignacion en lote)."""
+        self.ocupado.setdefault(slug, defaultdict(int))[fecha] |= mascara_bloqueo(hora)
+        self.horas.setdefault(slug, defaultdict(list))[fecha].append(hora)
+
+    def liberar(self, slug, fecha, hora):
+        """Deshace en memoria una reserva: recalcula el dia con las horas que siguen tomadas."""
+        horas = self.horas.setdefault(slug, defaultdict(list))[fecha]
+        if hora in horas:
+            horas.remove(hora)
+        if fecha in self.bloqueados[slug]:
+            return
+        mascara = 0
+        for tomada in horas:
+            mascara |= mascara_bloqueo(tomada)
+        self.ocupado.setdefault(slug, defaultdict(int))[fecha] = mascara
+
+    def bloquear(self, slug, desde, hasta):
+        """Marca al tecnico sin horarios entre dos fechas (ausencia, licencia)."""
+        dias = self.ocupado.setdefault(slug, defaultdict(int))
+        for dia in self.dias():
+            if desde <= dia <= hasta:
+                dias[dia] = MASCARA_DIA
+                self.bloqueados[slug].add(dia)
+
+    def tecnicos_libres(self, fecha) -> int:
+        return sum(1 for t in self.tecnicos if self.libres(t.slug, fecha))
+
+    def como_dict(self):
+        return {
+            "desde": self.desde.isoformat(),
+            "hasta": self.hasta.isoformat(),
+            "jornada": [JORNADA_INICIO.strftime("%H:%M"), JORNADA_FIN.strftime("%H:%M")],
+            "minutos_slot": MINUTOS_SLOT,
+            "tecnicos": [
+                {
+                    "slug": t.slug,
+                    "nombre": f"{t.nombre} {t.apellido or ''}".strip(),
+                    "dias": {
+                        dia.isoformat(): [
+                            {"desde": a.strftime("%H:%M"), "hasta": b.strftime("%H:%M")}
+                            for a, b in self.ventanas(t.slug, dia)
+                        ]
+                        for dia in self.dias()
+                    },
+                }
+                for t in self.tecnicos
+            ],
+        }
@@ -0,0 +1,81 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, DateField, DecimalField, DurationField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Cotizacion
+
+
+# Series de cotizaciones por periodo de creacion (cohortes): una consulta agrupada por periodo, memoizada por
+# (rango, granularidad) bajo una version que las senales de Cotizacion incrementan.
+CLAVE_VERSION = "analitica:version"
+TTL = 60 * 60
+GRANULARIDADES = {"dia": TruncDate, "semana": TruncWeek, "mes": TruncMonth}
+COLUMNAS = (
+    "periodo", "creadas", "enviadas", "aceptadas", "completadas", "rechazadas",
+    "tasa_envio", "tasa_aceptacion", "tasa_completado", "monto_aceptado", "monto_completado", "horas_resolucion",
+)
+
+# Enviada = llego al cliente con precio (enviada_en); una rechazada estando PENDIENTE no cuenta. Las etapas
+# siguientes salen del estado actual: una cotizacion aceptada esta en ella o en una posterior
+_ENVIADAS = Q(enviada_en__isnull=False)
+_ACEPTADAS = Q(estado__in=[Cotizacion.Estado.ACEPTADA, Cotizacion.Estado.PROCESO_PAGO, Cotizacion.Estado.COMPLETADA])
+_COMPLETADAS = Q(estado=Cotizacion.Estado.COMPLETADA)
+
+
+def _monto(filtro):
+    return Coalesce(Sum("presupuesto_estimado", filter=filtro), Value(Decimal("0")), output_field=DecimalField())
+
+
+def _tasa(parte, total):
+    return round(parte / total, 4) if total else None
+
+
+def calcular_series(desde, hasta, granularidad="dia"):
+    tz = timezone.get_current_timezone()
+    trunc = GRANULARIDADES[granularidad]
+    periodo = trunc("creado_en", tzinfo=tz) if trunc is TruncDate else trunc("creado_en", output_field=DateField(), tzinfo=tz)
+    filas = (
+        Cotizacion.objects.filter(creado_en__date__gte=desde, creado_en__date__lte=hasta)
+        .annotate(periodo=periodo)
+        .values("periodo")
+        .annotate(
+            creadas=Count("pk"),
+            enviadas=Count("pk", filter=_ENVIADAS),
+            aceptadas=Count("pk", filter=_ACEPTADAS),
+            completadas=Count("pk", filter=_COMPLETADAS),
+            rechazadas=Count("pk", filter=Q(estado=Cotizacion.Estado.RECHAZADA)),
+            monto_aceptado=_monto(_ACEPTADAS),
+            monto_completado=_monto(_COMPLETADAS),
+            resolucion=Avg(
+                ExpressionWrapper(F("resuelto_en") - F("creado_en"), output_field=DurationField()),
+                filter=Q(resuelto_en__isnull=False),
+            ),
+        )
+        .order_by("periodo")
+    )
+    series = []
+    for f in filas:
+        resolucion = f.pop("resolucion")
+        f["tasa_envio"] = _tasa(f["enviadas"], f["creadas"])
+        f["tasa_aceptacion"] = _tasa(f["aceptadas"], f["enviadas"])
+        f["tasa_completado"] = _tasa(f["completadas"], f["aceptadas"])
+        f["horas_resolucion"] = round(resolucion.total_seconds() / 3600, 2) if resolucion is not None else None
+        series.append(f)
+    return series
+
+
+def series_cotizaciones(desde, hasta, granularidad="dia"):
+    """Filas por periodo con los campos de COLUMNAS; desde la cache mientras no cambie ninguna cotizacion."""
+    version = cache.get_or_set(CLAVE_VERSION, 1, None)
+    clave = f"analitica:{version}:{granularidad}:{desde.isoformat()}:{hasta.isoformat()}"
+    return cache.get_or_set(clave, lambda: calcular_series(desde, hasta, granularidad), TTL)
+
+
+def invalidar_analitica():
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.set(CLAVE_VERSION, 2, None)
@@ -5,3 +5,5 @@ class FMConfig(AppConfig):
     name = 'FM'
     label = 'FM'   # mantenemos el mismo label (tablas "FM_*")
 
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,274 @@
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import time, timedelta
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .agenda import ConflictoAgenda, Disponibilidad, guardar_visita, hora_a_slot, slot_a_hora
+from .geo import distancias_desde, indice_comunas
+from .models import Tecnico, VisitaTecnica
+
+
+# Pesos del puntaje: coincidencia de servicio > region habitual > carga y espera
+PESO_SERVICIO = 10
+PESO_ESPECIALIDAD = 5
+PESO_REGION = 4
+PESO_CARGA = 1
+PESO_ESPERA_DIA = 2
+# Penalizacion por km hasta la visita mas cercana que el tecnico ya tiene ese dia (tope en 50 km)
+PESO_DISTANCIA_KM = 0.1
+TOPE_DISTANCIA_KM = 50
+DIAS_BUSQUEDA = 14
+# Tecnico fijo por servicio: palabra clave del nombre del servicio -> slug del tecnico
+SERVICE_TECH_MAP = {}
+# Region habitual: visitas ya realizadas en los ultimos HISTORIAL_DIAS, agrupadas una vez por dia en la cache
+# compartida (como los KPIs de estadisticas); las reservas nuevas son futuras y no la cambian.
+# La version la incrementan las senales cuando se edita o elimina una visita pasada.
+HISTORIAL_DIAS = 365
+CLAVE_VERSION_REGIONES = "asignacion:regiones:version"
+TTL_REGIONES = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Asignacion:
+    tecnico: Tecnico
+    fecha: object
+    hora: object
+    puntaje: float
+    punto: tuple | None = None
+
+    @property
+    def tecnico_info(self):
+        t = self.tecnico
+        return {
+            "id": t.pk,
+            "slug": t.slug,
+            "nombre": f"{t.nombre} {t.apellido or ''}".strip(),
+            "especialidad": t.especialidad or (t.servicio.titulo if t.servicio_id else "Tecnico"),
+            "email": t.correo,
+        }
+
+
+class Asignador:
+    """
+    Elige tecnico y horario para visitas nuevas.
+    Todo se precarga al crear la instancia (tecnicos, disponibilidad, carga y ubicacion en la ventana;
+    la region habitual sale de la cache compartida), asi que asignar muchas cotizaciones en lote no
+    agrega consultas por visita: cada asignacion se descuenta en memoria de la disponibilidad y suma
+    a la carga del tecnico.
+    """
+
+    def __init__(self, desde=None, dias=DIAS_BUSQUEDA):
+        self.desde = desde or timezone.localdate() + timedelta(days=1)
+        self.hasta = self.desde + timedelta(days=dias - 1)
+        self.tecnicos = list(
+            Tecnico.objects.filter(activo=True, slug__isnull=False)
+            .select_related("servicio")
+            .order_by("nombre", "apellido", "id")
+        )
+        slugs = {t.pk: t.slug for t in self.tecnicos}
+        self.disponibilidad = Disponibilidad(self.desde, self.hasta, tecnicos=self.tecnicos)
+        # Carga y ubicacion aproximada (centroide de comuna) de las visitas ya agendadas en la ventana
+        self.indice = indice_comunas()
+        self.carga = Counter()
+        self.puntos = defaultdict(list)
+        agendadas = VisitaTecnica.objects.filter(
+            tecnico_id__in=list(slugs), fecha__gte=self.desde, fecha__lte=self.hasta
+        ).values_list("tecnico_id", "fecha", "comuna", "region")
+        for tecnico_id, fecha, comuna, region in agendadas:
+            self.carga[slugs[tecnico_id]] += 1
+            punto = self.indice.coordenadas(comuna, region)
+            if punto:
+                self.puntos[(slugs[tecnico_id], fecha)].append(punto)
+        habituales = regiones_habituales()
+        self.regiones = {t.slug: habituales.get(t.pk, {}) for t in self.tecnicos}
+        # Reservas hechas en memoria por este asignador, para reponerlas si se recarga la disponibilidad
+        self.reservas = []
+
+    def distancia_km(self, slug, fecha, punto):
+        """Km desde punto a la visita mas cercana del tecnico ese dia (None si no tiene visitas ubicables)."""
+        ocupados = self.puntos.get((slug, fecha))
+        if not (punto and ocupados):
+            return None
+        return min(distancias_desde(punto, ocupados))
+
+    def puntaje(self, tecnico, servicio=None, region=None) -> float:
+        puntos = 0.0
+        if servicio is not None:
+            if tecnico.servicio_id and tecnico.servicio_id == servicio.pk:
+                puntos += PESO_SERVICIO
+            elif tecnico.especialidad and servicio.titulo and servicio.titulo.lower() in tecnico.especialidad.lower():
+                puntos += PESO_ESPECIALIDAD
+        if region:
+            puntos += PESO_REGION * self.regiones.get(tecnico.slug, {}).get(region.strip().lower(), 0)
+        puntos -= PESO_CARGA * self.carga[tecnico.slug]
+        return puntos
+
+    def primer_horario(self, slug, fecha=None, hora=None):
+        """
+        Primer (fecha, hora) libre del tecnico. Si se indica hora se prefiere ese bloque en cada dia;
+        si se indica fecha solo se busca en ese dia.
+        """
+        dias = [fecha] if fecha else self.disponibilidad.dias()
+        preferido = hora_a_slot(hora) if hora else None
+        for dia in dias:
+            libres = self.disponibilidad.libres(slug, dia)
+            if not libres:
+                continue
+            if preferido is not None and libres >> preferido & 1:
+                return dia, slot_a_hora(preferido)
+            return dia, slot_a_hora((libres & -libres).bit_length() - 1)
+        return None
+
+    def asignar(self, servicio=None, region=None, comuna=None, fecha=None, hora=None, tecnicos=None):
+        """
+        Devuelve la mejor Asignacion (o None si nadie tiene horario) y la reserva en memoria.
+        tecnicos: slugs a los que restringir la busqueda (p. ej. un mapeo fijo por servicio).
+        """
+        punto = self.indice.coordenadas(comuna, region)
+        if fecha and not (self.desde <= fecha <= self.hasta):
+            # Fecha pedida fuera del rango precargado: se amplia la disponibilidad a ese dia
+            self.disponibilidad = Disponibilidad(min(self.desde, fecha), max(self.hasta, fecha), tecnicos=self.tecnicos)
+            self.desde, self.hasta = self.disponibilidad.desde, self.disponibilidad.hasta
+            for reserva in self.reservas:
+                self.disponibilidad.reservar(*reserva)
+        mejor, mejor_clave = None, None
+        for tecnico in self.tecnicos:
+            if tecnicos and tecnico.slug not in tecnicos:
+                continue
+            horario = self.primer_horario(tecnico.slug, fecha=fecha, hora=hora)
+            if not horario:
+                continue
+            espera = (horario[0] - self.desde).days
+            puntos = self.puntaje(tecnico, servicio, region) - PESO_ESPERA_DIA * espera
+            km = self.distancia_km(tecnico.slug, horario[0], punto)
+            if km is not None:
+                puntos -= PESO_DISTANCIA_KM * min(km, TOPE_DISTANCIA_KM)
+            # Mayor puntaje gana; a igual puntaje, el horario mas temprano
+            clave = (puntos, -espera, -horario[1].hour * 60 - horario[1].minute)
+            if mejor_clave is None or clave > mejor_clave:
+                mejor, mejor_clave = Asignacion(tecnico, horario[0], horario[1], puntos, punto), clave
+        if mejor:
+            self.disponibilidad.reservar(mejor.tecnico.slug, mejor.fecha, mejor.hora)
+            self.reservas.append((mejor.tecnico.slug, mejor.fecha, mejor.hora))
+            self.carga[mejor.tecnico.slug] += 1
+            if punto:
+                self.puntos[(mejor.tecnico.slug, mejor.fecha)].append(punto)
+        return mejor
+
+    def liberar(self, asignacion, conservar_horario=False):
+        """
+        Revierte en memoria una asignacion que no se pudo guardar, sin recargar la base de datos
+        (se perderian las reservas del lote aun no guardadas). Con conservar_horario=True el bloque
+        sigue marcado como ocupado: sirve cuando otra reserva concurrente lo tomo.
+        """
+        slug = asignacion.tecnico.slug
+        self.carga[slug] -= 1
+        reserva = (slug, asignacion.fecha, asignacion.hora)
+        if reserva in self.reservas:
+            self.reservas.remove(reserva)
+        if asignacion.punto and asignacion.punto in self.puntos.get((slug, asignacion.fecha), []):
+            self.puntos[(slug, asignacion.fecha)].remove(asignacion.punto)
+        if not conservar_horario:
+            self.disponibilidad.liberar(slug, asignacion.fecha, asignacion.hora)
+
+
+def calcular_regiones(hoy):
+    """Proporcion de visitas de cada tecnico (id) por region en los HISTORIAL_DIAS anteriores a hoy."""
+    conteos = defaultdict(Counter)
+    historial = (
+        VisitaTecnica.objects.filter(
+            tecnico__isnull=False,
+            fecha__gte=hoy - timedelta(days=HISTORIAL_DIAS),
+            fecha__lt=hoy,
+            region__isnull=False,
+        )
+        .exclude(region="")
+        .order_by()
+        .values("tecnico_id", "region")
+        .annotate(n=Count("id"))
+        .values_list("tecnico_id", "region", "n")
+    )
+    for tecnico_id, region, n in historial:
+        conteos[tecnico_id][region.strip().lower()] += n
+    return {
+        tecnico_id: {region: n / sum(regiones.values()) for region, n in regiones.items()}
+        for tecnico_id, regiones in conteos.items()
+    }
+
+
+def regiones_habituales():
+    hoy = timezone.localdate()
+    version = cache.get_or_set(CLAVE_VERSION_REGIONES, 1, None)
+    return cache.get_or_set(
+        f"asignacion:regiones:{version}:{hoy.isoformat()}", lambda: calcular_regiones(hoy), TTL_REGIONES
+    )
+
+
+def invalidar_regiones():
+    try:
+        cache.incr(CLAVE_VERSION_REGIONES)
+    except ValueError:
+        cache.set(CLAVE_VERSION_REGIONES, 2, None)
+
+
+def tecnico_fijo(servicio_nombre):
+    """Slug del tecnico fijo para el servicio segun SERVICE_TECH_MAP; None deja la eleccion al Asignador."""
+    norm = (servicio_nombre or "").strip().lower()
+    if norm:
+        for keyword, slug in SERVICE_TECH_MAP.items():
+            if keyword in norm and Tecnico.objects.filter(slug=slug, activo=True).exists():
+                return slug
+    return None
+
+
+def agendar_cotizacion(cot, fecha=None, hora=None, asignador=None, guardar=True):
+    """
+    Agenda la visita de una cotizacion con el tecnico mejor evaluado (servicio, carga y region)
+    en su primer horario libre, prefiriendo las 10:00. Retorna None si nadie tiene horario.
+    Con un asignador compartido se pueden agendar muchas cotizaciones en lote.
+    Con guardar=False retorna la visita sin guardar (simulacion con la misma eleccion de tecnico).
+    """
+    asignador = asignador or Asignador()
+    fijo = tecnico_fijo((cot.servicio.titulo if cot.servicio else cot.asunto) or "")
+    asignacion = asignador.asignar(
+        servicio=cot.servicio,
+        region=cot.region,
+        comuna=cot.comuna,
+        fecha=fecha,
+        hora=hora or time(10, 0),
+        tecnicos=[fijo] if fijo else None,
+    )
+    if not asignacion:
+        logger.warning("No se agendo visita para cotizacion %s: no hay tecnicos con horario libre", cot.id)
+        return None
+    tecnico = asignacion.tecnico
+    visita = VisitaTecnica(
+        tecnico=tecnico,
+        tecnico_slug=tecnico.slug,
+        tecnico_nombre=asignacion.tecnico_info["nombre"],
+        cliente=cot.usuario.get_full_name() or cot.usuario.username,
+        correo=cot.usuario.email,
+        region=cot.region,
+        comuna=cot.comuna,
+        fecha=asignacion.fecha,
+        hora=asignacion.hora,
+        direccion=cot.lugar_servicio or "-",
+        notas=(cot.mensaje or "").strip() or f"Cotizacion #{cot.id}",
+        cotizacion=cot,
+    )
+    if not guardar:
+        return visita
+    try:
+        # Lanza ConflictoAgenda si otra reserva tomo el horario entre la asignacion y el guardado
+        return guardar_visita(visita)
+    except ConflictoAgenda:
+        asignador.liberar(asignacion, conservar_horario=True)
+        logger.warning("No se agendo visita para cotizacion %s: el tecnico no tiene ese horario libre", cot.id)
+        return None
+
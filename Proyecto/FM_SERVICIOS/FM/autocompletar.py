@@ -0,0 +1,120 @@
+import threading
+from bisect import bisect_left
+
+from django.db import DatabaseError, connection
+
+from .catalogo import get_catalogo
+from .geo import normalizar_nombre
+
+
+# Indice ordenado de prefijos sobre el catalogo en memoria: (clave, rango, comuna, region).
+# Cada comuna entra con su nombre completo (rango 0) y desde cada palabra interna (rango 1),
+# asi "bernardo" encuentra "San Bernardo". Se reconstruye cuando cambia la version del catalogo.
+LIMITE = 10
+MIN_DIFUSO = 4  # con menos letras un error de tipeo calza con casi todo
+SIMILITUD_MINIMA = 0.3
+
+_indice = None
+_lock = threading.Lock()
+
+
+class _Indice:
+    def __init__(self, catalogo):
+        self.version = catalogo.version
+        entradas = set()
+        for region, comunas in catalogo.comunas.items():
+            for comuna in comunas:
+                palabras = comuna.split()
+                for i in range(len(palabras)):
+                    clave = normalizar_nombre(" ".join(palabras[i:]))
+                    if clave:
+                        entradas.add((clave, 0 if i == 0 else 1, comuna, region))
+        self.entradas = sorted(entradas)
+        self.claves = [e[0] for e in self.entradas]
+        self.por_inicial = {}
+        for entrada in self.entradas:
+            self.por_inicial.setdefault(entrada[0][0], []).append(entrada)
+
+
+def _get_indice():
+    global _indice
+    catalogo = get_catalogo()
+    indice = _indice
+    if indice is None or indice.version != catalogo.version:
+        with _lock:
+            if _indice is None or _indice.version != catalogo.version:
+                _indice = _Indice(catalogo)
+            indice = _indice
+    return indice
+
+
+def _prefijo_con_un_error(q, clave):
+    """True si q esta a una edicion (cambio, letra de mas/menos o dos letras invertidas) de un prefijo de clave."""
+    n = len(q)
+    i = 0
+    while i < n and i < len(clave) and q[i] == clave[i]:
+        i += 1
+    if i == n:
+        return True
+    largo = len(clave)
+    return (
+        (largo >= n and q[i + 1:] == clave[i + 1:n])  # letra cambiada
+        or (largo >= n - 1 and q[i + 1:] == clave[i:n - 1])  # letra de mas en q
+        or (largo > n and q[i:] == clave[i + 1:n + 1])  # letra omitida en q
+        or (largo >= n and i + 1 < n and q[i] == clave[i + 1] and q[i + 1] == clave[i] and q[i + 2:] == clave[i + 2:n])
+    )
+
+
+def _trigramas(q, region, limite):
+    # Respaldo en Postgres (pg_trgm) para errores que el indice no cubre, p. ej. dos letras cambiadas
+    if connection.vendor != "postgresql":
+        return []
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    from .models import Comuna
+
+    qs = Comuna.objects.annotate(similitud=TrigramSimilarity("nombre", q)).filter(similitud__gte=SIMILITUD_MINIMA)
+    if region:
+        qs = qs.filter(region__nombre=region)
+    try:
+        return list(qs.order_by("-similitud", "nombre").values_list("nombre", "region__nombre")[:limite])
+    except DatabaseError:
+        return []
+
+
+def buscar_comunas(q, region=None, limite=LIMITE):
+    """
+    Comunas cuyo nombre (sin tildes ni mayusculas) empieza con q, o alguna de sus palabras.
+    Si faltan resultados se toleran un error de tipeo y, en Postgres, la similitud por trigramas.
+    Retorna [(comuna, region)].
+    """
+    clave = normalizar_nombre(q)
+    if not clave:
+        return []
+    indice = _get_indice()
+    vistos, encontrados = set(), []
+
+    def agregar(entradas):
+        for _, rango, comuna, reg in sorted(entradas, key=lambda e: (e[1], e[2])):
+            if (comuna, reg) in vistos or (region and reg != region):
+                continue
+            vistos.add((comuna, reg))
+            encontrados.append((comuna, reg))
+
+    inicio = bisect_left(indice.claves, clave)
+    fin = inicio
+    while fin < len(indice.claves) and indice.claves[fin].startswith(clave):
+        fin += 1
+    agregar(indice.entradas[inicio:fin])
+
+    if len(encontrados) < limite and len(clave) >= MIN_DIFUSO:
+        candidatas = indice.por_inicial.get(clave[0], [])
+        difusas = [e for e in candidatas if _prefijo_con_un_error(clave, e[0])]
+        if not difusas:
+            # el error puede estar en la primera letra
+            difusas = [e for e in indice.entradas if _prefijo_con_un_error(clave, e[0])]
+        agregar(difusas)
+
+    if not encontrados and len(clave) >= MIN_DIFUSO:
+        encontrados = _trigramas(q.strip(), region, limite)
+    return encontrados[:limite]
@@ -0,0 +1,241 @@
+import re
+
+from django.core import signing
+from django.db import DatabaseError, connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Cotizacion, User
+from .paginacion import TAMANO, Pagina
+
+
+# Busqueda de texto completo en cotizaciones: asunto, cliente (nombre, usuario y correo), ubicacion
+# (lugar y comuna) y mensaje. En Postgres es la columna tsvector "busqueda" con indice GIN; en SQLite una
+# tabla FTS5 con rowid = id de la cotizacion. Ambas las crea la migracion 0028. La columna no esta en el
+# modelo: la mantienen triggers de la base de datos, asi que queryset.update(), bulk_create, loaddata y SQL
+# directo tambien reindexan. Las senales pre/post_migrate los quitan mientras corren migraciones de FM y
+# despues los reponen y reconstruyen el indice (lo que hayan escrito esas migraciones queda incluido).
+COLUMNA_PG = "busqueda"
+TABLA_FTS = "fm_cotizacion_fts"
+TRIGGER_COTIZACION = "fm_cotizacion_busqueda"
+TRIGGER_USUARIO = "fm_user_busqueda"
+SALT = "FM.busqueda"
+# Campos cuyo cambio dispara la reindexacion (UPDATE OF ... en los triggers)
+CAMPOS_COTIZACION = {"asunto", "mensaje", "lugar_servicio", "comuna", "usuario"}
+CAMPOS_USUARIO = {"first_name", "last_name", "username", "email"}
+# Pesos bm25 de SQLite por columna, en el mismo orden que la tabla FTS5
+PESOS_FTS = (4.0, 4.0, 2.0, 1.0)
+
+
+def _tablas(conexion=connection):
+    qn = conexion.ops.quote_name
+    return qn(Cotizacion._meta.db_table), qn(User._meta.db_table)
+
+
+def _sql_postgres(conexion, filtro):
+    cot, usuario = _tablas(conexion)
+    cliente = "concat_ws(' ', u.first_name, u.last_name, u.username, u.email)"
+    return (
+        f"UPDATE {cot} AS c SET {COLUMNA_PG} = "
+        "setweight(to_tsvector('spanish', coalesce(c.asunto, '')), 'A') || "
+        f"setweight(to_tsvector('simple', {cliente}), 'A') || "
+        "setweight(to_tsvector('spanish', concat_ws(' ', c.lugar_servicio, c.comuna)), 'B') || "
+        "setweight(to_tsvector('spanish', coalesce(c.mensaje, '')), 'C') "
+        f"FROM {usuario} AS u WHERE u.id = c.usuario_id{filtro}"
+    )
+
+
+def _sql_sqlite(conexion, filtro):
+    cot, usuario = _tablas(conexion)
+    return (
+        f"INSERT INTO {TABLA_FTS} (rowid, asunto, cliente, ubicacion, mensaje) "
+        "SELECT c.id, coalesce(c.asunto, ''), "
+        "coalesce(u.first_name, '') || ' ' || coalesce(u.last_name, '') || ' ' || u.username || ' ' || coalesce(u.email, ''), "
+        "coalesce(c.lugar_servicio, '') || ' ' || coalesce(c.comuna, ''), coalesce(c.mensaje, '') "
+        f"FROM {cot} AS c JOIN {usuario} AS u ON u.id = c.usuario_id WHERE 1 = 1{filtro}"
+    )
+
+
+def indexar(ids=None, conexion=connection):
+    """Recalcula el indice de las cotizaciones ids (todas si ids es None)."""
+    if ids is not None:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return
+    marcas = ", ".join(["%s"] * len(ids)) if ids is not None else ""
+    filtro = f" AND c.id IN ({marcas})" if ids is not None else ""
+    with conexion.cursor() as cur:
+        if conexion.vendor == "postgresql":
+            cur.execute(_sql_postgres(conexion, filtro), ids or [])
+        elif conexion.vendor == "sqlite":
+            if ids is None:
+                cur.execute(f"DELETE FROM {TABLA_FTS}")
+            else:
+                cur.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid IN ({marcas})", ids)
+            cur.execute(_sql_sqlite(conexion, filtro), ids or [])
+
+
+def _columnas(modelo, campos):
+    return ", ".join(sorted(modelo._meta.get_field(c).column for c in campos))
+
+
+def _triggers_postgres(conexion):
+    cot, usuario = _tablas(conexion)
+    sentencias = []
+    for nombre, tabla, campos, filtro in (
+        (TRIGGER_COTIZACION, cot, _columnas(Cotizacion, CAMPOS_COTIZACION), " AND c.id = NEW.id"),
+        (TRIGGER_USUARIO, usuario, _columnas(User, CAMPOS_USUARIO), " AND u.id = NEW.id"),
+    ):
+        # AFTER: el UPDATE solo toca la columna del indice, que no esta en UPDATE OF, asi que no se re-dispara
+        eventos = f"INSERT OR UPDATE OF {campos}" if nombre == TRIGGER_COTIZACION else f"UPDATE OF {campos}"
+        sentencias += [
+            f"CREATE OR REPLACE FUNCTION {nombre}() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN {_sql_postgres(conexion, filtro)}; RETURN NULL; END $$",
+            f"DROP TRIGGER IF EXISTS {nombre} ON {tabla}",
+            f"CREATE TRIGGER {nombre} AFTER {eventos} ON {tabla} FOR EACH ROW EXECUTE FUNCTION {nombre}()",
+        ]
+    return sentencias
+
+
+def _triggers_sqlite(conexion):
+    cot, usuario = _tablas(conexion)
+    columnas_cot, columnas_usuario = _columnas(Cotizacion, CAMPOS_COTIZACION), _columnas(User, CAMPOS_USUARIO)
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_COTIZACION}_ai AFTER INSERT ON {cot} BEGIN "
+        f"{_sql_sqlite(conexion, ' AND c.id = NEW.id')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_COTIZACION}_au AFTER UPDATE OF {columnas_cot} ON {cot} BEGIN "
+        f"DELETE FROM {TABLA_FTS} WHERE rowid = OLD.id; {_sql_sqlite(conexion, ' AND c.id = NEW.id')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_COTIZACION}_ad AFTER DELETE ON {cot} BEGIN "
+        f"DELETE FROM {TABLA_FTS} WHERE rowid = OLD.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {TRIGGER_USUARIO}_au AFTER UPDATE OF {columnas_usuario} ON {usuario} BEGIN "
+        f"DELETE FROM {TABLA_FTS} WHERE rowid IN (SELECT id FROM {cot} WHERE usuario_id = NEW.id); "
+        f"{_sql_sqlite(conexion, ' AND c.usuario_id = NEW.id')}; END",
+    ]
+
+
+def _existe_indice(conexion, tablas):
+    if conexion.vendor == "postgresql":
+        with conexion.cursor() as cur:
+            columnas = {c.name for c in conexion.introspection.get_table_description(cur, Cotizacion._meta.db_table)}
+        return COLUMNA_PG in columnas
+    return TABLA_FTS in tablas
+
+
+def _tablas_presentes(conexion):
+    tablas = conexion.introspection.table_names()
+    if Cotizacion._meta.db_table in tablas and User._meta.db_table in tablas:
+        return tablas
+    return None
+
+
+def quitar_triggers(conexion=connection):
+    """
+    Quita los triggers del indice. Se llama antes de migrar: en SQLite rehacer FM_cotizacion o FM_user
+    (cualquier AlterField) falla mientras haya triggers que nombren esas tablas.
+    """
+    if conexion.vendor not in ("postgresql", "sqlite") or _tablas_presentes(conexion) is None:
+        return
+    cot, usuario = _tablas(conexion)
+    if conexion.vendor == "postgresql":
+        sentencias = [
+            f"DROP TRIGGER IF EXISTS {TRIGGER_COTIZACION} ON {cot}",
+            f"DROP TRIGGER IF EXISTS {TRIGGER_USUARIO} ON {usuario}",
+            f"DROP FUNCTION IF EXISTS {TRIGGER_COTIZACION}()",
+            f"DROP FUNCTION IF EXISTS {TRIGGER_USUARIO}()",
+        ]
+    else:
+        nombres = (f"{TRIGGER_COTIZACION}_ai", f"{TRIGGER_COTIZACION}_au", f"{TRIGGER_COTIZACION}_ad", f"{TRIGGER_USUARIO}_au")
+        sentencias = [f"DROP TRIGGER IF EXISTS {nombre}" for nombre in nombres]
+    with conexion.cursor() as cur:
+        for sql in sentencias:
+            cur.execute(sql)
+
+
+def instalar_triggers(conexion=connection):
+    """
+    Crea (o repone) los triggers que mantienen el indice y retorna True. Si el indice no existe
+    (migracion 0028 pendiente o revertida) no instala nada y retorna False.
+    """
+    if conexion.vendor not in ("postgresql", "sqlite"):
+        return False
+    tablas = _tablas_presentes(conexion)
+    if tablas is None or not _existe_indice(conexion, tablas):
+        return False
+    sentencias = _triggers_postgres(conexion) if conexion.vendor == "postgresql" else _triggers_sqlite(conexion)
+    with conexion.cursor() as cur:
+        for sql in sentencias:
+            cur.execute(sql)
+    return True
+
+
+def _consulta_fts(q):
+    # Cada palabra entre comillas (sin sintaxis FTS5 del usuario) y como prefijo: "calde" encuentra "calderas"
+    palabras = re.findall(r"\w+", q)
+    return " ".join(f'"{p}"*' for p in palabras)
+
+
+def buscar(queryset, q):
+    """
+    Filtra queryset a las cotizaciones que calzan con q y las anota con "rango" (mayor es mejor), sin ordenar.
+    Sin motor de texto completo cae a icontains sobre los mismos campos con rango 0.
+    """
+    q = (q or "").strip()
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+
+        consulta = SearchQuery(q, config="spanish", search_type="websearch") | SearchQuery(
+            q, config="simple", search_type="websearch"
+        )
+        vector = RawSQL(f"{_tablas()[0]}.{COLUMNA_PG}", [], output_field=SearchVectorField())
+        return queryset.annotate(_vector=vector).filter(_vector=consulta).annotate(rango=SearchRank(F("_vector"), consulta))
+    if connection.vendor == "sqlite":
+        expresion = _consulta_fts(q)
+        if not expresion:
+            return queryset.none()
+        coincidencias = RawSQL(f"SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s", [expresion])
+        pesos = ", ".join(str(p) for p in PESOS_FTS)
+        # bm25 es menor mientras mejor: se niega para que "rango" ordene igual que en Postgres
+        rango = RawSQL(
+            f"(SELECT -bm25({TABLA_FTS}, {pesos}) FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s AND rowid = {_tablas()[0]}.id)",
+            [expresion],
+        )
+        return queryset.filter(pk__in=coincidencias).annotate(rango=rango)
+    filtro = Q()
+    for campo in ("asunto", "mensaje", "lugar_servicio", "comuna", "usuario__username", "usuario__email", "usuario__first_name", "usuario__last_name"):
+        filtro |= Q(**{f"{campo}__icontains": q})
+    return queryset.filter(filtro).annotate(rango=Value(0.0, output_field=FloatField()))
+
+
+def _cursor(q, desde):
+    return signing.dumps([q, desde], salt=SALT, compress=True)
+
+
+def _desde(cursor, q):
+    try:
+        consulta, desde = signing.loads(cursor, salt=SALT)
+    except Exception:
+        return 0  # cursor invalido o manipulado: primera pagina
+    if consulta != q or not isinstance(desde, int) or desde < 0:
+        return 0
+    return desde
+
+
+def pagina_busqueda(queryset, q, cursor="", tamano=TAMANO):
+    """
+    Una pagina de las cotizaciones que calzan con q, de la mas relevante a la menos (empates por mas reciente).
+    El rango no tiene indice para paginar por cursor de valores: el cursor firmado guarda el desplazamiento.
+    """
+    desde = _desde(cursor, q) if cursor else 0
+    try:
+        filas = list(buscar(queryset, q).order_by("-rango", "-pk")[desde : desde + tamano + 1])
+    except DatabaseError:
+        # Indice aun no creado (migracion pendiente) o consulta invalida para el motor
+        return Pagina()
+    if not filas and desde:
+        return pagina_busqueda(queryset, q, tamano=tamano)
+    items = filas[:tamano]
+    return Pagina(
+        items=items,
+        siguiente=_cursor(q, desde + tamano) if len(filas) > tamano else "",
+        anterior=_cursor(q, max(0, desde - tamano)) if desde else "",
+    )
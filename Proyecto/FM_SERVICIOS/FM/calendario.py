@@ -0,0 +1,96 @@
+import calendar
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .agenda import Disponibilidad
+from .models import Tecnico, VisitaEliminada, VisitaTecnica
+
+
+# El cursor se retrocede unos segundos: una transaccion puede confirmar despues de haber
+# fijado su actualizado_en, y el cliente aplica los cambios repetidos sin efecto
+MARGEN_CURSOR = timedelta(seconds=5)
+# Registros de borrado que se conservan; un cursor mas antiguo obliga a una carga completa
+RETENCION_ELIMINADAS = timedelta(days=30)
+
+
+def rango_mes(primer_dia):
+    _, ultimo = calendar.monthrange(primer_dia.year, primer_dia.month)
+    return primer_dia, primer_dia.replace(day=ultimo)
+
+
+def registrar_eliminacion(visita):
+    ahora = timezone.now()
+    VisitaEliminada.objects.create(
+        visita_id=visita.pk, tecnico_slug=visita.tecnico_slug or "", fecha=visita.fecha, eliminado_en=ahora
+    )
+    VisitaEliminada.objects.filter(eliminado_en__lt=ahora - RETENCION_ELIMINADAS).delete()
+
+
+def visita_json(v):
+    cot = v.cotizacion if v.cotizacion_id else None
+    return {
+        "id": v.pk,
+        "fecha": v.fecha.isoformat(),
+        "hora": v.hora.strftime("%H:%M") if v.hora else None,
+        "tecnico": v.tecnico_slug,
+        "tecnico_nombre": v.tecnico_nombre or "",
+        "cliente": v.cliente,
+        "servicio": cot.servicio.titulo if cot is not None and cot.servicio_id else "",
+        "region": (cot.region if cot is not None else None) or v.region or "",
+        "comuna": (cot.comuna if cot is not None else None) or v.comuna or "",
+    }
+
+
+def _disponibilidad(desde, hasta, tecnico):
+    activos = list(Tecnico.objects.filter(activo=True).order_by("nombre", "apellido", "id"))
+    disp = Disponibilidad(desde, hasta, tecnicos=[t for t in activos if not tecnico or t.slug == tecnico])
+    return len(activos), {
+        dia.isoformat(): {
+            "tecnicos_libres": disp.tecnicos_libres(dia),
+            "ventanas": [[a.strftime("%H:%M"), b.strftime("%H:%M")] for a, b in disp.ventanas(tecnico, dia)]
+            if tecnico
+            else [],
+        }
+        for dia in disp.dias()
+    }
+
+
+def datos_calendario(desde, hasta, tecnico=None, since=None):
+    """
+    Visitas del rango [desde, hasta] (opcionalmente de un tecnico) para el calendario.
+    Sin since: carga completa. Con since (el cursor de la respuesta anterior): solo las visitas
+    creadas o modificadas desde entonces y los ids que el cliente debe quitar (borradas, o que
+    salieron del rango o del filtro). La disponibilidad se recalcula solo si hubo cambios.
+    """
+    cursor = timezone.now()
+    completo = since is None or since < cursor - RETENCION_ELIMINADAS
+    base = VisitaTecnica.objects.select_related("cotizacion", "cotizacion__servicio")
+    visitas, eliminadas = [], []
+    if completo:
+        qs = base.filter(fecha__gte=desde, fecha__lte=hasta)
+        if tecnico:
+            qs = qs.filter(tecnico__slug=tecnico)
+        visitas = [visita_json(v) for v in qs.order_by("fecha", "hora", "id")]
+    else:
+        desde_cursor = since - MARGEN_CURSOR
+        for v in base.filter(actualizado_en__gte=desde_cursor).order_by("fecha", "hora", "id"):
+            if desde <= v.fecha <= hasta and (not tecnico or v.tecnico_slug == tecnico):
+                visitas.append(visita_json(v))
+            else:
+                eliminadas.append(v.pk)
+        eliminadas += list(
+            VisitaEliminada.objects.filter(eliminado_en__gte=desde_cursor).values_list("visita_id", flat=True)
+        )
+    total, disponibilidad = _disponibilidad(desde, hasta, tecnico) if completo or visitas or eliminadas else (None, None)
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "tecnico": tecnico or "",
+        "cursor": cursor.isoformat(),
+        "completo": completo,
+        "visitas": visitas,
+        "eliminadas": eliminadas,
+        "disponibilidad": disponibilidad,
+        "tecnicos_total": total,
+    }
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from .models import Comuna, Region
+
+
+# Catalogo de regiones/comunas en memoria del proceso. La version vive en la cache compartida (settings.CACHES,
+# Redis o tabla de la base): al guardar una Region o Comuna se incrementa y cada worker reconstruye su copia
+# en el siguiente acceso.
+CLAVE_VERSION = "catalogo:version"
+OPCION_REGION = ("", "Selecciona region")
+OPCION_COMUNA = ("", "Selecciona comuna")
+
+# Copia estatica del catalogo: la genera exportar_catalogo() antes de collectstatic y la storage de
+# WhiteNoise la publica con hash en el nombre (cache inmutable en el navegador)
+RUTA_ESTATICA = "FM/generado/regiones.json"
+DIR_ESTATICO = Path(__file__).resolve().parent / "static"
+
+_catalogo = None
+_lock = threading.Lock()
+_urls = {}
+
+
+@dataclass(frozen=True)
+class Catalogo:
+    version: int
+    regiones: tuple
+    comunas: dict  # region -> tupla de comunas ordenadas
+    json: str  # {region: [comunas]} ya serializado para los selects dependientes
+    region_choices: tuple
+    desde_bd: bool
+
+    def comunas_de(self, region):
+        return self.comunas.get(region or "", ())
+
+    def comuna_choices(self, region):
+        return [OPCION_COMUNA] + [(c, c) for c in self.comunas_de(region)]
+
+    @property
+    def firma(self):
+        # Mismo criterio que ManifestStaticFilesStorage para el hash del nombre
+        return hashlib.md5(self.json.encode()).hexdigest()[:12]
+
+
+def _catalogo_desde(version, comunas, desde_bd):
+    return Catalogo(
+        version=version,
+        regiones=tuple(comunas),
+        comunas=comunas,
+        json=json.dumps({r: list(c) for r, c in comunas.items()}),
+        region_choices=(OPCION_REGION,) + tuple((r, r) for r in comunas),
+        desde_bd=desde_bd,
+    )
+
+
+def _estatico(version):
+    from .forms import CHILE_REGIONES_DICT
+
+    return _catalogo_desde(version, {r: tuple(c) for r, c in CHILE_REGIONES_DICT.items()}, False)
+
+
+def _construir(version):
+    from .forms import CHILE_REGIONES_DICT
+
+    nombres = list(Region.objects.order_by("nombre").values_list("nombre", flat=True))
+    if not nombres:
+        return _estatico(version)
+    por_region = {nombre: [] for nombre in nombres}
+    for region, comuna in Comuna.objects.order_by("region__nombre", "nombre").values_list("region__nombre", "nombre"):
+        por_region[region].append(comuna)
+    # Una region cargada sin comunas usa la lista estatica, como hacia ContactoForm
+    return _catalogo_desde(version, {r: tuple(c or CHILE_REGIONES_DICT.get(r, ())) for r, c in por_region.items()}, True)
+
+
+def _version():
+    return cache.get_or_set(CLAVE_VERSION, 1, None)
+
+
+def get_catalogo():
+    """Catalogo vigente; consulta la BD solo la primera vez y despues de cada invalidacion."""
+    global _catalogo
+    try:
+        version = _version()
+    except DatabaseError:
+        # Cache en la base aun sin crear (p. ej. collectstatic antes de migrate)
+        return _estatico(0)
+    catalogo = _catalogo
+    if catalogo is not None and catalogo.version == version:
+        return catalogo
+    with _lock:
+        if _catalogo is None or _catalogo.version != version:
+            try:
+                _catalogo = _construir(version)
+            except DatabaseError:
+                # Tablas aun sin migrar: se sirve la lista estatica sin guardarla para reintentar luego
+                return _estatico(version)
+        return _catalogo
+
+
+def invalidar_catalogo():
+    global _catalogo
+    _catalogo = None
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.set(CLAVE_VERSION, 2, None)
+
+
+def exportar_catalogo():
+    """Escribe el catalogo vigente en FM/static/FM/generado/ para que collectstatic lo publique con hash."""
+    destino = DIR_ESTATICO / RUTA_ESTATICA
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    destino.write_text(get_catalogo().json, encoding="utf-8")
+    return destino
+
+
+def _url_vigente(catalogo):
+    from django.contrib.staticfiles import finders
+    from django.contrib.staticfiles.storage import staticfiles_storage
+
+    if not settings.DEBUG and hasattr(staticfiles_storage, "stored_name"):
+        try:
+            publicado = staticfiles_storage.stored_name(RUTA_ESTATICA)
+        except ValueError:
+            return None
+        vigente = f".{catalogo.firma}." in publicado
+    else:
+        ruta = finders.find(RUTA_ESTATICA)
+        vigente = bool(ruta) and hashlib.md5(Path(ruta).read_bytes()).hexdigest()[:12] == catalogo.firma
+    return staticfiles_storage.url(RUTA_ESTATICA) if vigente else None
+
+
+def url_catalogo(catalogo=None):
+    """
+    URL del JSON estatico si coincide con el catalogo vigente; None si no se ha exportado o quedo
+    desactualizado (se edito una region despues del ultimo collectstatic) y hay que incrustarlo en la pagina.
+    """
+    catalogo = catalogo or get_catalogo()
+    if catalogo.version not in _urls:
+        _urls.clear()
+        _urls[catalogo.version] = _url_vigente(catalogo)
+    return _urls[catalogo.version]
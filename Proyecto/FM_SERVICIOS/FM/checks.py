@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# Backends que guardan los datos dentro de cada proceso: las versiones de cache no se comparten entre workers
+CACHES_POR_PROCESO = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches, deploy=False)
+def cache_compartida(app_configs, **kwargs):
+    """Catalogo, cobertura, estadisticas y demas invalidan por version: requieren una cache comun a todos los workers."""
+    backend = settings.CACHES.get("default", {}).get("BACKEND", "")
+    if backend not in CACHES_POR_PROCESO:
+        return []
+    mensaje = f"La cache por defecto ({backend}) no se comparte entre procesos."
+    ayuda = "Usa DatabaseCache o RedisCache (FM_CACHE_URL): las invalidaciones de un worker no llegan a los demas."
+    if settings.DEBUG:
+        return [Warning(mensaje, hint=ayuda, id="FM.W001")]
+    return [Error(mensaje, hint=ayuda, id="FM.E001")]
@@ -0,0 +1,60 @@
+import threading
+
+from django.core.cache import cache
+
+from .geo import normalizar_nombre
+from .models import Cobertura
+
+
+# Reglas de cobertura en memoria: (region, comuna, servicio_id | None) -> (cubierta, motivo), con nombres
+# normalizados. Misma invalidacion que el catalogo: version en la cache compartida, copia por proceso.
+CLAVE_VERSION = "cobertura:version"
+
+_reglas = None
+_version_cargada = None
+_lock = threading.Lock()
+
+
+def _cargar():
+    filas = Cobertura.objects.values_list("comuna__region__nombre", "comuna__nombre", "servicio_id", "cubierta", "motivo")
+    return {
+        (normalizar_nombre(region), normalizar_nombre(comuna), servicio_id): (cubierta, motivo)
+        for region, comuna, servicio_id, cubierta, motivo in filas
+    }
+
+
+def _get_reglas():
+    global _reglas, _version_cargada
+    version = cache.get_or_set(CLAVE_VERSION, 1, None)
+    if _reglas is None or _version_cargada != version:
+        with _lock:
+            if _reglas is None or _version_cargada != version:
+                _reglas, _version_cargada = _cargar(), version
+    return _reglas
+
+
+def invalidar_cobertura():
+    global _reglas
+    _reglas = None
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.set(CLAVE_VERSION, 2, None)
+
+
+def fuera_de_cobertura(region, comuna, servicio=None):
+    """
+    Motivo de rechazo si la comuna no se atiende (para ese servicio), o None si hay cobertura.
+    La regla del servicio especifico manda sobre la general de la comuna.
+    """
+    if not comuna:
+        return None
+    reglas = _get_reglas()
+    clave = (normalizar_nombre(region), normalizar_nombre(comuna))
+    servicio_id = getattr(servicio, "pk", servicio)
+    regla = reglas.get(clave + (servicio_id,)) if servicio_id else None
+    if regla is None:
+        regla = reglas.get(clave + (None,))
+    if regla is None or regla[0]:
+        return None
+    return regla[1] or f"No contamos con cobertura en {comuna}."
@@ -0,0 +1,127 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Cotizacion, Documento, Servicio, User, VisitaTecnica
+
+
+# Contadores del panel de administracion: una consulta agregada por tabla, cacheados hasta que
+# una senal de User/Servicio/Documento/Cotizacion los invalida (TTL solo como red de seguridad).
+CLAVE_STATS = "dashboard:stats"
+TTL_STATS = 15 * 60
+
+# KPIs de visitas de todos los tecnicos en una sola consulta agrupada. La clave lleva la fecha (hoy/proximas
+# cambian a medianoche) y una version que incrementan las senales de VisitaTecnica y Cotizacion.
+CLAVE_VERSION_KPIS = "tecnicos:kpis:version"
+TTL_KPIS = 24 * 60 * 60
+KPIS_VACIOS = {
+    "total": 0, "hoy": 0, "proximas": 0, "pendientes": 0, "aceptadas": 0, "proceso_pago": 0, "completadas": 0,
+}
+
+
+def _conteos_aproximados(modelos):
+    """
+    En Postgres, filas estimadas (pg_class.reltuples) de las tablas que superan
+    settings.FM_DASHBOARD_CONTEO_APROXIMADO; COUNT(*) exacto en tablas enormes recorre todo el indice.
+    """
+    umbral = getattr(settings, "FM_DASHBOARD_CONTEO_APROXIMADO", 0)
+    if not umbral or connection.vendor != "postgresql":
+        return {}
+    tablas = {m._meta.db_table: m for m in modelos}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r' AND relname = ANY(%s)",
+                [list(tablas)],
+            )
+            filas = cursor.fetchall()
+    except DatabaseError:
+        return {}
+    return {tablas[nombre]: total for nombre, total in filas if total >= umbral}
+
+
+def _agregar(modelo, aproximados, total, **filtrados):
+    conteos = {clave: Count("pk", filter=filtro) for clave, filtro in filtrados.items()}
+    if modelo in aproximados:
+        datos = modelo.objects.aggregate(**conteos) if conteos else {}
+        datos[total] = aproximados[modelo]
+        return datos
+    return modelo.objects.aggregate(**{total: Count("pk")}, **conteos)
+
+
+def calcular_stats():
+    aproximados = _conteos_aproximados([User, Servicio, Documento, Cotizacion])
+    stats = {}
+    stats.update(_agregar(User, aproximados, "usuarios", clientes=Q(rol=User.Rol.CLIENTE)))
+    stats.update(_agregar(Servicio, aproximados, "servicios"))
+    stats.update(_agregar(Documento, aproximados, "documentos"))
+    stats.update(
+        _agregar(
+            Cotizacion, aproximados, "cotizaciones", cotizaciones_pendientes=Q(estado=Cotizacion.Estado.PENDIENTE)
+        )
+    )
+    stats["aproximado"] = bool(aproximados)
+    return stats
+
+
+def _cargar():
+    stats = calcular_stats()
+    etag = hashlib.md5(json.dumps(stats, sort_keys=True).encode()).hexdigest()
+    return {"stats": stats, "etag": etag}
+
+
+def stats_dashboard():
+    """(stats, etag) desde la cache; se recalculan solo tras un cambio o al vencer el TTL."""
+    entrada = cache.get_or_set(CLAVE_STATS, _cargar, TTL_STATS)
+    return entrada["stats"], entrada["etag"]
+
+
+def refrescar_stats():
+    """Recalcula sin leer la cache y guarda el resultado: pisa un valor viejo que otro proceso haya guardado tarde."""
+    entrada = _cargar()
+    cache.set(CLAVE_STATS, entrada, TTL_STATS)
+    return entrada["stats"], entrada["etag"]
+
+
+def invalidar_stats():
+    cache.delete(CLAVE_STATS)
+
+
+def calcular_kpis_tecnicos(hoy=None):
+    """{tecnico_id: {total, hoy, proximas, pendientes, aceptadas, proceso_pago, completadas}} en un solo GROUP BY."""
+    hoy = hoy or timezone.localdate()
+    estado = "cotizacion__estado"
+    filas = (
+        VisitaTecnica.objects.filter(tecnico__isnull=False)
+        .values("tecnico_id")
+        .annotate(
+            total=Count("pk"),
+            hoy=Count("pk", filter=Q(fecha=hoy)),
+            proximas=Count("pk", filter=Q(fecha__gte=hoy)),
+            pendientes=Count("pk", filter=Q(**{estado: Cotizacion.Estado.PENDIENTE})),
+            aceptadas=Count("pk", filter=Q(**{estado: Cotizacion.Estado.ACEPTADA})),
+            proceso_pago=Count("pk", filter=Q(**{estado: Cotizacion.Estado.PROCESO_PAGO})),
+            completadas=Count("pk", filter=Q(**{estado: Cotizacion.Estado.COMPLETADA})),
+        )
+        .order_by()
+    )
+    return {f.pop("tecnico_id"): f for f in filas}
+
+
+def kpis_tecnicos():
+    """KPIs de todos los tecnicos desde la cache; un tecnico sin visitas no aparece (usar KPIS_VACIOS)."""
+    hoy = timezone.localdate()
+    version = cache.get_or_set(CLAVE_VERSION_KPIS, 1, None)
+    return cache.get_or_set(f"tecnicos:kpis:{version}:{hoy.isoformat()}", lambda: calcular_kpis_tecnicos(hoy), TTL_KPIS)
+
+
+def invalidar_kpis():
+    try:
+        cache.incr(CLAVE_VERSION_KPIS)
+    except ValueError:
+        cache.set(CLAVE_VERSION_KPIS, 2, None)
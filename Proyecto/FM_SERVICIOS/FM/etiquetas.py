@@ -0,0 +1,72 @@
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Documento, Etiqueta
+
+
+# Etiquetas de documentos normalizadas en la tabla Etiqueta (clave en minusculas, unica) y enlazadas por M2M.
+# Documento.tags sigue siendo el texto que se edita; las senales lo sincronizan con Documento.etiquetas.
+SEPARADOR = ","
+PREFIJO = "*"  # "pag*" filtra por prefijo; sin asterisco la etiqueta debe ser exacta
+CLAVE_VERSION_NUBE = "etiquetas:nube:version"
+TTL_NUBE = 60 * 60
+LIMITE_NUBE = 40
+
+
+def separar(raw):
+    """Etiquetas de raw sin vacias ni repetidas (sin distinguir mayusculas), en el orden escrito."""
+    etiquetas = []
+    for chunk in (raw or "").split(SEPARADOR):
+        limpia = chunk.strip()
+        if limpia and limpia.lower() not in [e.lower() for e in etiquetas]:
+            etiquetas.append(limpia)
+    return etiquetas
+
+
+def sincronizar(doc):
+    """Deja doc.etiquetas igual a las de doc.tags, creando las etiquetas nuevas."""
+    nombres = {n.lower(): n for n in separar(doc.tags)}
+    existentes = {e.clave: e for e in Etiqueta.objects.filter(clave__in=nombres)}
+    nuevas = [Etiqueta(clave=clave, nombre=nombre) for clave, nombre in nombres.items() if clave not in existentes]
+    if nuevas:
+        Etiqueta.objects.bulk_create(nuevas, ignore_conflicts=True)
+        existentes = {e.clave: e for e in Etiqueta.objects.filter(clave__in=nombres)}
+    doc.etiquetas.set(existentes.values())
+
+
+def filtrar(documentos, texto):
+    """Documentos con la etiqueta texto (exacta, o por prefijo si termina en PREFIJO)."""
+    clave = (texto or "").strip().lower()
+    prefijo = clave.endswith(PREFIJO)
+    clave = clave.rstrip(PREFIJO).strip()
+    if not clave:
+        return documentos
+    enlaces = Documento.etiquetas.through.objects
+    enlaces = enlaces.filter(etiqueta__clave__startswith=clave) if prefijo else enlaces.filter(etiqueta__clave=clave)
+    return documentos.filter(pk__in=enlaces.values("documento_id"))
+
+
+def calcular_nube(usuario_id=None):
+    enlaces = Documento.etiquetas.through.objects.all()
+    if usuario_id is not None:
+        enlaces = enlaces.filter(documento__subido_por_id=usuario_id)
+    filas = (
+        enlaces.values("etiqueta__clave", "etiqueta__nombre")
+        .annotate(cantidad=Count("documento_id"))
+        .order_by("-cantidad", "etiqueta__clave")[:LIMITE_NUBE]
+    )
+    return [{"clave": f["etiqueta__clave"], "nombre": f["etiqueta__nombre"], "cantidad": f["cantidad"]} for f in filas]
+
+
+def nube_etiquetas(usuario_id=None):
+    """Etiquetas mas usadas con su cantidad de documentos (de todos, o solo los subidos por usuario_id)."""
+    version = cache.get_or_set(CLAVE_VERSION_NUBE, 1, None)
+    alcance = "todos" if usuario_id is None else usuario_id
+    return cache.get_or_set(f"etiquetas:nube:{version}:{alcance}", lambda: calcular_nube(usuario_id), TTL_NUBE)
+
+
+def invalidar_nube():
+    try:
+        cache.incr(CLAVE_VERSION_NUBE)
+    except ValueError:
+        cache.set(CLAVE_VERSION_NUBE, 2, None)
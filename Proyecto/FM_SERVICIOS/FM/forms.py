@@ -5,7 +5,9 @@ from django.core.exceptions import ValidationError
 from django.db.models import Q
 import re
 
-from .models import User, Cotizacion, ContactoWeb, Documento, Servicio, Region, Comuna
+from .catalogo import get_catalogo
+from .cobertura import fuera_de_cobertura
+from .models import User, Cotizacion, ContactoWeb, Documento, Servicio
 
 CHILE_REGIONES = [
     ("Arica y Parinacota", ["Arica", "Camarones", "Putre", "General Lagos"]),
@@ -289,40 +291,28 @@ class ContactoForm(forms.ModelForm):
             else:
                 field.widget.attrs.update({"class": "form-control"})
         services = Servicio.objects.filter(publicado=True).order_by("orden", "titulo")
+        self._servicio_ids = {s.titulo.lower(): s.pk for s in services}
         service_choices = [("", "Selecciona un servicio")] + [(s.titulo, s.titulo) for s in services]
         self.fields["tipo_servicio"].widget = forms.Select(choices=service_choices)
         self.fields["tipo_servicio"].widget.attrs.update({"class": "form-select"})
 
+        catalogo = get_catalogo()
         region_field = self.fields["region"]
-        try:
-            regiones_db = list(Region.objects.all().order_by("nombre"))
-        except Exception:
-            regiones_db = []
-        if regiones_db:
-            region_choices = [("", "Selecciona region")] + [(r.nombre, r.nombre) for r in regiones_db]
-        else:
-            region_choices = [("", "Selecciona region")] + [(r, r) for r, _ in CHILE_REGIONES]
-        region_field.choices = region_choices
-        region_field.widget = forms.Select(choices=region_choices)
+        region_field.choices = catalogo.region_choices
+        region_field.widget = forms.Select(choices=catalogo.region_choices)
         region_field.widget.attrs.update({"class": "form-select"})
 
         comuna_field = self.fields["comuna"]
         selected_region = self.data.get("region") or self.initial.get("region")
-        comunas = []
-        if selected_region and regiones_db:
-            try:
-                region_obj = next((r for r in regiones_db if r.nombre == selected_region), None)
-                if region_obj:
-                    comunas = list(Comuna.objects.filter(region=region_obj).order_by("nombre").values_list("nombre", flat=True))
-            except Exception:
-                comunas = []
-        if not comunas:
-            comunas = CHILE_REGIONES_DICT.get(selected_region, [])
-        comuna_choices = [("", "Selecciona comuna")] + [(c, c) for c in comunas]
+        comuna_choices = catalogo.comuna_choices(selected_region)
         comuna_field.choices = comuna_choices
         comuna_field.widget = forms.Select(choices=comuna_choices)
         comuna_field.widget.attrs.update(
-            {"class": "form-select", "data-initial": self.data.get("comuna") or self.initial.get("comuna") or ""}
+            {
+                "class": "form-select",
+                "data-initial": self.data.get("comuna") or self.initial.get("comuna") or "",
+                "data-autocompletar": "id_region",
+            }
         )
 
         self.fields["lugar_servicio"].widget.attrs.setdefault("placeholder", "Ej: Direccion o referencia del lugar")
@@ -349,6 +339,15 @@ class ContactoForm(forms.ModelForm):
             return raw
         return _normalize_phone(raw)
 
+    def clean(self):
+        cleaned = super().clean()
+        # Se rechaza aqui, antes de que la vista cree usuario, cotizacion o visita
+        servicio_id = self._servicio_ids.get((cleaned.get("tipo_servicio") or "").strip().lower())
+        motivo = fuera_de_cobertura(cleaned.get("region"), cleaned.get("comuna"), servicio=servicio_id)
+        if motivo:
+            self.add_error("comuna", motivo)
+        return cleaned
+
 
 class DocumentoForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,119 @@
+import math
+import threading
+import unicodedata
+from dataclasses import dataclass
+
+from django.core.cache import cache
+
+from .models import Comuna
+
+
+RADIO_TIERRA_KM = 6371.0088
+
+# Indice en memoria de centroides: nombre normalizado -> (lat, lng). Misma invalidacion que el catalogo:
+# al guardar una Comuna se incrementa la version en la cache compartida y cada worker reconstruye su copia.
+CLAVE_VERSION = "geo:version"
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def normalizar_nombre(texto) -> str:
+    """'Ñuñoa', 'NUNOA' y 'nunoa ' -> 'nunoa'; tambien ignora espacios y signos ('Til Til' == 'Tiltil')."""
+    plano = unicodedata.normalize("NFKD", texto or "").encode("ascii", "ignore").decode("ascii")
+    return "".join(ch for ch in plano.lower() if ch.isalnum())
+
+
+@dataclass(frozen=True)
+class IndiceComunas:
+    version: int
+    por_comuna: dict
+    por_region_comuna: dict
+
+    def coordenadas(self, comuna, region=None):
+        """Centroide (lat, lng) de una comuna escrita a mano, o None si no se reconoce."""
+        clave = normalizar_nombre(comuna)
+        if not clave:
+            return None
+        if region:
+            punto = self.por_region_comuna.get((normalizar_nombre(region), clave))
+            if punto:
+                return punto
+        return self.por_comuna.get(clave)
+
+
+def _construir_indice(version):
+    por_comuna, por_region_comuna = {}, {}
+    filas = Comuna.objects.filter(lat__isnull=False, lng__isnull=False).values_list("region__nombre", "nombre", "lat", "lng")
+    for region, nombre, lat, lng in filas:
+        punto = (float(lat), float(lng))
+        clave = normalizar_nombre(nombre)
+        por_comuna.setdefault(clave, punto)
+        por_region_comuna[(normalizar_nombre(region), clave)] = punto
+    return IndiceComunas(version, por_comuna, por_region_comuna)
+
+
+def indice_comunas():
+    """
+    Indice vigente; consulta la BD solo la primera vez y despues de cada invalidacion.
+    Cada llamada lee la version de la cache: en un ciclo conviene obtenerlo una vez y usar .coordenadas().
+    """
+    global _indice
+    version = cache.get_or_set(CLAVE_VERSION, 1, None)
+    indice = _indice
+    if indice is None or indice.version != version:
+        with _indice_lock:
+            if _indice is None or _indice.version != version:
+                _indice = _construir_indice(version)
+            indice = _indice
+    return indice
+
+
+def invalidar_indice():
+    global _indice
+    _indice = None
+    try:
+        cache.incr(CLAVE_VERSION)
+    except ValueError:
+        cache.set(CLAVE_VERSION, 2, None)
+
+
+def coordenadas_comuna(comuna, region=None):
+    """Centroide (lat, lng) de una comuna escrita a mano, o None si no se reconoce."""
+    return indice_comunas().coordenadas(comuna, region)
+
+
+def distancias(origenes, destinos):
+    """
+    Matriz haversine en km de len(origenes) x len(destinos), con puntos (lat, lng).
+    Vectorizada con NumPy si esta instalado; si no, calculo equivalente en Python puro.
+    """
+    if not origenes or not destinos:
+        return [[] for _ in origenes]
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        a = np.radians(np.asarray(origenes, dtype=float))
+        b = np.radians(np.asarray(destinos, dtype=float))
+        lat1, lng1 = a[:, 0:1], a[:, 1:2]
+        lat2, lng2 = b[:, 0], b[:, 1]
+        h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        return (2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))).tolist()
+    destinos_rad = [(math.radians(la), math.radians(lo)) for la, lo in destinos]
+    matriz = []
+    for la1, lo1 in ((math.radians(la), math.radians(lo)) for la, lo in origenes):
+        fila = []
+        for la2, lo2 in destinos_rad:
+            h = math.sin((la2 - la1) / 2) ** 2 + math.cos(la1) * math.cos(la2) * math.sin((lo2 - lo1) / 2) ** 2
+            fila.append(2 * RADIO_TIERRA_KM * math.asin(math.sqrt(min(1.0, h))))
+        matriz.append(fila)
+    return matriz
+
+
+def distancias_desde(origen, destinos):
+    """Distancias en km desde un punto a muchos (una fila de distancias())."""
+    if not destinos:
+        return []
+    return distancias([origen], destinos)[0]
@@ -0,0 +1,109 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import VisitaEliminada, VisitaTecnica
+
+
+PRODID = "-//FM Servicios Generales//Agenda de visitas//ES"
+# Historial incluido en el feed; lo mas antiguo deja de sincronizarse para mantener el archivo liviano
+DIAS_HISTORIAL = 60
+
+
+def visitas_feed(tecnico=None):
+    desde = timezone.localdate() - timedelta(days=DIAS_HISTORIAL)
+    qs = VisitaTecnica.objects.filter(fecha__gte=desde)
+    if tecnico is not None:
+        qs = qs.filter(tecnico=tecnico)
+    return qs
+
+
+def resumen_feed(qs, tecnico_slug=None):
+    """
+    (cantidad, ultima modificacion) del feed; sirve para ETag y Last-Modified.
+    Los borrados cuentan como modificacion, asi Last-Modified tambien avanza al eliminar una visita.
+    """
+    datos = qs.order_by().aggregate(n=Count("id"), ultima=Max("actualizado_en"))
+    borradas = VisitaEliminada.objects.filter(fecha__gte=timezone.localdate() - timedelta(days=DIAS_HISTORIAL))
+    if tecnico_slug:
+        borradas = borradas.filter(tecnico_slug=tecnico_slug)
+    ultimo_borrado = borradas.order_by().aggregate(ultima=Max("eliminado_en"))["ultima"]
+    return datos["n"], max(filter(None, (datos["ultima"], ultimo_borrado)), default=None)
+
+
+def _escapar(texto) -> str:
+    return (
+        str(texto or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _plegar(linea: str) -> str:
+    # RFC 5545: lineas de maximo 75 octetos; la continuacion empieza con un espacio
+    datos = linea.encode("utf-8")
+    if len(datos) <= 75:
+        return linea
+    partes, actual, limite = [], b"", 75
+    for ch in linea:
+        b = ch.encode("utf-8")
+        if len(actual) + len(b) > limite:
+            partes.append(actual.decode("utf-8"))
+            actual, limite = b"", 74
+        actual += b
+    partes.append(actual.decode("utf-8"))
+    return "\r\n ".join(partes)
+
+
+def _utc(valor) -> str:
+    return valor.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def generar_ics(visitas, nombre_calendario: str, dominio: str = "fm-servicios") -> str:
+    lineas = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escapar(nombre_calendario)}",
+        "X-WR-TIMEZONE:America/Santiago",
+    ]
+    for v in visitas:
+        cot = v.cotizacion if v.cotizacion_id else None
+        servicio = cot.servicio.titulo if cot is not None and cot.servicio_id else ""
+        titulo = f"Visita: {v.cliente}" + (f" ({servicio})" if servicio else "")
+        ubicacion = ", ".join(x for x in (v.direccion if v.direccion != "-" else "", v.comuna, v.region) if x)
+        descripcion = [f"Tecnico: {v.tecnico_nombre}"]
+        if v.correo:
+            descripcion.append(f"Contacto: {v.correo}")
+        if cot is not None:
+            descripcion.append(f"Cotizacion #{cot.pk}")
+        if v.notas and v.notas != "-":
+            descripcion.append(v.notas)
+        lineas += [
+            "BEGIN:VEVENT",
+            f"UID:visita-{v.pk}@{dominio}",
+            f"DTSTAMP:{_utc(v.actualizado_en)}",
+            f"LAST-MODIFIED:{_utc(v.actualizado_en)}",
+        ]
+        if v.inicio and v.fin:
+            lineas += [f"DTSTART:{_utc(v.inicio)}", f"DTEND:{_utc(v.fin)}"]
+        else:
+            # Sin hora definida: evento de dia completo
+            lineas += [
+                f"DTSTART;VALUE=DATE:{v.fecha:%Y%m%d}",
+                f"DTEND;VALUE=DATE:{v.fecha + timedelta(days=1):%Y%m%d}",
+            ]
+        lineas += [
+            f"SUMMARY:{_escapar(titulo)}",
+            f"LOCATION:{_escapar(ubicacion)}",
+            f"DESCRIPTION:{_escapar(chr(10).join(descripcion))}",
+            "END:VEVENT",
+        ]
+    lineas.append("END:VCALENDAR")
+    return "\r\n".join(_plegar(linea) for linea in lineas) + "\r\n"
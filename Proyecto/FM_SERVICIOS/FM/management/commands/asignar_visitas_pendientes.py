@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandParser
+
+from FM.asignacion import DIAS_BUSQUEDA, Asignador, agendar_cotizacion
+from FM.models import Cotizacion
+
+
+class Command(BaseCommand):
+    help = (
+        "Agenda en una pasada las cotizaciones vigentes que aun no tienen visita, "
+        "repartiendolas entre los tecnicos activos: --dias <n> --dry-run"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--dias", type=int, default=DIAS_BUSQUEDA, help="Dias hacia adelante a considerar.")
+        parser.add_argument("--dry-run", action="store_true", help="Muestra la asignacion sin guardar visitas.")
+
+    def handle(self, *args, **opts):
+        pendientes = list(
+            Cotizacion.objects.filter(
+                estado__in=[Cotizacion.Estado.PENDIENTE, Cotizacion.Estado.ENVIADA, Cotizacion.Estado.ACEPTADA],
+                visitas__isnull=True,
+            )
+            .select_related("usuario", "servicio")
+            .order_by("creado_en", "id")
+        )
+        if not pendientes:
+            self.stdout.write("No hay cotizaciones sin visita.")
+            return
+        asignador = Asignador(dias=max(1, opts["dias"]))
+        agendadas = 0
+        for cot in pendientes:
+            visita = agendar_cotizacion(cot, asignador=asignador, guardar=not opts["dry_run"])
+            if visita:
+                agendadas += 1
+                self.stdout.write(f"Cotizacion #{cot.id}: {visita.tecnico_nombre} {visita.fecha:%d/%m/%Y} {visita.hora:%H:%M}")
+            else:
+                self.stdout.write(self.style.WARNING(f"Cotizacion #{cot.id}: sin horario disponible"))
+        resumen = f"{agendadas} de {len(pendientes)} cotizaciones {'asignables' if opts['dry_run'] else 'agendadas'}."
+        self.stdout.write(self.style.SUCCESS(resumen))
@@ -0,0 +1,11 @@
+from django.contrib.staticfiles.management.commands.collectstatic import Command as CollectstaticCommand
+
+from FM.catalogo import exportar_catalogo
+
+
+class Command(CollectstaticCommand):
+    help = CollectstaticCommand.help + " Antes exporta el catalogo de regiones/comunas a JSON estatico."
+
+    def handle(self, **options):
+        exportar_catalogo()
+        return super().handle(**options)
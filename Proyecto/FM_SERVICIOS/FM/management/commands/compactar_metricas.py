@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils import timezone
+
+from FM.metricas import compactar
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula el rollup MetricaDiaria de los ultimos dias desde Cotizacion y borra filas en cero. "
+        "Corrige cambios que no pasaron por save() y guardados simultaneos de una misma cotizacion. "
+        "Cron: cada noche con la ventana por defecto y cada semana con --todo. --dias <n> | --todo"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--dias", type=int, default=35, help="Ventana hacia atras desde hoy (por defecto 35).")
+        parser.add_argument("--todo", action="store_true", help="Reconstruye el historial completo.")
+
+    def handle(self, *args, **opts):
+        desde = None if opts["todo"] else timezone.localdate() - timedelta(days=max(1, opts["dias"]))
+        escritas, borradas = compactar(desde=desde)
+        alcance = "todo el historial" if desde is None else f"desde {desde:%d/%m/%Y}"
+        self.stdout.write(self.style.SUCCESS(f"Metricas recalculadas ({alcance}): {escritas} filas, {borradas} reemplazadas."))
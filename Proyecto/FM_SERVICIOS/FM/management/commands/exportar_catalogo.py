@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from FM.catalogo import RUTA_ESTATICA, exportar_catalogo, get_catalogo
+
+
+class Command(BaseCommand):
+    help = (
+        "Escribe el catalogo de regiones/comunas como JSON estatico (FM/static/FM/generado/regiones.json). "
+        "collectstatic lo ejecuta solo; usalo a mano si cambias regiones y vuelves a publicar estaticos."
+    )
+
+    def handle(self, *args, **opts):
+        destino = exportar_catalogo()
+        catalogo = get_catalogo()
+        self.stdout.write(
+            self.style.SUCCESS(f"{RUTA_ESTATICA}: {len(catalogo.regiones)} regiones, firma {catalogo.firma} ({destino})")
+        )
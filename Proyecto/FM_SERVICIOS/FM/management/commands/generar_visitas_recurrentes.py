@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+
+from FM.agenda import ConflictoAgenda
+from FM.recurrencia import HORIZONTE_DIAS, generar_visitas
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea las visitas de las mantenciones periodicas para los proximos dias. "
+        "Se puede ejecutar a diario (cron): no duplica visitas ya generadas. --dias <n> --dry-run"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--dias", type=int, default=HORIZONTE_DIAS, help="Horizonte en dias desde manana.")
+        parser.add_argument("--dry-run", action="store_true", help="Muestra las visitas sin crearlas.")
+
+    def handle(self, *args, **opts):
+        desde = timezone.localdate() + timedelta(days=1)
+        hasta = desde + timedelta(days=max(1, opts["dias"]) - 1)
+        try:
+            nuevas, sin_horario, movidas = generar_visitas(desde, hasta, guardar=not opts["dry_run"])
+        except ConflictoAgenda as exc:
+            raise CommandError(str(exc)) from exc
+        for v in nuevas:
+            self.stdout.write(f"{v.fecha:%d/%m/%Y} {v.hora:%H:%M} {v.cliente} -> {v.tecnico_nombre}")
+        for v in movidas:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{v.fecha:%d/%m/%Y} {v.recurrencia}: {v.recurrencia.hora:%H:%M} no disponible, agendada a las {v.hora:%H:%M}"
+                )
+            )
+        for regla, fecha in sin_horario:
+            self.stdout.write(self.style.WARNING(f"{fecha:%d/%m/%Y} {regla}: sin horario disponible"))
+        accion = "por crear" if opts["dry_run"] else "creadas"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(nuevas)} visitas {accion} ({len(movidas)} en otra hora), {len(sin_horario)} sin horario."
+            )
+        )
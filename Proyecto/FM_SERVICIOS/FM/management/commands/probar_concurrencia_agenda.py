@@ -0,0 +1,117 @@
+import threading
+import time as time_mod
+from datetime import time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from FM.agenda import ConflictoAgenda, guardar_visita
+from FM.models import Tecnico, VisitaTecnica
+
+
+class Command(BaseCommand):
+    help = (
+        "Lanza reservas concurrentes contra un tecnico temporal y verifica que la agenda "
+        "no acepte dos visitas a menos de 3 horas ni se trabe esperando locks: "
+        "--hilos <n> --rondas <n> --espera-max <ms>"
+    )
+
+    # Mensajes con los que SQLite y Postgres reportan una espera de lock agotada
+    MENSAJES_TIMEOUT = ("database is locked", "lock timeout", "canceling statement due to")
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--hilos", type=int, default=8)
+        parser.add_argument("--rondas", type=int, default=5)
+        parser.add_argument(
+            "--espera-max",
+            type=float,
+            default=2000.0,
+            help="Latencia maxima aceptada por reserva, en milisegundos.",
+        )
+
+    def handle(self, *args, **opts):
+        hilos = max(2, opts["hilos"])
+        rondas = max(1, opts["rondas"])
+        espera_max = max(0.0, opts["espera_max"]) / 1000
+        sufijo = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        tecnico = Tecnico.objects.create(
+            nombre="Prueba",
+            apellido=f"Concurrencia {sufijo}",
+            correo=f"concurrencia-{sufijo}@example.invalid",
+            rut=f"CONC-{sufijo}",
+            activo=False,
+        )
+        # Fecha lejana para no interferir con la agenda real
+        fecha = timezone.localdate() + timedelta(days=3650)
+        errores = []
+        timeouts = []
+        esperas = []
+        lock = threading.Lock()
+        try:
+            for ronda in range(rondas):
+                barrera = threading.Barrier(hilos)
+                # Cada hilo pide una hora distinta pero todas dentro de la misma ventana de 3 horas
+                horas = [time(8 + (ronda * 4 + i % 3) % 12, (i * 10) % 60) for i in range(hilos)]
+
+                def reservar(hora):
+                    visita = VisitaTecnica(
+                        tecnico=tecnico,
+                        cliente="Prueba concurrencia",
+                        fecha=fecha,
+                        hora=hora,
+                    )
+                    try:
+                        barrera.wait()
+                        t0 = time_mod.monotonic()
+                        try:
+                            guardar_visita(visita)
+                        except ConflictoAgenda:
+                            pass
+                        with lock:
+                            esperas.append(time_mod.monotonic() - t0)
+                    except OperationalError as exc:
+                        destino = timeouts if any(m in str(exc).lower() for m in self.MENSAJES_TIMEOUT) else errores
+                        with lock:
+                            destino.append(repr(exc))
+                    except Exception as exc:
+                        with lock:
+                            errores.append(repr(exc))
+                    finally:
+                        connection.close()
+
+                threads = [threading.Thread(target=reservar, args=(h,)) for h in horas]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+
+            inicios = sorted(
+                VisitaTecnica.objects.filter(tecnico=tecnico).values_list("inicio", flat=True)
+            )
+            solapes = [
+                (a, b) for a, b in zip(inicios, inicios[1:]) if b - a <= VisitaTecnica.VENTANA_CONFLICTO
+            ]
+        finally:
+            VisitaTecnica.objects.filter(tecnico=tecnico).delete()
+            tecnico.delete()
+
+        lentas = [e for e in esperas if e > espera_max]
+        self.stdout.write(
+            f"Reservas aceptadas: {len(inicios)} de {hilos * rondas} intentos; "
+            f"espera maxima {max(esperas or [0]) * 1000:.1f} ms; "
+            f"{len(timeouts)} timeouts de lock, {len(lentas)} reservas sobre {espera_max * 1000:.0f} ms, "
+            f"{len(errores)} errores."
+        )
+        if timeouts:
+            raise CommandError(f"Esperas de lock agotadas: {timeouts[:5]}")
+        if lentas:
+            raise CommandError(
+                f"{len(lentas)} reservas superaron {espera_max * 1000:.0f} ms "
+                f"(maxima {max(lentas) * 1000:.1f} ms)"
+            )
+        if errores:
+            raise CommandError(f"Errores durante la prueba: {errores[:5]}")
+        if solapes:
+            raise CommandError(f"Se aceptaron visitas superpuestas: {solapes[:5]}")
+        self.stdout.write(self.style.SUCCESS("Sin reservas duplicadas, superpuestas ni esperas de lock excesivas."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from FM.busqueda import indexar, instalar_triggers
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye el indice de texto completo de cotizaciones (tsvector en Postgres, FTS5 en SQLite) "
+        "y repone los triggers que lo mantienen. Util tras restaurar un respaldo sin triggers o cargas con "
+        "los triggers deshabilitados."
+    )
+
+    def handle(self, *args, **opts):
+        instalar_triggers()
+        indexar()
+        self.stdout.write(self.style.SUCCESS("Indice de busqueda de cotizaciones reconstruido."))
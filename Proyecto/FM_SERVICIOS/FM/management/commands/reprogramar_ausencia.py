@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from FM.agenda import ConflictoAgenda
+from FM.models import Tecnico
+from FM.reprogramacion import aplicar_reprogramacion, enviar_correo_reprogramacion, planificar_ausencia
+
+
+class Command(BaseCommand):
+    help = (
+        "Reprograma en lote las visitas de un tecnico ausente y avisa a cada cliente: "
+        "<slug> --desde AAAA-MM-DD --hasta AAAA-MM-DD [--sin-reasignar] [--dry-run]"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("tecnico", help="Slug del tecnico ausente.")
+        parser.add_argument("--desde", required=True, help="Primer dia de la ausencia (AAAA-MM-DD).")
+        parser.add_argument("--hasta", required=True, help="Ultimo dia de la ausencia (AAAA-MM-DD).")
+        parser.add_argument("--sin-reasignar", action="store_true", help="Mantiene el tecnico y solo mueve la fecha.")
+        parser.add_argument("--dry-run", action="store_true", help="Muestra los cambios sin guardarlos.")
+
+    def handle(self, *args, **opts):
+        tecnico = Tecnico.objects.filter(slug=opts["tecnico"]).first()
+        if not tecnico:
+            raise CommandError(f"No existe el tecnico {opts['tecnico']!r}.")
+        try:
+            desde = datetime.strptime(opts["desde"], "%Y-%m-%d").date()
+            hasta = datetime.strptime(opts["hasta"], "%Y-%m-%d").date()
+        except ValueError as exc:
+            raise CommandError("Las fechas deben tener formato AAAA-MM-DD.") from exc
+        cambios, sin_horario = planificar_ausencia(tecnico, desde, hasta, reasignar=not opts["sin_reasignar"])
+        for c in cambios:
+            antes = f"{c.fecha_anterior:%d/%m/%Y}" + (f" {c.hora_anterior:%H:%M}" if c.hora_anterior else "")
+            self.stdout.write(f"Visita #{c.visita.pk} {c.visita.cliente}: {antes} -> {c.fecha:%d/%m/%Y} {c.hora:%H:%M} ({c.tecnico_nombre})")
+        for v in sin_horario:
+            self.stdout.write(self.style.WARNING(f"Visita #{v.pk} {v.cliente}: sin horario disponible"))
+        if opts["dry_run"] or not cambios:
+            self.stdout.write(self.style.SUCCESS(f"{len(cambios)} visitas reprogramables, {len(sin_horario)} sin horario."))
+            return
+        try:
+            aplicar_reprogramacion(cambios, notificar=enviar_correo_reprogramacion)
+        except ConflictoAgenda as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(self.style.SUCCESS(f"{len(cambios)} visitas reprogramadas, {len(sin_horario)} sin horario."))
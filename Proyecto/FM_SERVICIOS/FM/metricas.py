@@ -0,0 +1,134 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Cotizacion, MetricaDiaria
+
+
+# Clave de rollup de una cotizacion: el dia en que se creo y su estado/servicio/region actuales.
+# Se mantiene en post_save con la instantanea tomada al cargar la cotizacion: dos guardados simultaneos de la
+# misma cotizacion restan ambos de la clave vieja, y queryset.update/bulk no pasan por aqui. Esa deriva la
+# corrige compactar_metricas, que debe correr cada noche (ventana de 35 dias) y una vez por semana con --todo.
+Clave = namedtuple("Clave", "fecha estado servicio_id region")
+
+DIMENSIONES = {"estado": "estado", "servicio": "servicio_id", "region": "region"}
+SERIES = {"dia": None, "semana": TruncWeek, "mes": TruncMonth}
+CAMPOS_METRICA = ("creado_en", "estado", "servicio_id", "region", "presupuesto_estimado")
+CERO = Decimal("0")
+
+
+def instantanea(cot):
+    """Valores de la cotizacion que definen su clave, o None si alguno vino diferido (.only/.defer)."""
+    if cot.get_deferred_fields().intersection(CAMPOS_METRICA):
+        return None
+    return tuple(getattr(cot, c) for c in CAMPOS_METRICA)
+
+
+def _clave(valores):
+    creado, estado, servicio_id, region, presupuesto = valores
+    clave = Clave(timezone.localdate(creado or timezone.now()), estado, servicio_id, region or "")
+    return clave, presupuesto or CERO
+
+
+def _sumar(clave, cantidad, monto):
+    filtro = clave._asdict()
+    incremento = {"cantidad": F("cantidad") + cantidad, "monto": F("monto") + monto, "actualizado_en": timezone.now()}
+    if MetricaDiaria.objects.filter(**filtro).update(**incremento):
+        return
+    try:
+        with transaction.atomic():
+            MetricaDiaria.objects.create(cantidad=cantidad, monto=monto, **filtro)
+    except IntegrityError:
+        # Otra transaccion creo la fila entre el update y el insert
+        MetricaDiaria.objects.filter(**filtro).update(**incremento)
+
+
+def registrar_cambio(anterior, actual):
+    """
+    Aplica al rollup el paso de anterior a actual (instantaneas, o None en creacion/eliminacion).
+    Un cambio de estado resta en la clave vieja y suma en la nueva; si la clave y el monto no cambian no escribe.
+    """
+    antes = _clave(anterior) if anterior is not None else None
+    despues = _clave(actual) if actual is not None else None
+    if antes == despues:
+        return
+    if antes is not None:
+        _sumar(antes[0], -1, -antes[1])
+    if despues is not None:
+        _sumar(despues[0], 1, despues[1])
+
+
+def fusionar_servicio(servicio_id):
+    """
+    Mueve las filas de un servicio que se va a eliminar a la clave sin servicio, como pasa con sus
+    cotizaciones (SET_NULL). Se llama antes del borrado: la FK no hace nada por su cuenta porque
+    ponerla en NULL chocaria con la fila sin servicio que ya exista para ese dia, estado y region.
+    """
+    with transaction.atomic():
+        filas = MetricaDiaria.objects.filter(servicio_id=servicio_id)
+        for fecha, estado, region, cantidad, monto in filas.values_list("fecha", "estado", "region", "cantidad", "monto"):
+            _sumar(Clave(fecha, estado, None, region), cantidad, monto)
+        filas.delete()
+
+
+def _desde_fuente(desde=None, hasta=None):
+    qs = Cotizacion.objects.all()
+    if desde:
+        qs = qs.filter(creado_en__date__gte=desde)
+    if hasta:
+        qs = qs.filter(creado_en__date__lte=hasta)
+    filas = (
+        qs.annotate(dia=TruncDate("creado_en", tzinfo=timezone.get_current_timezone()))
+        .values("dia", "estado", "servicio_id", "region")
+        .annotate(n=Count("pk"), total=Coalesce(Sum("presupuesto_estimado"), Value(CERO), output_field=DecimalField()))
+        .order_by()
+    )
+    agrupado = {}
+    for f in filas:
+        clave = Clave(f["dia"], f["estado"], f["servicio_id"], f["region"] or "")
+        cantidad, monto = agrupado.get(clave, (0, CERO))
+        # region None y "" caen en la misma clave
+        agrupado[clave] = (cantidad + f["n"], monto + f["total"])
+    return agrupado
+
+
+def compactar(desde=None, hasta=None):
+    """
+    Recalcula el rollup de [desde, hasta] desde Cotizacion (todo el historial si no hay rango) y borra las filas
+    en cero. Corrige lo que no paso por save(): queryset.update, cargas masivas o servicios eliminados.
+    Retorna (filas_escritas, filas_borradas).
+    """
+    agrupado = _desde_fuente(desde, hasta)
+    with transaction.atomic():
+        viejas = MetricaDiaria.objects.all()
+        if desde:
+            viejas = viejas.filter(fecha__gte=desde)
+        if hasta:
+            viejas = viejas.filter(fecha__lte=hasta)
+        borradas, _ = viejas.delete()
+        MetricaDiaria.objects.bulk_create(
+            [MetricaDiaria(cantidad=n, monto=m, **c._asdict()) for c, (n, m) in agrupado.items() if n],
+            batch_size=1000,
+        )
+        MetricaDiaria.objects.filter(cantidad=0, monto=0).delete()
+    return len(agrupado), borradas
+
+
+def reporte_periodo(desde, hasta, por=("estado",), serie=None):
+    """
+    Totales de cotizaciones creadas en [desde, hasta] agrupados por las dimensiones de por
+    (estado, servicio, region) y opcionalmente por dia/semana/mes. Lee solo filas del rollup del
+    rango, asi que el costo no depende del largo del historial.
+    """
+    campos = [DIMENSIONES[d] for d in por]
+    qs = MetricaDiaria.objects.filter(fecha__gte=desde, fecha__lte=hasta)
+    if serie:
+        trunc = SERIES[serie]
+        qs = qs.annotate(periodo=trunc("fecha") if trunc else F("fecha"))
+        campos = ["periodo"] + campos
+    filas = qs.values(*campos).annotate(cantidad=Sum("cantidad"), monto=Sum("monto")).order_by(*campos)
+    return [f for f in filas if f["cantidad"]]
@@ -9,20 +9,25 @@ class Migration(migrations.Migration):
         ('FM', '0003_tecnico'),
     ]
 
+    # Los nombres nuevos ya vienen en 0001_initial: solo cambia el estado (ver 0003)
     operations = [
-        migrations.RenameIndex(
-            model_name='tecnico',
-            new_name='FM_tecnico_slug_a053ed_idx',
-            old_name='FM_tecnico_slug_idx',
-        ),
-        migrations.RenameIndex(
-            model_name='tecnico',
-            new_name='FM_tecnico_correo_5f91a0_idx',
-            old_name='FM_tecnico_correo_idx',
-        ),
-        migrations.RenameIndex(
-            model_name='tecnico',
-            new_name='FM_tecnico_rut_24b492_idx',
-            old_name='FM_tecnico_rut_idx',
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameIndex(
+                    model_name='tecnico',
+                    new_name='FM_tecnico_slug_a053ed_idx',
+                    old_name='FM_tecnico_slug_idx',
+                ),
+                migrations.RenameIndex(
+                    model_name='tecnico',
+                    new_name='FM_tecnico_correo_5f91a0_idx',
+                    old_name='FM_tecnico_correo_idx',
+                ),
+                migrations.RenameIndex(
+                    model_name='tecnico',
+                    new_name='FM_tecnico_rut_24b492_idx',
+                    old_name='FM_tecnico_rut_idx',
+                ),
+            ],
         ),
     ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:03
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_intervalos(apps, schema_editor):
+    VisitaTecnica = apps.get_model("FM", "VisitaTecnica")
+    pendientes = []
+    for visita in VisitaTecnica.objects.filter(hora__isnull=False).only("id", "fecha", "hora").iterator(chunk_size=500):
+        inicio = datetime.combine(visita.fecha, visita.hora)
+        if settings.USE_TZ:
+            inicio = timezone.make_aware(inicio)
+        visita.inicio = inicio
+        visita.fin = inicio + timedelta(hours=3)
+        pendientes.append(visita)
+        if len(pendientes) >= 500:
+            VisitaTecnica.objects.bulk_update(pendientes, ["inicio", "fin"])
+            pendientes = []
+    if pendientes:
+        VisitaTecnica.objects.bulk_update(pendientes, ["inicio", "fin"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0013_cotizacion_transbank_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitatecnica',
+            name='fin',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='visitatecnica',
+            name='inicio',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='visitatecnica',
+            index=models.Index(fields=['tecnico_slug', 'inicio'], name='FM_visitate_tecnico_a388f7_idx'),
+        ),
+        migrations.RunPython(backfill_intervalos, migrations.RunPython.noop),
+    ]
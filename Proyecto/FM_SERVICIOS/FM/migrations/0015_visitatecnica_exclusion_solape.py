@@ -0,0 +1,60 @@
+from django.db import migrations
+
+
+CONSTRAINT_NAME = "fm_visita_sin_solape"
+
+
+def crear_restriccion(apps, schema_editor):
+    """
+    En Postgres impide a nivel de BD que un tecnico tenga dos intervalos [inicio, fin] superpuestos.
+    Otros motores usan el fallback serializado de FM.agenda.reserva_atomica.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name("FM_visitatecnica")
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT a.id, b.id
+            FROM {table} a
+            JOIN {table} b
+              ON a.tecnico_slug = b.tecnico_slug
+             AND a.id < b.id
+             AND tstzrange(a.inicio, a.fin, '[]') && tstzrange(b.inicio, b.fin, '[]')
+            WHERE a.inicio IS NOT NULL AND b.inicio IS NOT NULL
+            LIMIT 20
+            """
+        )
+        solapadas = cursor.fetchall()
+    if solapadas:
+        pares = ", ".join(f"{a}/{b}" for a, b in solapadas)
+        raise RuntimeError(
+            "Hay visitas superpuestas para el mismo tecnico (ids " + pares + "). "
+            "Reprograma esas visitas antes de aplicar esta migracion."
+        )
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    schema_editor.execute(
+        f"""
+        ALTER TABLE {table} ADD CONSTRAINT {CONSTRAINT_NAME}
+        EXCLUDE USING gist (tecnico_slug WITH =, tstzrange(inicio, fin, '[]') WITH &&)
+        WHERE (inicio IS NOT NULL)
+        """
+    )
+
+
+def eliminar_restriccion(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name("FM_visitatecnica")
+    schema_editor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {CONSTRAINT_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0014_visitatecnica_intervalo"),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_restriccion, eliminar_restriccion),
+    ]
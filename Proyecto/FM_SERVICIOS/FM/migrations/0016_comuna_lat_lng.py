@@ -0,0 +1,49 @@
+import csv
+from decimal import Decimal
+from pathlib import Path
+
+from django.db import migrations, models
+
+
+CENTROIDES_CSV = Path(__file__).resolve().parent.parent / "data" / "comunas_centroides.csv"
+
+
+def cargar_centroides(apps, schema_editor):
+    Comuna = apps.get_model("FM", "Comuna")
+    with open(CENTROIDES_CSV, encoding="utf-8") as fh:
+        centroides = {
+            (fila["region"], fila["comuna"]): (Decimal(fila["lat"]), Decimal(fila["lng"]))
+            for fila in csv.DictReader(fh)
+        }
+    pendientes = []
+    for comuna in Comuna.objects.select_related("region").only("id", "nombre", "region__nombre"):
+        punto = centroides.get((comuna.region.nombre, comuna.nombre))
+        if punto:
+            comuna.lat, comuna.lng = punto
+            pendientes.append(comuna)
+    Comuna.objects.bulk_update(pendientes, ["lat", "lng"], batch_size=500)
+
+
+def limpiar_centroides(apps, schema_editor):
+    apps.get_model("FM", "Comuna").objects.update(lat=None, lng=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0015_visitatecnica_exclusion_solape"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comuna",
+            name="lat",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name="comuna",
+            name="lng",
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.RunPython(cargar_centroides, limpiar_centroides),
+    ]
@@ -0,0 +1,27 @@
+import secrets
+
+from django.db import migrations, models
+
+
+def generar_tokens(apps, schema_editor):
+    Tecnico = apps.get_model("FM", "Tecnico")
+    pendientes = list(Tecnico.objects.filter(ical_token__isnull=True).only("id"))
+    for tecnico in pendientes:
+        tecnico.ical_token = secrets.token_urlsafe(24)
+    Tecnico.objects.bulk_update(pendientes, ["ical_token"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0016_comuna_lat_lng"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tecnico",
+            name="ical_token",
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(generar_tokens, migrations.RunPython.noop),
+    ]
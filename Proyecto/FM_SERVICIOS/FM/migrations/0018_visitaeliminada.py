@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0017_tecnico_ical_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitaEliminada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visita_id', models.PositiveIntegerField()),
+                ('tecnico_slug', models.CharField(blank=True, max_length=60)),
+                ('fecha', models.DateField(blank=True, null=True)),
+                ('eliminado_en', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-eliminado_en'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='visitatecnica',
+            index=models.Index(fields=['actualizado_en'], name='FM_visitate_actuali_1873fc_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0018_visitaeliminada'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='visitatecnica',
+            name='FM_visitate_tecnico_a388f7_idx',
+        ),
+        migrations.AddField(
+            model_name='visitatecnica',
+            name='tecnico',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='visitas', to='FM.tecnico'),
+        ),
+        migrations.AddIndex(
+            model_name='visitatecnica',
+            index=models.Index(fields=['tecnico', 'fecha', 'hora'], name='FM_visitate_tecnico_b20ce9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visitatecnica',
+            index=models.Index(fields=['tecnico', 'inicio'], name='FM_visitate_tecnico_683e0b_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from collections import defaultdict
+
+from django.db import migrations, transaction
+
+
+LOTE = 1000
+
+
+def asignar_tecnicos(apps, schema_editor):
+    """
+    Resuelve tecnico_slug -> tecnico_id por lotes de ids, cada uno en su propia transaccion,
+    para no bloquear la tabla completa en bases grandes. Los slugs sin tecnico quedan en NULL.
+    """
+    Tecnico = apps.get_model("FM", "Tecnico")
+    VisitaTecnica = apps.get_model("FM", "VisitaTecnica")
+    ids_por_slug = dict(Tecnico.objects.filter(slug__isnull=False).values_list("slug", "id"))
+    ultimo = 0
+    while True:
+        filas = list(
+            VisitaTecnica.objects.filter(pk__gt=ultimo, tecnico__isnull=True)
+            .order_by("pk")
+            .values_list("pk", "tecnico_slug")[:LOTE]
+        )
+        if not filas:
+            break
+        ultimo = filas[-1][0]
+        por_tecnico = defaultdict(list)
+        for pk, slug in filas:
+            if slug in ids_por_slug:
+                por_tecnico[ids_por_slug[slug]].append(pk)
+        with transaction.atomic():
+            for tecnico_id, pks in por_tecnico.items():
+                VisitaTecnica.objects.filter(pk__in=pks).update(tecnico_id=tecnico_id)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("FM", "0019_visitatecnica_tecnico"),
+    ]
+
+    operations = [
+        migrations.RunPython(asignar_tecnicos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+CONSTRAINT_NAME = "fm_visita_sin_solape"
+
+
+def _recrear(schema_editor, columna):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name("FM_visitatecnica")
+    schema_editor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {CONSTRAINT_NAME}")
+    schema_editor.execute(
+        f"""
+        ALTER TABLE {table} ADD CONSTRAINT {CONSTRAINT_NAME}
+        EXCLUDE USING gist ({columna} WITH =, tstzrange(inicio, fin, '[]') WITH &&)
+        WHERE (inicio IS NOT NULL)
+        """
+    )
+
+
+def usar_fk(apps, schema_editor):
+    """La restriccion de no solapamiento (0015) pasa a usar la FK en vez del slug copiado."""
+    _recrear(schema_editor, "tecnico_id")
+
+
+def usar_slug(apps, schema_editor):
+    _recrear(schema_editor, "tecnico_slug")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0020_visitatecnica_tecnico_backfill"),
+    ]
+
+    operations = [
+        migrations.RunPython(usar_fk, usar_slug),
+    ]
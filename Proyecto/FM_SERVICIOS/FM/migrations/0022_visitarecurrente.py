@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:22
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0021_visitatecnica_exclusion_por_tecnico'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitaRecurrente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('frecuencia', models.CharField(choices=[('DAILY', 'Diaria'), ('WEEKLY', 'Semanal'), ('MONTHLY', 'Mensual'), ('YEARLY', 'Anual')], default='MONTHLY', max_length=7)),
+                ('intervalo', models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)])),
+                ('dias_semana', models.CharField(blank=True, max_length=30)),
+                ('dia_mes', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('hora', models.TimeField()),
+                ('fecha_inicio', models.DateField()),
+                ('fecha_fin', models.DateField(blank=True, null=True)),
+                ('correo', models.EmailField(blank=True, max_length=254, null=True)),
+                ('notas', models.TextField(blank=True, null=True)),
+                ('activa', models.BooleanField(default=True)),
+                ('edificio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visitas_recurrentes', to='FM.edificio')),
+                ('servicio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='visitas_recurrentes', to='FM.servicio')),
+                ('tecnico', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='visitas_recurrentes', to='FM.tecnico')),
+            ],
+            options={
+                'ordering': ['edificio__nombre', 'hora', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='visitatecnica',
+            name='recurrencia',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='visitas', to='FM.visitarecurrente'),
+        ),
+        migrations.AddConstraint(
+            model_name='visitatecnica',
+            constraint=models.UniqueConstraint(fields=('recurrencia', 'fecha'), name='fm_visita_recurrencia_fecha_unica'),
+        ),
+        migrations.AddIndex(
+            model_name='visitarecurrente',
+            index=models.Index(fields=['activa', 'fecha_inicio'], name='FM_visitare_activa_09d446_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+INDEX_NAME = "fm_comuna_nombre_trgm"
+
+
+def crear_indice(apps, schema_editor):
+    """Indice GIN de trigramas para el respaldo difuso del autocompletado de comunas (solo Postgres)."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name("FM_comuna")
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} USING gin (nombre gin_trgm_ops)")
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0022_visitarecurrente"),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
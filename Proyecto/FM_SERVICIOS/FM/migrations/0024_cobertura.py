@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+MOTIVO_CABO_DE_HORNOS = "No contamos con cobertura en Cabo de Hornos."
+
+
+def excluir_cabo_de_hornos(apps, schema_editor):
+    """Traspasa a la tabla la exclusion que contacto tenia escrita en el codigo."""
+    Comuna = apps.get_model("FM", "Comuna")
+    Cobertura = apps.get_model("FM", "Cobertura")
+    for comuna in Comuna.objects.filter(nombre__iexact="Cabo de Hornos"):
+        Cobertura.objects.get_or_create(
+            comuna=comuna, servicio=None, defaults={"cubierta": False, "motivo": MOTIVO_CABO_DE_HORNOS}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0023_comuna_nombre_trigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cobertura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('cubierta', models.BooleanField(default=False, help_text='Desmarcado = no se atiende en esta comuna.')),
+                ('motivo', models.CharField(blank=True, help_text='Mensaje que ve el cliente al quedar fuera de cobertura.', max_length=200)),
+                ('comuna', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coberturas', to='FM.comuna')),
+                ('servicio', models.ForeignKey(blank=True, help_text='Vacio = todos los servicios.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='coberturas', to='FM.servicio')),
+            ],
+            options={
+                'ordering': ['comuna__region__nombre', 'comuna__nombre', 'servicio__titulo'],
+                'constraints': [models.UniqueConstraint(fields=('comuna', 'servicio'), name='fm_cobertura_comuna_servicio_unica'), models.UniqueConstraint(condition=models.Q(('servicio__isnull', True)), fields=('comuna',), name='fm_cobertura_comuna_general_unica')],
+            },
+        ),
+        migrations.RunPython(excluir_cabo_de_hornos, migrations.RunPython.noop),
+    ]
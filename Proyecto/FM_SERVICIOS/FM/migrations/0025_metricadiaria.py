@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:33
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def poblar(apps, schema_editor):
+    """Carga inicial del rollup con el historial existente (despues lo mantienen las senales)."""
+    Cotizacion = apps.get_model("FM", "Cotizacion")
+    MetricaDiaria = apps.get_model("FM", "MetricaDiaria")
+    filas = (
+        Cotizacion.objects.annotate(dia=TruncDate("creado_en", tzinfo=timezone.get_current_timezone()))
+        .values("dia", "estado", "servicio_id", "region")
+        .annotate(n=Count("pk"), total=Sum("presupuesto_estimado"))
+        .order_by()
+    )
+    agrupado = {}
+    for f in filas:
+        clave = (f["dia"], f["estado"], f["servicio_id"], f["region"] or "")
+        n, total = agrupado.get(clave, (0, Decimal("0")))
+        agrupado[clave] = (n + f["n"], total + (f["total"] or 0))
+    MetricaDiaria.objects.bulk_create(
+        [
+            MetricaDiaria(fecha=dia, estado=estado, servicio_id=servicio_id, region=region, cantidad=n, monto=total)
+            for (dia, estado, servicio_id, region), (n, total) in agrupado.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0024_cobertura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('ENVIADA', 'Enviada al cliente'), ('ACEPTADA', 'Aceptada'), ('RECHAZADA', 'Rechazada'), ('PROCESO_PAGO', 'Proceso de pago'), ('COMPLETADA', 'Completada')], max_length=15)),
+                ('region', models.CharField(blank=True, default='', max_length=80)),
+                ('cantidad', models.IntegerField(default=0)),
+                ('monto', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('servicio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='FM.servicio')),
+            ],
+            options={
+                'ordering': ['fecha', 'estado'],
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'estado', 'servicio', 'region'), name='fm_metrica_clave_unica'), models.UniqueConstraint(condition=models.Q(('servicio__isnull', True)), fields=('fecha', 'estado', 'region'), name='fm_metrica_clave_sin_servicio_unica')],
+            },
+        ),
+        migrations.RunPython(poblar, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0025_metricadiaria'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cotizacion',
+            name='FM_cotizaci_estado_33f618_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cotizacion',
+            index=models.Index(fields=['estado', 'creado_en', 'id'], name='FM_cotizaci_estado_342836_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cotizacion',
+            index=models.Index(fields=['estado', 'resuelto_en', 'id'], name='FM_cotizaci_estado_daf797_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cotizacion',
+            index=models.Index(fields=['resuelto_en', 'id'], name='FM_cotizaci_resuelt_e880eb_idx'),
+        ),
+    ]
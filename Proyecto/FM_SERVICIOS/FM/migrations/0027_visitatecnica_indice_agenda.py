@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0026_cotizacion_indices_paginacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visitatecnica',
+            index=models.Index(fields=['fecha', 'hora', 'id'], name='FM_visitate_fecha_cdef54_idx'),
+        ),
+    ]
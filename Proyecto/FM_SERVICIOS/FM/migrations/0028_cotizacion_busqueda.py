@@ -0,0 +1,65 @@
+from django.db import migrations
+
+
+COLUMNA = "busqueda"
+INDEX_NAME = "fm_cotizacion_busqueda_gin"
+TABLA_FTS = "fm_cotizacion_fts"
+
+# Copia congelada de la carga inicial de FM/busqueda.py: la migracion no debe cambiar si ese modulo cambia
+SQL_POSTGRES = (
+    "UPDATE {cot} AS c SET busqueda = "
+    "setweight(to_tsvector('spanish', coalesce(c.asunto, '')), 'A') || "
+    "setweight(to_tsvector('simple', concat_ws(' ', u.first_name, u.last_name, u.username, u.email)), 'A') || "
+    "setweight(to_tsvector('spanish', concat_ws(' ', c.lugar_servicio, c.comuna)), 'B') || "
+    "setweight(to_tsvector('spanish', coalesce(c.mensaje, '')), 'C') "
+    "FROM {usuario} AS u WHERE u.id = c.usuario_id"
+)
+SQL_SQLITE = (
+    "INSERT INTO fm_cotizacion_fts (rowid, asunto, cliente, ubicacion, mensaje) "
+    "SELECT c.id, coalesce(c.asunto, ''), "
+    "coalesce(u.first_name, '') || ' ' || coalesce(u.last_name, '') || ' ' || u.username || ' ' || coalesce(u.email, ''), "
+    "coalesce(c.lugar_servicio, '') || ' ' || coalesce(c.comuna, ''), coalesce(c.mensaje, '') "
+    "FROM {cot} AS c JOIN {usuario} AS u ON u.id = c.usuario_id"
+)
+
+
+def crear_indice(apps, schema_editor):
+    """
+    Texto completo de cotizaciones: columna tsvector con indice GIN en Postgres, tabla FTS5 en SQLite.
+    Se llena con el historial existente; despues lo mantienen las senales (FM/busqueda.py).
+    """
+    vendor = schema_editor.connection.vendor
+    table = schema_editor.quote_name("FM_cotizacion")
+    tablas = {"cot": table, "usuario": schema_editor.quote_name("FM_user")}
+    if vendor == "postgresql":
+        schema_editor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {COLUMNA} tsvector")
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} USING gin ({COLUMNA})")
+        schema_editor.execute(SQL_POSTGRES.format(**tablas))
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5("
+            "asunto, cliente, ubicacion, mensaje, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(f"DELETE FROM {TABLA_FTS}")
+        schema_editor.execute(SQL_SQLITE.format(**tablas))
+
+
+def borrar_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        table = schema_editor.quote_name("FM_cotizacion")
+        schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+        schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {COLUMNA}")
+    elif vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLA_FTS}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0027_visitatecnica_indice_agenda"),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 05:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0028_cotizacion_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Etiqueta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=255, unique=True)),
+                ('nombre', models.CharField(max_length=255)),
+            ],
+            options={
+                'ordering': ['clave'],
+            },
+        ),
+        migrations.AddField(
+            model_name='documento',
+            name='etiquetas',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='documentos', to='FM.etiqueta'),
+        ),
+    ]
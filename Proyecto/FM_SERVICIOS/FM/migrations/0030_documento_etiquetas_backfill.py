@@ -0,0 +1,68 @@
+from django.db import migrations, transaction
+
+
+LOTE = 1000
+
+
+def separar(raw):
+    """Copia congelada de FM.etiquetas.separar: la migracion no debe cambiar si ese modulo cambia."""
+    etiquetas = []
+    for chunk in (raw or "").split(","):
+        limpia = chunk.strip()
+        if limpia and limpia.lower() not in [e.lower() for e in etiquetas]:
+            etiquetas.append(limpia)
+    return etiquetas
+
+
+def poblar_etiquetas(apps, schema_editor):
+    """
+    Pasa Documento.tags (texto separado por comas) a Etiqueta + Documento.etiquetas por lotes de ids.
+    El texto queda normalizado igual que al guardar desde el panel (sin vacias ni repetidas).
+    """
+    Documento = apps.get_model("FM", "Documento")
+    Etiqueta = apps.get_model("FM", "Etiqueta")
+    Enlace = Documento.etiquetas.through
+    ids_por_clave = dict(Etiqueta.objects.values_list("clave", "id"))
+    ultimo = 0
+    while True:
+        filas = list(
+            Documento.objects.filter(pk__gt=ultimo).exclude(tags__isnull=True).exclude(tags="")
+            .order_by("pk")
+            .values_list("pk", "tags")[:LOTE]
+        )
+        if not filas:
+            break
+        ultimo = filas[-1][0]
+        por_documento = {pk: separar(tags) for pk, tags in filas}
+        nuevas = {}
+        for nombres in por_documento.values():
+            for nombre in nombres:
+                if nombre.lower() not in ids_por_clave:
+                    nuevas.setdefault(nombre.lower(), nombre)
+        with transaction.atomic():
+            Etiqueta.objects.bulk_create([Etiqueta(clave=c, nombre=n) for c, n in nuevas.items()])
+            ids_por_clave.update(Etiqueta.objects.filter(clave__in=nuevas).values_list("clave", "id"))
+            Enlace.objects.bulk_create(
+                [
+                    Enlace(documento_id=pk, etiqueta_id=ids_por_clave[n.lower()])
+                    for pk, nombres in por_documento.items()
+                    for n in nombres
+                ],
+                ignore_conflicts=True,
+            )
+            for pk, tags in filas:
+                normalizadas = ", ".join(por_documento[pk])
+                if normalizadas != tags:
+                    Documento.objects.filter(pk=pk).update(tags=normalizadas or None)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("FM", "0029_documento_etiquetas"),
+    ]
+
+    operations = [
+        migrations.RunPython(poblar_etiquetas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0030_documento_etiquetas_backfill"),
+    ]
+
+    operations = [
+        # Reemplaza el token firmado con la pk del usuario (no revocable) por uno aleatorio y rotable;
+        # los enlaces firmados anteriores dejan de funcionar y se generan de nuevo al abrir el panel
+        migrations.AddField(
+            model_name="user",
+            name="ical_token",
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
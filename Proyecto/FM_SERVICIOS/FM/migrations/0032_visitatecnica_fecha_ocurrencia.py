@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def copiar_fecha(apps, schema_editor):
+    # Las visitas ya generadas no guardaron su ocurrencia: se toma la fecha actual (unica por regla hasta ahora)
+    VisitaTecnica = apps.get_model("FM", "VisitaTecnica")
+    VisitaTecnica.objects.filter(recurrencia__isnull=False).update(fecha_ocurrencia=models.F("fecha"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0031_user_ical_token"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="visitatecnica",
+            name="fm_visita_recurrencia_fecha_unica",
+        ),
+        migrations.AddField(
+            model_name="visitatecnica",
+            name="fecha_ocurrencia",
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(copiar_fecha, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="visitatecnica",
+            constraint=models.UniqueConstraint(
+                fields=("recurrencia", "fecha_ocurrencia"), name="fm_visita_recurrencia_ocurrencia_unica"
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0033_tabla_cache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='metricadiaria',
+            name='servicio',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='FM.servicio'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:12
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def marcar_enviadas(apps, schema_editor):
+    """
+    Historial sin fecha de envio: cuentan como enviadas las que siguen en una etapa posterior al envio y las
+    rechazadas que tenian precio (solo se fija al enviar o aceptar). La fecha es aproximada: la de creacion.
+    """
+    Cotizacion = apps.get_model("FM", "Cotizacion")
+    Cotizacion.objects.filter(
+        Q(estado__in=["ENVIADA", "ACEPTADA", "PROCESO_PAGO", "COMPLETADA"])
+        | Q(estado="RECHAZADA", presupuesto_estimado__isnull=False)
+    ).update(enviada_en=models.F("creado_en"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FM', '0034_metricadiaria_servicio_do_nothing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cotizacion',
+            name='enviada_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(marcar_enviadas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+import django.contrib.postgres.fields.ranges
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+import FM.models
+
+
+CONSTRAINT_NAME = "fm_visita_sin_solape"
+
+
+def quitar_restriccion_manual(apps, schema_editor):
+    """
+    0015/0021 crearon la restriccion con SQL crudo, fuera del estado de los modelos.
+    Se elimina para volver a crearla con AddConstraint y que makemigrations la siga.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name("FM_visitatecnica")
+    schema_editor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {CONSTRAINT_NAME}")
+
+
+def restaurar_restriccion_manual(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name("FM_visitatecnica")
+    schema_editor.execute(
+        f"""
+        ALTER TABLE {table} ADD CONSTRAINT {CONSTRAINT_NAME}
+        EXCLUDE USING gist (tecnico_id WITH =, tstzrange(inicio, fin, '[]') WITH &&)
+        WHERE (inicio IS NOT NULL)
+        """
+    )
+
+
+class ExtensionBtreeGist(BtreeGistExtension):
+    # La extension ya la creo 0015: al revertir se conserva (y fuera de Postgres no hay nada que consultar)
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("FM", "0035_cotizacion_enviada_en"),
+    ]
+
+    operations = [
+        migrations.RunPython(quitar_restriccion_manual, restaurar_restriccion_manual),
+        # Solo actua en Postgres, igual que ExclusionPostgres (sin DDL en otros motores)
+        ExtensionBtreeGist(),
+        migrations.AddConstraint(
+            model_name="visitatecnica",
+            constraint=FM.models.ExclusionPostgres(
+                condition=models.Q(("inicio__isnull", False)),
+                expressions=[
+                    ("tecnico", "="),
+                    (
+                        FM.models.TsTzRange(
+                            "inicio",
+                            "fin",
+                            django.contrib.postgres.fields.ranges.RangeBoundary(
+                                inclusive_lower=True, inclusive_upper=True
+                            ),
+                        ),
+                        "&&",
+                    ),
+                ],
+                name="fm_visita_sin_solape",
+            ),
+        ),
+    ]
@@ -1,9 +1,14 @@
-﻿from django.db import models
+﻿from django.db import DEFAULT_DB_ALIAS, connections, models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.utils.text import slugify
 from django.conf import settings
+from datetime import datetime, timedelta
+import secrets
 
 
 # ===== Base con timestamps =====
@@ -37,6 +42,13 @@ class User(AbstractUser):
     acepta_privacidad_at = models.DateTimeField(blank=True, null=True)
     security_question = models.CharField(max_length=200, blank=True, null=True)
     security_answer_hash = models.CharField(max_length=256, blank=True, null=True)
+    # Token secreto del calendario .ics con todos los tecnicos (solo staff); se rota para revocar el enlace
+    ical_token = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False)
+
+    def regenerar_ical_token(self):
+        self.ical_token = secrets.token_urlsafe(24)
+        self.save(update_fields=["ical_token"])
+
     def __str__(self):
         return f"{self.get_full_name() or self.username} ({self.rol})"
 
@@ -52,6 +64,8 @@ class Tecnico(TimeStampedModel):
     servicio = models.ForeignKey("Servicio", on_delete=models.SET_NULL, null=True, blank=True, related_name="tecnicos")
     especialidad = models.CharField(max_length=150, blank=True, null=True)
     activo = models.BooleanField(default=True)
+    # Token secreto de la URL del calendario .ics (solo lectura)
+    ical_token = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False)
 
     class Meta:
         ordering = ["nombre", "apellido", "id"]
@@ -65,7 +79,36 @@ class Tecnico(TimeStampedModel):
         if not self.slug:
             base = f"{self.nombre or ''} {self.apellido or ''}".strip() or (self.correo or "")
             self.slug = slugify(base)[:80]
+        if not self.ical_token:
+            self.ical_token = secrets.token_urlsafe(24)
+        nuevo = self._state.adding
+        update_fields = kwargs.get("update_fields")
         super().save(*args, **kwargs)
+        if update_fields is not None and not {"slug", "nombre", "apellido"} & set(update_fields):
+            return
+        # Las visitas guardan una copia del slug y nombre (historial y correos); se mantiene al dia
+        copia = (self.slug, self.nombre_completo)
+        if not nuevo and copia != getattr(self, "_copia_visitas", None):
+            self.visitas.exclude(tecnico_slug=copia[0], tecnico_nombre=copia[1]).update(
+                tecnico_slug=copia[0], tecnico_nombre=copia[1], actualizado_en=timezone.now()
+            )
+        self._copia_visitas = copia
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Slug y nombre tal como estan en la base, para saber si save() debe tocar las visitas
+        if not instance.get_deferred_fields() & {"slug", "nombre", "apellido"}:
+            instance._copia_visitas = (instance.slug, instance.nombre_completo)
+        return instance
+
+    @property
+    def nombre_completo(self):
+        return f"{self.nombre} {self.apellido or ''}".strip()
+
+    def regenerar_ical_token(self):
+        self.ical_token = secrets.token_urlsafe(24)
+        self.save(update_fields=["ical_token"])
 
     def __str__(self):
         return f"{self.nombre} {self.apellido or ''}".strip() or self.correo
@@ -84,6 +127,9 @@ class Region(TimeStampedModel):
 class Comuna(TimeStampedModel):
     nombre = models.CharField(max_length=120)
     region = models.ForeignKey(Region, on_delete=models.CASCADE, related_name="comunas")
+    # Centroide aproximado (cabecera comunal), cargado desde FM/data/comunas_centroides.csv
+    lat = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    lng = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
 
     class Meta:
         ordering = ["region__nombre", "nombre"]
@@ -132,6 +178,35 @@ class ServicioFAQ(models.Model):
     class Meta:
         ordering = ["orden", "id"]
 
+# ===== Cobertura de servicio =====
+class Cobertura(TimeStampedModel):
+    """
+    Excepciones a la cobertura por comuna. Sin fila la comuna se atiende; una fila con servicio
+    vacio aplica a todos los servicios y una con servicio especifico la reemplaza para ese servicio.
+    FM.cobertura la carga en memoria para el chequeo durante la recepcion de solicitudes.
+    """
+    comuna = models.ForeignKey(Comuna, on_delete=models.CASCADE, related_name="coberturas")
+    servicio = models.ForeignKey(
+        Servicio, on_delete=models.CASCADE, null=True, blank=True, related_name="coberturas",
+        help_text="Vacio = todos los servicios.",
+    )
+    cubierta = models.BooleanField(default=False, help_text="Desmarcado = no se atiende en esta comuna.")
+    motivo = models.CharField(max_length=200, blank=True, help_text="Mensaje que ve el cliente al quedar fuera de cobertura.")
+
+    class Meta:
+        ordering = ["comuna__region__nombre", "comuna__nombre", "servicio__titulo"]
+        constraints = [
+            models.UniqueConstraint(fields=["comuna", "servicio"], name="fm_cobertura_comuna_servicio_unica"),
+            models.UniqueConstraint(
+                fields=["comuna"], condition=models.Q(servicio__isnull=True), name="fm_cobertura_comuna_general_unica"
+            ),
+        ]
+
+    def __str__(self):
+        alcance = self.servicio.titulo if self.servicio_id else "todos los servicios"
+        return f"{self.comuna.nombre}: {'con' if self.cubierta else 'sin'} cobertura ({alcance})"
+
+
 # ===== Edificios (para mapas/reporting) =====
 class Edificio(TimeStampedModel):
     nombre = models.CharField(max_length=160)
@@ -171,6 +246,8 @@ class Cotizacion(TimeStampedModel):
     comuna = models.CharField(max_length=80, blank=True, null=True)
     estado = models.CharField(max_length=15, choices=Estado.choices, default=Estado.PENDIENTE)
     resuelto_en = models.DateTimeField(blank=True, null=True)
+    # Primera vez que la cotizacion llego al cliente con precio (enviada o aceptada por el admin); base del embudo
+    enviada_en = models.DateTimeField(blank=True, null=True)
     motivo_rechazo = models.TextField(blank=True, null=True)
     mp_preference_id = models.CharField(max_length=80, blank=True, null=True)
     mp_payment_id = models.CharField(max_length=80, blank=True, null=True)
@@ -186,8 +263,12 @@ class Cotizacion(TimeStampedModel):
     tb_redirect_url = models.TextField(blank=True, null=True)
     class Meta:
         indexes = [
-            models.Index(fields=["estado"]),
             models.Index(fields=["creado_en"]),
+            # Paginacion por cursor de los listados de administracion (FM/paginacion.py); el primero
+            # tambien cubre los filtros por estado que usaba el indice simple
+            models.Index(fields=["estado", "creado_en", "id"]),
+            models.Index(fields=["estado", "resuelto_en", "id"]),
+            models.Index(fields=["resuelto_en", "id"]),
         ]
     @property
     def total_items(self):
@@ -210,7 +291,131 @@ class CotizacionItem(models.Model):
     precio_unit = models.DecimalField(max_digits=14, decimal_places=2, default=0, validators=[MinValueValidator(0)])
 
 
+# ===== Metricas (rollup de cotizaciones) =====
+class MetricaDiaria(models.Model):
+    """
+    Cotizaciones creadas cada dia agrupadas por su estado actual, servicio y region.
+    FM.metricas la mantiene al guardar cada Cotizacion (mueve la cuenta entre estados) y
+    compactar_metricas la recalcula cada noche; los reportes leen solo estas filas.
+    """
+    fecha = models.DateField()
+    estado = models.CharField(max_length=15, choices=Cotizacion.Estado.choices)
+    # Al eliminar el servicio sus filas se suman a las sin servicio (FM.metricas.fusionar_servicio, pre_delete)
+    servicio = models.ForeignKey(Servicio, on_delete=models.DO_NOTHING, null=True, blank=True, related_name="+")
+    region = models.CharField(max_length=80, blank=True, default="")
+    cantidad = models.IntegerField(default=0)
+    monto = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["fecha", "estado"]
+        constraints = [
+            models.UniqueConstraint(fields=["fecha", "estado", "servicio", "region"], name="fm_metrica_clave_unica"),
+            models.UniqueConstraint(
+                fields=["fecha", "estado", "region"],
+                condition=models.Q(servicio__isnull=True),
+                name="fm_metrica_clave_sin_servicio_unica",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.fecha} {self.estado} {self.servicio_id or '-'} {self.region or '-'}: {self.cantidad}"
+
+
+class VisitaRecurrente(TimeStampedModel):
+    """Mantencion periodica de un edificio (p. ej. revision mensual de calderas), al estilo RRULE."""
+    class Frecuencia(models.TextChoices):
+        DIARIA = "DAILY", "Diaria"
+        SEMANAL = "WEEKLY", "Semanal"
+        MENSUAL = "MONTHLY", "Mensual"
+        ANUAL = "YEARLY", "Anual"
+    edificio = models.ForeignKey(Edificio, on_delete=models.CASCADE, related_name="visitas_recurrentes")
+    servicio = models.ForeignKey(Servicio, on_delete=models.SET_NULL, null=True, blank=True, related_name="visitas_recurrentes")
+    # Sin tecnico fijo, el generador elige uno con el Asignador en cada ocurrencia
+    tecnico = models.ForeignKey(Tecnico, on_delete=models.SET_NULL, null=True, blank=True, related_name="visitas_recurrentes")
+    frecuencia = models.CharField(max_length=7, choices=Frecuencia.choices, default=Frecuencia.MENSUAL)
+    intervalo = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)])
+    # Solo semanal: dias en formato RRULE separados por coma (MO,TU,WE,TH,FR,SA,SU); vacio = dia de fecha_inicio
+    dias_semana = models.CharField(max_length=30, blank=True)
+    # Solo mensual/anual: dia del mes (si el mes es mas corto se usa el ultimo dia); vacio = dia de fecha_inicio
+    dia_mes = models.PositiveSmallIntegerField(blank=True, null=True)
+    hora = models.TimeField()
+    fecha_inicio = models.DateField()
+    fecha_fin = models.DateField(blank=True, null=True)
+    correo = models.EmailField(blank=True, null=True)
+    notas = models.TextField(blank=True, null=True)
+    activa = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["edificio__nombre", "hora", "id"]
+        indexes = [
+            models.Index(fields=["activa", "fecha_inicio"]),
+        ]
+
+    def clean(self):
+        # El generador solo reserva bloques de la agenda: una hora fuera de la grilla se moveria en cada ocurrencia
+        from .agenda import JORNADA_INICIO, MINUTOS_SLOT, SLOTS_DIA, hora_a_slot, slot_a_hora
+
+        if self.hora and hora_a_slot(self.hora) is None:
+            raise ValidationError({
+                "hora": f"La hora debe calzar con la agenda: entre {JORNADA_INICIO:%H:%M} y "
+                f"{slot_a_hora(SLOTS_DIA - 1):%H:%M}, cada {MINUTOS_SLOT} minutos."
+            })
+
+    @property
+    def rrule(self):
+        partes = [f"FREQ={self.frecuencia}", f"INTERVAL={self.intervalo}"]
+        if self.frecuencia == self.Frecuencia.SEMANAL and self.dias_semana:
+            partes.append(f"BYDAY={self.dias_semana}")
+        if self.frecuencia in (self.Frecuencia.MENSUAL, self.Frecuencia.ANUAL) and self.dia_mes:
+            partes.append(f"BYMONTHDAY={self.dia_mes}")
+        if self.fecha_fin:
+            partes.append(f"UNTIL={self.fecha_fin:%Y%m%d}")
+        return ";".join(partes)
+
+    def __str__(self):
+        servicio = self.servicio.titulo if self.servicio_id else "Mantencion"
+        return f"{servicio} - {self.edificio} ({self.get_frecuencia_display().lower()})"
+
+
+class TsTzRange(models.Func):
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+
+class ExclusionPostgres(ExclusionConstraint):
+    """
+    Restriccion de exclusion que solo existe en Postgres. En otros motores no genera DDL (tampoco al
+    reconstruir la tabla en SQLite) ni valida: ahi las reservas las serializa FM.agenda.reserva_atomica.
+    """
+
+    def constraint_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return None
+        return super().constraint_sql(model, schema_editor)
+
+    def create_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return None
+        return super().create_sql(model, schema_editor)
+
+    def remove_sql(self, model, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return None
+        return super().remove_sql(model, schema_editor)
+
+    def validate(self, model, instance, exclude=None, using=DEFAULT_DB_ALIAS):
+        if connections[using].vendor == "postgresql":
+            super().validate(model, instance, exclude=exclude, using=using)
+
+
 class VisitaTecnica(TimeStampedModel):
+    # Un tecnico no puede tener dos visitas a menos de 3 horas de distancia:
+    # cada visita bloquea el intervalo [inicio, inicio + VENTANA_CONFLICTO].
+    VENTANA_CONFLICTO = timedelta(hours=3)
+
+    tecnico = models.ForeignKey(Tecnico, on_delete=models.SET_NULL, null=True, blank=True, related_name="visitas")
+    # Copia del slug y nombre al agendar: se conserva si el tecnico se elimina
     tecnico_slug = models.CharField(max_length=60)
     tecnico_nombre = models.CharField(max_length=120)
     cliente = models.CharField(max_length=150)
@@ -222,13 +427,93 @@ class VisitaTecnica(TimeStampedModel):
     direccion = models.CharField(max_length=200, blank=True, null=True)
     notas = models.TextField(blank=True, null=True)
     cotizacion = models.ForeignKey(Cotizacion, on_delete=models.SET_NULL, null=True, blank=True, related_name="visitas")
+    recurrencia = models.ForeignKey(VisitaRecurrente, on_delete=models.SET_NULL, null=True, blank=True, related_name="visitas")
+    # Fecha de la ocurrencia de la regla que genero la visita; no cambia al reprogramar (fecha si)
+    fecha_ocurrencia = models.DateField(blank=True, null=True, editable=False)
+    # Intervalo bloqueado en la agenda (derivado de fecha/hora); nulo si la visita no tiene hora
+    inicio = models.DateTimeField(blank=True, null=True, editable=False)
+    fin = models.DateTimeField(blank=True, null=True, editable=False)
 
     class Meta:
         ordering = ["fecha", "hora", "id"]
+        indexes = [
+            models.Index(fields=["tecnico", "fecha", "hora"]),
+            models.Index(fields=["tecnico", "inicio"]),
+            # Agenda por ventana de fechas paginada por cursor (fecha, hora, id)
+            models.Index(fields=["fecha", "hora", "id"]),
+            # Sincronizacion incremental del calendario: visitas cambiadas desde un cursor
+            models.Index(fields=["actualizado_en"]),
+        ]
+        constraints = [
+            # Una visita por ocurrencia de cada regla: el generador puede re-ejecutarse sin duplicar,
+            # aunque la visita se haya movido a otra fecha (incluso a la de otra ocurrencia)
+            models.UniqueConstraint(
+                fields=["recurrencia", "fecha_ocurrencia"], name="fm_visita_recurrencia_ocurrencia_unica"
+            ),
+            # Un tecnico no puede tener dos intervalos [inicio, fin] superpuestos (FM.agenda.RESTRICCION_SIN_SOLAPE)
+            ExclusionPostgres(
+                name="fm_visita_sin_solape",
+                expressions=[
+                    ("tecnico", RangeOperators.EQUAL),
+                    (
+                        TsTzRange("inicio", "fin", RangeBoundary(inclusive_lower=True, inclusive_upper=True)),
+                        RangeOperators.OVERLAPS,
+                    ),
+                ],
+                condition=models.Q(inicio__isnull=False),
+            ),
+        ]
+
+    @classmethod
+    def intervalo_para(cls, fecha, hora):
+        if not (fecha and hora):
+            return None, None
+        inicio = datetime.combine(fecha, hora)
+        if settings.USE_TZ:
+            inicio = timezone.make_aware(inicio)
+        return inicio, inicio + cls.VENTANA_CONFLICTO
+
+    def calcular_intervalo(self):
+        self.inicio, self.fin = self.intervalo_para(self.fecha, self.hora)
+
+    def resolver_tecnico(self):
+        """Completa la FK desde el slug (codigo antiguo que solo asigna tecnico_slug) y sincroniza las copias."""
+        if self.tecnico_id is None and self.tecnico_slug:
+            self.tecnico = Tecnico.objects.filter(slug=self.tecnico_slug).first()
+        elif self.tecnico_id is not None and VisitaTecnica.tecnico.is_cached(self):
+            tecnico = self.tecnico
+            self.tecnico_slug = tecnico.slug or self.tecnico_slug
+            self.tecnico_nombre = f"{tecnico.nombre} {tecnico.apellido or ''}".strip()
+
+    def save(self, *args, **kwargs):
+        self.calcular_intervalo()
+        self.resolver_tecnico()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            # actualizado_en es el cursor de sincronizacion: debe avanzar aunque se guarden solo algunos campos
+            extra = {"actualizado_en"} | ({"inicio", "fin"} if {"fecha", "hora"} & set(update_fields) else set())
+            if {"tecnico", "tecnico_slug"} & set(update_fields):
+                extra |= {"tecnico", "tecnico_slug", "tecnico_nombre"}
+            kwargs["update_fields"] = set(update_fields) | extra
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.tecnico_nombre} - {self.fecha}"
 
+
+class VisitaEliminada(models.Model):
+    """Registro de visitas borradas, para que los clientes que sincronizan por cursor sepan quitarlas."""
+    visita_id = models.PositiveIntegerField()
+    tecnico_slug = models.CharField(max_length=60, blank=True)
+    fecha = models.DateField(blank=True, null=True)
+    eliminado_en = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ["-eliminado_en"]
+
+    def __str__(self):
+        return f"Visita #{self.visita_id} eliminada"
+
 # ===== Trabajos (agenda/metricas) =====
 class Trabajo(TimeStampedModel):
     class Estado(models.TextChoices):
@@ -277,6 +562,17 @@ class ContactoWeb(TimeStampedModel):
 def documento_upload_path(instance, filename):
     return f"documentos/{filename}"
 
+class Etiqueta(models.Model):
+    # clave: nombre en minusculas, lo que se busca; nombre: como se escribio la primera vez
+    clave = models.CharField(max_length=255, unique=True)
+    nombre = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ["clave"]
+
+    def __str__(self):
+        return self.nombre
+
 class Documento(TimeStampedModel):
     class Categoria(models.TextChoices):
         FACTURA = "FACTURA", "Factura"
@@ -293,6 +589,7 @@ class Documento(TimeStampedModel):
     storage_bucket = models.CharField(max_length=120, blank=True, null=True)
     categoria = models.CharField(max_length=20, choices=Categoria.choices, default=Categoria.OTRO)
     tags = models.CharField(max_length=255, blank=True, null=True, help_text="Separar por comas")
+    etiquetas = models.ManyToManyField(Etiqueta, blank=True, related_name="documentos", editable=False)
     publico = models.BooleanField(default=True)
     subido_por = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -310,8 +607,8 @@ class Documento(TimeStampedModel):
 
     @property
     def tags_list(self):
-        raw = self.tags or ""
-        return [t.strip() for t in raw.split(",") if t.strip()]
+        # Usar con prefetch_related("etiquetas") en listados
+        return [e.nombre for e in self.etiquetas.all()]
 
     @property
     def url(self):
@@ -0,0 +1,131 @@
+from dataclasses import dataclass, field
+from functools import reduce
+from operator import or_
+
+from django.core import signing
+from django.db.models import F, Q
+
+
+# Paginacion por cursor (keyset) sobre (campos..., id): cada pagina parte desde la ultima fila vista con un rango
+# sobre el indice, asi la pagina N cuesta lo mismo que la primera. Los nulos van al final. Si el primer campo
+# admite nulos, esas filas forman un segundo tramo consultado aparte para no romper la condicion de rango.
+TAMANO = 25
+SALT = "FM.paginacion"
+
+
+@dataclass
+class Pagina:
+    items: list = field(default_factory=list)
+    siguiente: str = ""  # cursor de la pagina siguiente ("" si es la ultima)
+    anterior: str = ""  # cursor de la pagina anterior ("" si es la primera)
+
+
+def _valor_json(valor):
+    return valor.isoformat() if hasattr(valor, "isoformat") else valor
+
+
+class Paginador:
+    def __init__(self, queryset, campos, tamano=TAMANO, descendente=True):
+        self.queryset = queryset
+        self.campos = (campos,) if isinstance(campos, str) else tuple(campos)
+        self.tamano = tamano
+        self.descendente = descendente
+        meta = queryset.model._meta
+        self._fields = {c: meta.get_field(c) for c in self.campos}
+        self.tramos = (0, 1) if self._fields[self.campos[0]].null else (0,)
+
+    def _tramo(self, obj):
+        return 1 if getattr(obj, self.campos[0]) is None else 0
+
+    def _cursor(self, obj, direccion):
+        valores = [_valor_json(getattr(obj, c)) for c in self.campos]
+        return signing.dumps([direccion, self._tramo(obj), valores, obj.pk], salt=SALT, compress=True)
+
+    def _leer(self, cursor):
+        try:
+            direccion, tramo, valores, pk = signing.loads(cursor, salt=SALT)
+            valores = [self._fields[c].to_python(v) if v is not None else None for c, v in zip(self.campos, valores, strict=True)]
+        except Exception:
+            return None  # cursor invalido o manipulado: primera pagina
+        if direccion not in ("sig", "ant") or tramo not in self.tramos:
+            return None
+        return direccion, tramo, valores, pk
+
+    def _orden(self, columnas, adelante):
+        ascendente = self.descendente != adelante
+        orden = []
+        for c in columnas:
+            # El primer campo nunca trae nulos en su tramo; sin NULLS FIRST/LAST el orden coincide con el indice
+            nulos = {}
+            if self._fields[c].null and c != self.campos[0]:
+                nulos = {"nulls_last": True} if adelante else {"nulls_first": True}
+            orden.append(F(c).asc(**nulos) if ascendente else F(c).desc(**nulos))
+        return orden + ["pk" if ascendente else "-pk"]
+
+    def _despues(self, columnas, valores, pk, adelante):
+        """Filas posteriores a (valores, pk) en el sentido de la consulta, con los nulos al final de la pagina."""
+        op = "gt" if self.descendente != adelante else "lt"
+        ramas, iguales = [], Q()
+        for c, v in zip(columnas, valores):
+            if v is None:
+                if not adelante:
+                    ramas.append(iguales & Q(**{f"{c}__isnull": False}))
+                iguales &= Q(**{f"{c}__isnull": True})
+                continue
+            rama = Q(**{f"{c}__{op}": v})
+            if adelante and self._fields[c].null:
+                rama |= Q(**{f"{c}__isnull": True})
+            ramas.append(iguales & rama)
+            iguales &= Q(**{c: v})
+        ramas.append(iguales & Q(**{f"pk__{op}": pk}))
+        condicion = reduce(or_, ramas)
+        if columnas and valores[0] is not None:
+            # Rango sobre la primera columna: es lo que el indice usa para saltar directo al cursor
+            condicion &= Q(**{f"{columnas[0]}__{op}e": valores[0]})
+        return condicion
+
+    def _consulta(self, tramo, limite, adelante):
+        """Filas del tramo en orden de pagina (adelante) o inverso (atras), desde el limite (valores, pk) exclusivo."""
+        primero = self.campos[0]
+        if tramo == 0:
+            columnas = self.campos
+            qs = self.queryset.filter(**{f"{primero}__isnull": False}) if len(self.tramos) > 1 else self.queryset
+        else:
+            columnas = self.campos[1:]
+            qs = self.queryset.filter(**{f"{primero}__isnull": True})
+        if limite is not None:
+            valores, pk = limite
+            qs = qs.filter(self._despues(columnas, valores[len(self.campos) - len(columnas):], pk, adelante))
+        return qs.order_by(*self._orden(columnas, adelante))
+
+    def _recorrer(self, tramos, tramo_inicial, limite, adelante):
+        filas = []
+        for tramo in tramos:
+            faltan = self.tamano + 1 - len(filas)
+            if faltan <= 0:
+                break
+            filas += list(self._consulta(tramo, limite if tramo == tramo_inicial else None, adelante)[:faltan])
+        return filas
+
+    def pagina(self, cursor=""):
+        posicion = self._leer(cursor) if cursor else None
+        if posicion is None or posicion[0] == "sig":
+            tramo_inicial = posicion[1] if posicion else 0
+            limite = posicion[2:] if posicion else None
+            filas = self._recorrer([t for t in self.tramos if t >= tramo_inicial], tramo_inicial, limite, True)
+            items = filas[: self.tamano]
+            return Pagina(
+                items=items,
+                siguiente=self._cursor(items[-1], "sig") if len(filas) > self.tamano else "",
+                anterior=self._cursor(items[0], "ant") if posicion and items else "",
+            )
+        _, tramo_inicial, valores, pk = posicion
+        filas = self._recorrer([t for t in reversed(self.tramos) if t <= tramo_inicial], tramo_inicial, (valores, pk), False)
+        items = filas[: self.tamano][::-1]
+        if not items:
+            return self.pagina()
+        return Pagina(
+            items=items,
+            siguiente=self._cursor(items[-1], "sig"),
+            anterior=self._cursor(items[0], "ant") if len(filas) > self.tamano else "",
+        )
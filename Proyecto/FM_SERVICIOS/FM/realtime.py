@@ -0,0 +1,308 @@
+"""
+Avisos en tiempo real (ASGI puro, sin dependencias extra).
+config/asgi.py enruta /ws/agenda/ a agenda_websocket; las senales publican cada cambio de
+VisitaTecnica en el broker configurado en settings.FM_REALTIME_BROKER. Los contadores del panel
+de administracion se envian por Server-Sent Events desde un DifusorStats por proceso; con varios
+workers el broker y la cache (settings.CACHES) deben ser compartidos.
+"""
+import asyncio
+import json
+import logging
+import threading
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+CANAL_AGENDA = "agenda"
+CANAL_DASHBOARD = "dashboard"
+RUTA_AGENDA = "/ws/agenda/"
+# Un cliente lento no debe acumular memoria: si su cola se llena se le pide resincronizar
+COLA_MAXIMA = 200
+PING_SEGUNDOS = 25
+
+
+def _encolar(cola, mensaje):
+    try:
+        cola.put_nowait(mensaje)
+    except asyncio.QueueFull:
+        while not cola.empty():
+            cola.get_nowait()
+        cola.put_nowait({"tipo": "resync"})
+
+
+class BrokerMemoria:
+    """
+    Canal en memoria del proceso. Basta con un solo worker ASGI (runserver con daphne, uvicorn sin --workers);
+    con varios procesos usa un broker compartido como BrokerRedis.
+    """
+
+    def __init__(self):
+        self._suscriptores = {}
+        self._lock = threading.Lock()
+
+    def publicar(self, canal, mensaje):
+        # Se llama desde codigo sincrono (senales, on_commit): cada mensaje se entrega en el loop del suscriptor
+        with self._lock:
+            suscriptores = list(self._suscriptores.get(canal, ()))
+        for loop, cola in suscriptores:
+            try:
+                loop.call_soon_threadsafe(_encolar, cola, mensaje)
+            except RuntimeError:
+                pass  # loop cerrado; se limpia al desuscribir
+
+    async def suscribir(self, canal):
+        cola = asyncio.Queue(maxsize=COLA_MAXIMA)
+        with self._lock:
+            self._suscriptores.setdefault(canal, set()).add((asyncio.get_running_loop(), cola))
+        return cola
+
+    async def desuscribir(self, canal, cola):
+        with self._lock:
+            self._suscriptores.get(canal, set()).discard((asyncio.get_running_loop(), cola))
+
+
+class BrokerRedis:
+    """Pub/sub de Redis para varios workers o servidores (settings.FM_REALTIME_REDIS_URL; requiere el paquete redis)."""
+
+    def __init__(self, url=None):
+        try:
+            import redis  # noqa: F401
+        except ImportError as exc:
+            raise ImproperlyConfigured("BrokerRedis requiere el paquete 'redis' (pip install redis).") from exc
+        self.url = url or getattr(settings, "FM_REALTIME_REDIS_URL", "redis://localhost:6379/0")
+        self._cliente = None
+        self._lecturas = {}
+
+    def _canal(self, canal):
+        return f"fm:realtime:{canal}"
+
+    def publicar(self, canal, mensaje):
+        import redis
+
+        if self._cliente is None:
+            self._cliente = redis.Redis.from_url(self.url)
+        self._cliente.publish(self._canal(canal), json.dumps(mensaje))
+
+    async def suscribir(self, canal):
+        import redis.asyncio as aioredis
+
+        cliente = aioredis.from_url(self.url)
+        pubsub = cliente.pubsub()
+        await pubsub.subscribe(self._canal(canal))
+        cola = asyncio.Queue(maxsize=COLA_MAXIMA)
+
+        async def leer():
+            async for item in pubsub.listen():
+                if item.get("type") == "message":
+                    _encolar(cola, json.loads(item["data"]))
+
+        self._lecturas[id(cola)] = (asyncio.ensure_future(leer()), pubsub, cliente)
+        return cola
+
+    async def desuscribir(self, canal, cola):
+        tarea, pubsub, cliente = self._lecturas.pop(id(cola), (None, None, None))
+        if tarea is None:
+            return
+        tarea.cancel()
+        await pubsub.unsubscribe(self._canal(canal))
+        await cliente.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, "FM_REALTIME_BROKER", "FM.realtime.BrokerMemoria"))()
+    return _broker
+
+
+def publicar(mensaje, canal=CANAL_AGENDA):
+    # Un broker caido no debe impedir guardar visitas: los clientes tienen el refresco periodico de respaldo
+    try:
+        get_broker().publicar(canal, mensaje)
+    except Exception:
+        logger.exception("No se pudo publicar el aviso en tiempo real")
+
+
+def publicar_visita(visita):
+    from .calendario import visita_json
+
+    publicar({"tipo": "visita", "accion": "guardada", "visita": visita_json(visita)})
+
+
+def publicar_eliminacion(visita_id, fecha):
+    publicar({"tipo": "visita", "accion": "eliminada", "visita": {"id": visita_id, "fecha": fecha.isoformat()}})
+
+
+def publicar_resync():
+    """Para cambios masivos (bulk_create/bulk_update): los clientes piden el delta en vez de recibir cada visita."""
+    publicar({"tipo": "resync"})
+
+
+def publicar_stats():
+    """Los contadores del panel cambiaron; cada proceso los recalcula una vez y los reparte a sus paneles abiertos."""
+    publicar({"tipo": "stats"}, canal=CANAL_DASHBOARD)
+
+
+class DifusorStats:
+    """
+    Un solo suscriptor al canal del panel por proceso: ante cada aviso recalcula los contadores una vez
+    y entrega el resultado a todos los streams abiertos. Con N paneles abiertos el costo sigue siendo uno.
+    """
+
+    def __init__(self):
+        self._clientes = set()
+        self._tarea = None
+
+    async def _stats(self, recalcular=False):
+        from .estadisticas import refrescar_stats, stats_dashboard
+
+        # Tras un aviso se recalcula siempre: la cache de este proceso (o un valor guardado antes del commit)
+        # podria seguir con los contadores viejos
+        return await sync_to_async(refrescar_stats if recalcular else stats_dashboard)()
+
+    async def conectar(self):
+        # Cola de un elemento: un panel lento solo necesita el valor mas reciente
+        cola = asyncio.Queue(maxsize=1)
+        self._clientes.add(cola)
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.ensure_future(self._escuchar())
+        _reemplazar(cola, await self._stats())
+        return cola
+
+    def desconectar(self, cola):
+        self._clientes.discard(cola)
+        if not self._clientes and self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    async def _escuchar(self):
+        broker = get_broker()
+        avisos = await broker.suscribir(CANAL_DASHBOARD)
+        try:
+            _, ultimo = await self._stats()
+            while True:
+                await avisos.get()
+                while not avisos.empty():
+                    avisos.get_nowait()  # una rafaga de cambios se resuelve con un solo calculo
+                try:
+                    stats = await self._stats(recalcular=True)
+                except Exception:
+                    logger.exception("No se pudieron recalcular los contadores del panel")
+                    continue
+                if stats[1] == ultimo:
+                    continue
+                ultimo = stats[1]
+                for cola in list(self._clientes):
+                    _reemplazar(cola, stats)
+        finally:
+            await broker.desuscribir(CANAL_DASHBOARD, avisos)
+
+
+def _reemplazar(cola, valor):
+    if cola.full():
+        cola.get_nowait()
+    cola.put_nowait(valor)
+
+
+_difusores = {}
+
+
+def get_difusor_stats():
+    # Uno por event loop: las colas asyncio no se comparten entre loops
+    loop = asyncio.get_running_loop()
+    if loop not in _difusores:
+        for viejo in [l for l in _difusores if l.is_closed()]:
+            del _difusores[viejo]
+        _difusores[loop] = DifusorStats()
+    return _difusores[loop]
+
+
+async def stream_stats():
+    """Cuerpo text/event-stream: un evento "stats" por cambio (id = ETag) y un comentario de ping si no hay cambios."""
+    difusor = get_difusor_stats()
+    cola = await difusor.conectar()
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                stats, etag = await asyncio.wait_for(cola.get(), timeout=PING_SEGUNDOS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield f"id: {etag}\nevent: stats\ndata: {json.dumps(stats)}\n\n"
+    finally:
+        # Django cancela el generador cuando el navegador cierra la conexion
+        difusor.desconectar(cola)
+
+
+def _headers(scope):
+    return {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+
+def _origen_valido(headers):
+    # Evita que otra pagina abra el socket con la cookie del admin (cross-site WebSocket hijacking)
+    origen = headers.get("origin")
+    return not origen or urlsplit(origen).netloc == headers.get("host")
+
+
+def _usuario_staff(session_key):
+    from django.contrib.auth import get_user
+
+    engine = import_module(settings.SESSION_ENGINE)
+    user = get_user(SimpleNamespace(session=engine.SessionStore(session_key)))
+    return user.is_authenticated and (user.is_staff or user.is_superuser)
+
+
+async def _autorizado(headers):
+    cookie = SimpleCookie()
+    cookie.load(headers.get("cookie", ""))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None or not _origen_valido(headers):
+        return False
+    return await sync_to_async(_usuario_staff)(morsel.value)
+
+
+async def agenda_websocket(scope, receive, send):
+    evento = await receive()
+    if evento["type"] != "websocket.connect":
+        return
+    if not await _autorizado(_headers(scope)):
+        await send({"type": "websocket.close", "code": 4403})
+        return
+    await send({"type": "websocket.accept"})
+    broker = get_broker()
+    cola = await broker.suscribir(CANAL_AGENDA)
+    recibir = asyncio.ensure_future(receive())
+    leer = asyncio.ensure_future(cola.get())
+    try:
+        while True:
+            listos, _ = await asyncio.wait({recibir, leer}, timeout=PING_SEGUNDOS, return_when=asyncio.FIRST_COMPLETED)
+            if not listos:
+                await send({"type": "websocket.send", "text": json.dumps({"tipo": "ping"})})
+                continue
+            if recibir in listos:
+                if recibir.result()["type"] == "websocket.disconnect":
+                    break
+                recibir = asyncio.ensure_future(receive())  # el cliente no envia comandos; se ignora
+            if leer in listos:
+                await send({"type": "websocket.send", "text": json.dumps(leer.result())})
+                leer = asyncio.ensure_future(cola.get())
+    finally:
+        recibir.cancel()
+        leer.cancel()
+        await broker.desuscribir(CANAL_AGENDA, cola)
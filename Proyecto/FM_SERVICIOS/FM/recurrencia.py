@@ -0,0 +1,183 @@
+import calendar
+from datetime import date, timedelta
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .agenda import RESTRICCION_SIN_SOLAPE, ConflictoAgenda, conflictos_en_lote, reserva_atomica
+from .asignacion import Asignador
+from .estadisticas import invalidar_kpis
+from .models import VisitaRecurrente, VisitaTecnica
+from .realtime import publicar_resync
+from .rutas import invalidar_dia
+
+
+DIAS_RRULE = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+HORIZONTE_DIAS = 60
+# Restriccion unica (recurrencia, fecha_ocurrencia) del modelo VisitaTecnica
+RESTRICCION_OCURRENCIA = "fm_visita_recurrencia_ocurrencia_unica"
+
+
+def _fecha_mes(anio, mes, dia):
+    # BYMONTHDAY=31 en meses cortos cae en el ultimo dia del mes en vez de saltarse el mes
+    return date(anio, mes, min(dia, calendar.monthrange(anio, mes)[1]))
+
+
+def ocurrencias(regla, desde, hasta):
+    """Fechas de la regla dentro de [desde, hasta], en orden (subconjunto de RRULE: FREQ, INTERVAL, BYDAY, BYMONTHDAY, UNTIL)."""
+    inicio = regla.fecha_inicio
+    fin = min(hasta, regla.fecha_fin) if regla.fecha_fin else hasta
+    desde = max(desde, inicio)
+    if desde > fin:
+        return
+    paso = max(1, regla.intervalo)
+    F = VisitaRecurrente.Frecuencia
+
+    if regla.frecuencia == F.DIARIA:
+        n = -(-(desde - inicio).days // paso)
+        fecha = inicio + timedelta(days=n * paso)
+        while fecha <= fin:
+            yield fecha
+            fecha += timedelta(days=paso)
+
+    elif regla.frecuencia == F.SEMANAL:
+        dias = sorted(DIAS_RRULE[d] for d in regla.dias_semana.upper().replace(" ", "").split(",") if d in DIAS_RRULE)
+        dias = dias or [inicio.weekday()]
+        lunes = inicio - timedelta(days=inicio.weekday())
+        semana = (desde - lunes).days // 7 // paso * paso
+        while True:
+            base = lunes + timedelta(weeks=semana)
+            if base > fin:
+                return
+            for d in dias:
+                fecha = base + timedelta(days=d)
+                if desde <= fecha <= fin:
+                    yield fecha
+            semana += paso
+
+    elif regla.frecuencia == F.MENSUAL:
+        dia = regla.dia_mes or inicio.day
+        meses = (desde.year - inicio.year) * 12 + desde.month - inicio.month
+        n = max(0, meses // paso * paso)
+        while True:
+            anio, mes = divmod(inicio.month - 1 + n, 12)
+            fecha = _fecha_mes(inicio.year + anio, mes + 1, dia)
+            if fecha > fin:
+                return
+            if fecha >= desde:
+                yield fecha
+            n += paso
+
+    elif regla.frecuencia == F.ANUAL:
+        dia = regla.dia_mes or inicio.day
+        n = max(0, (desde.year - inicio.year) // paso * paso)
+        while True:
+            fecha = _fecha_mes(inicio.year + n, inicio.month, dia)
+            if fecha > fin:
+                return
+            if fecha >= desde:
+                yield fecha
+            n += paso
+
+
+def generar_visitas(desde, hasta, guardar=True):
+    """
+    Expande las reglas activas entre desde y hasta y crea las visitas que falten.
+    Las ocurrencias que ya tienen visita (recurrencia, fecha_ocurrencia) se omiten aunque la visita se haya
+    reprogramado, asi que re-ejecutar no duplica; la restriccion unica del modelo lo garantiza aun con
+    ejecuciones simultaneas (la que pierde lanza ConflictoAgenda y se puede reintentar).
+    Si la hora de la regla esta tomada ese dia la ocurrencia se agenda en el primer bloque libre; esas
+    visitas se reportan aparte. Retorna (visitas_nuevas, [(regla, fecha)] sin horario, visitas movidas de hora).
+    """
+    reglas = list(
+        VisitaRecurrente.objects.filter(activa=True, fecha_inicio__lte=hasta)
+        .filter(Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=desde))
+        .select_related("edificio", "servicio", "tecnico")
+    )
+    if not reglas:
+        return [], [], []
+    existentes = _ocurrencias_existentes(reglas, desde, hasta)
+    asignador = Asignador(desde=desde, dias=(hasta - desde).days + 1)
+    nuevas, sin_horario = [], []
+    for regla in reglas:
+        edificio = regla.edificio
+        for fecha in ocurrencias(regla, desde, hasta):
+            if (regla.pk, fecha) in existentes:
+                continue
+            asignacion = asignador.asignar(
+                servicio=regla.servicio,
+                region=edificio.region,
+                comuna=edificio.comuna,
+                fecha=fecha,
+                hora=regla.hora,
+                tecnicos=[regla.tecnico.slug] if regla.tecnico_id else None,
+            )
+            if asignacion is None:
+                sin_horario.append((regla, fecha))
+                continue
+            info = asignacion.tecnico_info
+            visita = VisitaTecnica(
+                recurrencia=regla,
+                fecha_ocurrencia=fecha,
+                tecnico=asignacion.tecnico,
+                tecnico_slug=info["slug"],
+                tecnico_nombre=info["nombre"],
+                cliente=edificio.nombre,
+                correo=regla.correo,
+                region=edificio.region,
+                comuna=edificio.comuna,
+                fecha=fecha,
+                hora=asignacion.hora,
+                direccion=edificio.direccion or "-",
+                notas=regla.notas or f"Mantencion periodica: {regla.servicio.titulo if regla.servicio_id else 'general'}",
+            )
+            visita.calcular_intervalo()
+            nuevas.append(visita)
+
+    if not guardar:
+        nuevas, choques = _descartar_conflictos(nuevas)
+        return nuevas, sin_horario + choques, _movidas(nuevas)
+    if not nuevas:
+        return [], sin_horario, []
+    try:
+        with reserva_atomica():
+            # Revalidacion dentro del bloqueo: otra reserva u otra ejecucion pudo entrar mientras se planificaba
+            existentes = _ocurrencias_existentes(reglas, desde, hasta)
+            nuevas = [v for v in nuevas if (v.recurrencia_id, v.fecha_ocurrencia) not in existentes]
+            nuevas, choques = _descartar_conflictos(nuevas)
+            sin_horario += choques
+            if nuevas:
+                VisitaTecnica.objects.bulk_create(nuevas, batch_size=500)
+                # bulk_create no emite post_save: se invalidan a mano las rutas de esos dias
+                for dia in {v.fecha for v in nuevas}:
+                    transaction.on_commit(partial(invalidar_dia, dia))
+                transaction.on_commit(invalidar_kpis)
+                # Un solo aviso para el lote: los calendarios abiertos piden el delta
+                transaction.on_commit(publicar_resync)
+    except IntegrityError as exc:
+        if RESTRICCION_SIN_SOLAPE in str(exc) or RESTRICCION_OCURRENCIA in str(exc):
+            raise ConflictoAgenda("La agenda cambió mientras se generaban las visitas. Vuelve a intentarlo.") from exc
+        raise
+    return nuevas, sin_horario, _movidas(nuevas)
+
+
+def _movidas(nuevas):
+    return [v for v in nuevas if v.hora != v.recurrencia.hora]
+
+
+def _ocurrencias_existentes(reglas, desde, hasta):
+    return set(
+        VisitaTecnica.objects.filter(
+            recurrencia__in=reglas, fecha_ocurrencia__gte=desde, fecha_ocurrencia__lte=hasta
+        ).values_list("recurrencia_id", "fecha_ocurrencia")
+    )
+
+
+def _descartar_conflictos(nuevas):
+    """Separa las visitas que chocan con la agenda (o entre si) en una sola consulta."""
+    conflictos = conflictos_en_lote([(v.tecnico_id, v.fecha, v.hora) for v in nuevas], entre_si=True)
+    if not conflictos:
+        return nuevas, []
+    choques = [(v.recurrencia, v.fecha) for i, v in enumerate(nuevas) if i in conflictos]
+    return [v for i, v in enumerate(nuevas) if i not in conflictos], choques
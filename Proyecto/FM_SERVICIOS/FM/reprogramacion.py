@@ -0,0 +1,170 @@
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .agenda import RESTRICCION_SIN_SOLAPE, ConflictoAgenda, conflictos_en_lote, reserva_atomica
+from .asignacion import DIAS_BUSQUEDA, Asignador
+from .email_utils import send_email
+from .estadisticas import invalidar_kpis
+from .models import VisitaTecnica
+from .realtime import publicar_visita
+from .rutas import invalidar_dia
+
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_REPROGRAMACION = ["tecnico", "tecnico_slug", "tecnico_nombre", "fecha", "hora", "inicio", "fin", "actualizado_en"]
+
+
+@dataclass
+class Cambio:
+    visita: VisitaTecnica
+    tecnico: object
+    fecha: object
+    hora: object
+    fecha_anterior: object
+    hora_anterior: object
+    tecnico_anterior: str
+
+    @property
+    def tecnico_nombre(self):
+        return f"{self.tecnico.nombre} {self.tecnico.apellido or ''}".strip()
+
+
+def planificar_ausencia(tecnico, desde, hasta, reasignar=True, dias_busqueda=DIAS_BUSQUEDA):
+    """
+    Calcula en una pasada el nuevo tecnico/horario de las visitas de un tecnico ausente entre desde y hasta.
+    Con reasignar=True se intenta primero otro tecnico el mismo dia; si no hay cupo, el primer horario
+    libre de cualquier tecnico (incluido el ausente, una vez que vuelve). Sin reasignar solo se mueve la fecha.
+    Todo se resuelve sobre la disponibilidad en memoria del Asignador y al final se valida el lote
+    completo contra la BD con una sola consulta. Retorna (cambios, visitas_sin_horario).
+    """
+    inicio = max(desde, timezone.localdate())
+    if inicio > hasta:
+        return [], []
+    # Hoy cuenta (el caso tipico es un tecnico que amanece enfermo); solo se omiten las visitas ya iniciadas
+    visitas = list(
+        tecnico.visitas.filter(fecha__gte=inicio, fecha__lte=hasta)
+        .filter(Q(inicio__isnull=True) | Q(inicio__gt=timezone.now()))
+        .select_related("cotizacion", "cotizacion__servicio")
+        .order_by("fecha", "hora", "id")
+    )
+    if not visitas:
+        return [], []
+    asignador = Asignador(desde=inicio, dias=(hasta - inicio).days + 1 + dias_busqueda)
+    asignador.disponibilidad.bloquear(tecnico.slug, inicio, hasta)
+    otros = [t.slug for t in asignador.tecnicos if t.pk != tecnico.pk]
+    candidatos = otros + [tecnico.slug] if reasignar else [tecnico.slug]
+
+    cambios, sin_horario = [], []
+    for v in visitas:
+        cot = v.cotizacion if v.cotizacion_id else None
+        datos = {
+            "servicio": cot.servicio if cot is not None and cot.servicio_id else None,
+            "region": v.region or getattr(cot, "region", None),
+            "comuna": v.comuna or getattr(cot, "comuna", None),
+        }
+        asignacion = None
+        if reasignar and otros:
+            asignacion = asignador.asignar(fecha=v.fecha, hora=v.hora, tecnicos=otros, **datos)
+        if asignacion is None:
+            asignacion = asignador.asignar(hora=v.hora, tecnicos=candidatos, **datos)
+        if asignacion is None:
+            sin_horario.append(v)
+            continue
+        cambios.append(
+            Cambio(v, asignacion.tecnico, asignacion.fecha, asignacion.hora, v.fecha, v.hora, v.tecnico_nombre)
+        )
+
+    conflictos = conflictos_en_lote([(c.tecnico.pk, c.fecha, c.hora, c.visita.pk) for c in cambios], entre_si=True)
+    if conflictos:
+        sin_horario += [c.visita for i, c in enumerate(cambios) if i in conflictos]
+        cambios = [c for i, c in enumerate(cambios) if i not in conflictos]
+    return cambios, sin_horario
+
+
+def cambios_por_cliente(cambios):
+    """Agrupa por correo de contacto para enviar un solo aviso por cliente."""
+    grupos = defaultdict(list)
+    for c in cambios:
+        correo = (c.visita.correo or "").strip().lower()
+        if correo:
+            grupos[correo].append(c)
+    return grupos
+
+
+def aplicar_reprogramacion(cambios, notificar=None):
+    """
+    Guarda todos los cambios en una transaccion con un solo bulk_update.
+    notificar(correo, cambios) se encola por cliente y corre solo si la transaccion confirma.
+    Lanza ConflictoAgenda si la agenda cambio desde que se planifico.
+    """
+    if not cambios:
+        return 0
+    ahora = timezone.now()
+    dias = set()
+    try:
+        with reserva_atomica():
+            # Revalidacion dentro del bloqueo: otra reserva pudo entrar entre la planificacion y el guardado
+            if conflictos_en_lote([(c.tecnico.pk, c.fecha, c.hora, c.visita.pk) for c in cambios], entre_si=True):
+                raise ConflictoAgenda("La agenda cambió mientras se preparaba la reprogramación. Vuelve a intentarlo.")
+            visitas = []
+            for c in cambios:
+                v = c.visita
+                dias.update((v.fecha, c.fecha))
+                v.tecnico = c.tecnico
+                v.tecnico_slug = c.tecnico.slug
+                v.tecnico_nombre = c.tecnico_nombre
+                v.fecha, v.hora = c.fecha, c.hora
+                v.calcular_intervalo()
+                v.actualizado_en = ahora
+                visitas.append(v)
+            VisitaTecnica.objects.bulk_update(visitas, CAMPOS_REPROGRAMACION, batch_size=500)
+            # bulk_update no emite post_save: se invalidan a mano las rutas y se avisa a los calendarios abiertos
+            for dia in dias:
+                transaction.on_commit(partial(invalidar_dia, dia))
+            transaction.on_commit(invalidar_kpis)
+            for v in visitas:
+                transaction.on_commit(partial(publicar_visita, v))
+            if notificar:
+                for correo, del_cliente in cambios_por_cliente(cambios).items():
+                    transaction.on_commit(partial(notificar, correo, del_cliente))
+    except IntegrityError as exc:
+        if RESTRICCION_SIN_SOLAPE in str(exc):
+            raise ConflictoAgenda() from exc
+        raise
+    return len(cambios)
+
+
+def enviar_correo_reprogramacion(correo, cambios):
+    """Un solo aviso por cliente con todas sus visitas movidas por la ausencia de un tecnico."""
+    lineas = []
+    for c in cambios:
+        antes = c.fecha_anterior.strftime("%d/%m/%Y") + (f" {c.hora_anterior:%H:%M}" if c.hora_anterior else "")
+        ahora = c.fecha.strftime("%d/%m/%Y") + (f" {c.hora:%H:%M}" if c.hora else "")
+        tecnico = c.tecnico_nombre
+        if c.tecnico_anterior and c.tecnico_anterior != tecnico:
+            tecnico = f"{tecnico} (antes {c.tecnico_anterior})"
+        lineas.append(f"- {antes} -> {ahora}, tecnico: {tecnico}")
+    cuerpo = (
+        "Hola {nombre},\n\n"
+        "Por la ausencia de uno de nuestros tecnicos tuvimos que reprogramar tu visita:\n"
+        "{detalle}\n\n"
+        "Si el nuevo horario no te acomoda, responde este correo y lo coordinamos.\n\n"
+        "Saludos,\nFM Servicios Generales"
+    ).format(nombre=cambios[0].visita.cliente or "cliente", detalle="\n".join(lineas))
+    try:
+        send_email(
+            "Visita técnica reprogramada",
+            [correo],
+            text_body=cuerpo,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+        )
+    except Exception:
+        logger.exception("No se pudo enviar correo de visita reprogramada")
@@ -0,0 +1,157 @@
+import hashlib
+
+from django.core.cache import cache
+
+from .geo import distancias, indice_comunas
+from .models import VisitaTecnica
+
+
+# La distancia en linea recta subestima el trayecto por calles; velocidad media urbana en Santiago
+FACTOR_CALLES = 1.3
+VELOCIDAD_KMH = 30.0
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def matriz_distancias(coords):
+    """Matriz simetrica de distancias haversine en km entre [(lat, lng), ...]."""
+    return distancias(coords, coords)
+
+
+def _largo(orden, dist):
+    return sum(dist[a][b] for a, b in zip(orden, orden[1:]))
+
+
+def _respeta_fijas(orden, fijas):
+    # Las visitas con hora deben quedar en el mismo orden que sus horas
+    posiciones = [fijas[i] for i in orden if i in fijas]
+    return posiciones == sorted(posiciones)
+
+
+def ordenar_paradas(dist, fijas=None):
+    """
+    Orden de recorrido (ruta abierta) para los indices de la matriz dist.
+    fijas: {indice: clave_orden} de las paradas con horario comprometido, que conservan su orden relativo.
+    Vecino mas cercano desde la primera parada fija (o la 0) y luego mejora 2-opt.
+    """
+    n = len(dist)
+    if n <= 2:
+        return sorted(range(n), key=lambda i: (fijas or {}).get(i, float("inf")))
+    fijas = fijas or {}
+    pendientes_fijas = sorted(fijas, key=fijas.get)
+    actual = pendientes_fijas.pop(0) if pendientes_fijas else 0
+    orden = [actual]
+    restantes = set(range(n)) - {actual}
+    while restantes:
+        # Solo es elegible la proxima fija en la secuencia; las flexibles siempre lo son
+        candidatos = [i for i in restantes if i not in fijas or (pendientes_fijas and i == pendientes_fijas[0])]
+        siguiente = min(candidatos, key=lambda i: dist[actual][i])
+        if pendientes_fijas and siguiente == pendientes_fijas[0]:
+            pendientes_fijas.pop(0)
+        orden.append(siguiente)
+        restantes.discard(siguiente)
+        actual = siguiente
+
+    mejoro = True
+    while mejoro:
+        mejoro = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b = orden[i - 1], orden[i]
+                c = orden[j]
+                d = orden[j + 1] if j + 1 < n else None
+                delta = dist[a][c] - dist[a][b]
+                if d is not None:
+                    delta += dist[b][d] - dist[c][d]
+                if delta < -1e-9:
+                    candidato = orden[:i] + orden[i:j + 1][::-1] + orden[j + 1:]
+                    if _respeta_fijas(candidato, fijas):
+                        orden = candidato
+                        mejoro = True
+    return orden
+
+
+def minutos_viaje(km: float) -> int:
+    return int(round(km * FACTOR_CALLES / VELOCIDAD_KMH * 60))
+
+
+def coordenadas_visita(visita, indice=None):
+    """
+    (lat, lng, aproximada) de la visita: coordenadas del edificio si existen y, si no,
+    el centroide de la comuna de la visita o de su cotizacion. None si no hay como ubicarla.
+    """
+    indice = indice or indice_comunas()
+    cot = visita.cotizacion if visita.cotizacion_id else None
+    edificio = getattr(cot, "edificio", None)
+    if edificio is not None and edificio.lat is not None and edificio.lng is not None:
+        return float(edificio.lat), float(edificio.lng), False
+    for comuna, region in ((visita.comuna, visita.region), (getattr(cot, "comuna", None), getattr(cot, "region", None))):
+        punto = indice.coordenadas(comuna, region)
+        if punto:
+            return punto[0], punto[1], True
+    return None
+
+
+def _version_dia(fecha):
+    return cache.get_or_set(f"rutas:version:{fecha.isoformat()}", 1, None)
+
+
+def invalidar_dia(fecha):
+    """Invalida las matrices cacheadas de todos los tecnicos para ese dia."""
+    clave = f"rutas:version:{fecha.isoformat()}"
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.set(clave, 2, None)
+
+
+def ruta_del_dia(tecnico_slug, fecha):
+    """
+    Ruta optimizada del tecnico para un dia.
+    Retorna {"paradas": [{"visita", "tramo_km", "tramo_min", "aproximada"}], "sin_ubicacion": [...], "km", "minutos"}.
+    """
+    visitas = list(
+        VisitaTecnica.objects.filter(tecnico__slug=tecnico_slug, fecha=fecha)
+        .select_related("cotizacion", "cotizacion__edificio")
+        .order_by("hora", "id")
+    )
+    con_coords, sin_ubicacion, coords, aproximadas = [], [], [], set()
+    indice = indice_comunas()
+    for v in visitas:
+        punto = coordenadas_visita(v, indice)
+        if punto is None:
+            sin_ubicacion.append(v)
+            continue
+        if punto[2]:
+            aproximadas.add(len(con_coords))
+        con_coords.append(v)
+        coords.append(punto[:2])
+
+    # La clave incluye los ids y coordenadas: si una visita cambia de dia o de lugar la matriz se recalcula
+    huella = hashlib.md5(repr([(v.pk, c) for v, c in zip(con_coords, coords)]).encode()).hexdigest()
+    clave = f"rutas:matriz:{tecnico_slug}:{fecha.isoformat()}:{_version_dia(fecha)}:{huella}"
+    dist = cache.get(clave)
+    if dist is None:
+        dist = matriz_distancias(coords)
+        cache.set(clave, dist, CACHE_TIMEOUT)
+
+    fijas = {i: (v.hora.hour, v.hora.minute) for i, v in enumerate(con_coords) if v.hora}
+    orden = ordenar_paradas(dist, fijas)
+    paradas, total_km = [], 0.0
+    anterior = None
+    for i in orden:
+        km = dist[anterior][i] if anterior is not None else 0.0
+        total_km += km
+        paradas.append({
+            "visita": con_coords[i],
+            "tramo_km": round(km, 1),
+            "tramo_min": minutos_viaje(km),
+            "aproximada": i in aproximadas,
+        })
+        anterior = i
+    return {
+        "fecha": fecha,
+        "paradas": paradas,
+        "sin_ubicacion": sin_ubicacion,
+        "km": round(total_km, 1),
+        "minutos": minutos_viaje(total_km),
+    }
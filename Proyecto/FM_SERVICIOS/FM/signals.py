@@ -0,0 +1,156 @@
+from functools import partial
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save, pre_delete, pre_migrate
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .analitica import invalidar_analitica
+from .asignacion import invalidar_regiones
+from .busqueda import indexar, instalar_triggers, quitar_triggers
+from .calendario import registrar_eliminacion
+from .catalogo import invalidar_catalogo
+from .cobertura import invalidar_cobertura
+from .estadisticas import invalidar_kpis, invalidar_stats
+from .etiquetas import invalidar_nube, sincronizar
+from .geo import invalidar_indice
+from .metricas import fusionar_servicio, instantanea, registrar_cambio
+from .models import Cobertura, Comuna, Cotizacion, Documento, Region, Servicio, User, VisitaTecnica
+from .realtime import publicar_eliminacion, publicar_stats, publicar_visita
+from .rutas import invalidar_dia
+
+
+@receiver(post_save, sender=VisitaTecnica)
+@receiver(post_delete, sender=VisitaTecnica)
+def visita_cambiada(sender, instance, **kwargs):
+    if instance.fecha:
+        invalidar_dia(instance.fecha)
+        if instance.fecha < timezone.localdate():
+            # Solo las visitas pasadas cuentan para la region habitual del asignador
+            invalidar_regiones()
+
+
+@receiver(post_delete, sender=VisitaTecnica)
+def visita_eliminada(sender, instance, **kwargs):
+    registrar_eliminacion(instance)
+    transaction.on_commit(partial(publicar_eliminacion, instance.pk, instance.fecha))
+
+
+@receiver(post_save, sender=VisitaTecnica)
+def visita_guardada(sender, instance, **kwargs):
+    # Solo tras confirmar: un calendario no debe ver una reserva que luego se revierte
+    transaction.on_commit(partial(publicar_visita, instance))
+
+
+@receiver(post_save, sender=Comuna)
+@receiver(post_delete, sender=Comuna)
+def comuna_cambiada(sender, **kwargs):
+    invalidar_indice()
+    invalidar_catalogo()
+    invalidar_cobertura()
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def region_cambiada(sender, **kwargs):
+    invalidar_catalogo()
+    invalidar_cobertura()
+
+
+@receiver(post_save, sender=Cobertura)
+@receiver(post_delete, sender=Cobertura)
+def cobertura_cambiada(sender, **kwargs):
+    invalidar_cobertura()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Servicio)
+@receiver(post_delete, sender=Servicio)
+@receiver(post_save, sender=Documento)
+@receiver(post_delete, sender=Documento)
+@receiver(post_save, sender=Cotizacion)
+@receiver(post_delete, sender=Cotizacion)
+def contadores_cambiados(sender, **kwargs):
+    # Tras el commit: invalidar antes dejaria que un calculo concurrente vuelva a guardar los contadores viejos
+    transaction.on_commit(invalidar_stats)
+    transaction.on_commit(publicar_stats)
+
+
+@receiver(post_save, sender=VisitaTecnica)
+@receiver(post_delete, sender=VisitaTecnica)
+@receiver(post_save, sender=Cotizacion)
+@receiver(post_delete, sender=Cotizacion)
+def kpis_cambiados(sender, **kwargs):
+    invalidar_kpis()
+
+
+@receiver(post_save, sender=Cotizacion)
+@receiver(post_delete, sender=Cotizacion)
+def series_cambiadas(sender, **kwargs):
+    invalidar_analitica()
+
+
+# Rollup de metricas: se recuerda la clave con que se cargo la cotizacion para mover la cuenta al guardar
+@receiver(post_init, sender=Cotizacion)
+def cotizacion_cargada(sender, instance, **kwargs):
+    instance._metrica = instantanea(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Cotizacion)
+def cotizacion_guardada(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    actual = instantanea(instance)
+    anterior = None if created else getattr(instance, "_metrica", None)
+    if actual is None or (anterior is None and not created):
+        return  # campos diferidos: lo corrige compactar_metricas
+    registrar_cambio(anterior, actual)
+    instance._metrica = actual
+
+
+@receiver(post_delete, sender=Cotizacion)
+def cotizacion_eliminada(sender, instance, **kwargs):
+    anterior = getattr(instance, "_metrica", None) or instantanea(instance)
+    if anterior is not None:
+        registrar_cambio(anterior, None)
+
+
+@receiver(pre_delete, sender=Servicio)
+def servicio_por_eliminar(sender, instance, **kwargs):
+    fusionar_servicio(instance.pk)
+
+
+def _toca(update_fields, campos):
+    return update_fields is None or bool(campos.intersection(update_fields))
+
+
+# Texto completo de cotizaciones: lo mantienen triggers de la BD (tambien en update() y bulk_create)
+def _migra_fm(plan):
+    return any(migracion.app_label == "FM" for migracion, _ in plan or [])
+
+
+@receiver(pre_migrate)
+def triggers_busqueda_quitados(sender, using=DEFAULT_DB_ALIAS, plan=None, **kwargs):
+    if sender.name == "FM" and _migra_fm(plan):
+        quitar_triggers(connections[using])
+
+
+@receiver(post_migrate)
+def triggers_busqueda(sender, using=DEFAULT_DB_ALIAS, plan=None, **kwargs):
+    if sender.name == "FM" and instalar_triggers(connections[using]) and _migra_fm(plan):
+        indexar(conexion=connections[using])
+
+
+@receiver(post_save, sender=Documento)
+def documento_etiquetado(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Documento.tags es el texto editable; la tabla Etiqueta es lo que se consulta
+    if raw or not _toca(update_fields, {"tags", "subido_por"}):
+        return
+    sincronizar(instance)
+    invalidar_nube()
+
+
+@receiver(post_delete, sender=Documento)
+def documento_desetiquetado(sender, **kwargs):
+    invalidar_nube()
@@ -1,4 +1,396 @@
-﻿from django.test import TestCase
+import threading
+from datetime import time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from . import geo
+from .agenda import ConflictoAgenda, conflictos_en_lote, guardar_visita
+from .asignacion import SERVICE_TECH_MAP, Asignador
+from .busqueda import pagina_busqueda
+from .metricas import compactar, reporte_periodo
+from .models import Comuna, Cotizacion, Edificio, Region, Servicio, Tecnico, User, VisitaRecurrente, VisitaTecnica
+from .recurrencia import generar_visitas
+from .reprogramacion import aplicar_reprogramacion, enviar_correo_reprogramacion, planificar_ausencia
+
+
+def crear_tecnico(nombre="Ana", **extra):
+    datos = {"apellido": "Prueba", "correo": f"{nombre.lower()}@example.invalid", "rut": f"RUT-{nombre}"}
+    datos.update(extra)
+    return Tecnico.objects.create(nombre=nombre, **datos)
+
+
+def nueva_visita(tecnico, fecha, hora, **extra):
+    return VisitaTecnica(tecnico=tecnico, cliente="Cliente prueba", fecha=fecha, hora=hora, **extra)
+
+
+class GuardarVisitaTests(TestCase):
+    def setUp(self):
+        self.tecnico = crear_tecnico()
+        self.fecha = timezone.localdate() + timedelta(days=7)
+
+    def test_rechaza_visita_dentro_de_la_ventana(self):
+        guardar_visita(nueva_visita(self.tecnico, self.fecha, time(9, 0)))
+        with self.assertRaises(ConflictoAgenda):
+            guardar_visita(nueva_visita(self.tecnico, self.fecha, time(11, 30)))
+        guardar_visita(nueva_visita(self.tecnico, self.fecha, time(12, 30)))
+        self.assertEqual(VisitaTecnica.objects.filter(tecnico=self.tecnico).count(), 2)
+
+    def test_editar_una_visita_no_choca_consigo_misma(self):
+        visita = guardar_visita(nueva_visita(self.tecnico, self.fecha, time(9, 0)))
+        visita.hora = time(10, 0)
+        guardar_visita(visita)
+        visita.refresh_from_db()
+        self.assertEqual(visita.inicio.astimezone(timezone.get_current_timezone()).time(), time(10, 0))
+
+    def test_otro_tecnico_puede_tomar_la_misma_hora(self):
+        guardar_visita(nueva_visita(self.tecnico, self.fecha, time(9, 0)))
+        guardar_visita(nueva_visita(crear_tecnico("Beto"), self.fecha, time(9, 0)))
+
+
+class ConflictosEnLoteTests(TestCase):
+    def setUp(self):
+        self.tecnico = crear_tecnico()
+        self.fecha = timezone.localdate() + timedelta(days=7)
+        self.existente = guardar_visita(nueva_visita(self.tecnico, self.fecha, time(9, 0)))
+
+    def test_marca_choques_con_la_agenda(self):
+        candidatos = [
+            (self.tecnico.pk, self.fecha, time(11, 0)),
+            (self.tecnico.pk, self.fecha, time(12, 30)),
+            (self.tecnico.pk, self.fecha + timedelta(days=1), time(9, 0)),
+            (self.tecnico.pk, self.fecha, time(9, 0), self.existente.pk),
+        ]
+        self.assertEqual(conflictos_en_lote(candidatos), {0})
+
+    def test_entre_si_acepta_el_primero_y_marca_los_siguientes(self):
+        candidatos = [
+            (self.tecnico.pk, self.fecha, time(14, 0)),
+            (self.tecnico.pk, self.fecha, time(15, 0)),
+            (self.tecnico.pk, self.fecha, time(17, 30)),
+        ]
+        self.assertEqual(conflictos_en_lote(candidatos), set())
+        self.assertEqual(conflictos_en_lote(candidatos, entre_si=True), {1})
+
+    def test_coincide_con_la_revision_individual(self):
+        horas = [time(h, m) for h in range(8, 20) for m in (0, 30)]
+        candidatos = [(self.tecnico.pk, self.fecha, h) for h in horas]
+        lote = conflictos_en_lote(candidatos)
+        individuales = set()
+        for idx, hora in enumerate(horas):
+            inicio, fin = VisitaTecnica.intervalo_para(self.fecha, hora)
+            if VisitaTecnica.objects.filter(tecnico=self.tecnico, inicio__lte=fin, fin__gte=inicio).exists():
+                individuales.add(idx)
+        self.assertEqual(lote, individuales)
+
+
+class ReservasConcurrentesTests(TransactionTestCase):
+    """Varios hilos reservan a la vez dentro de la misma ventana de 3 horas: solo una reserva puede ganar."""
+
+    HILOS = 8
+
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("La BD de pruebas en memoria no admite una conexion por hilo.")
+        self.tecnico = crear_tecnico()
+        self.fecha = timezone.localdate() + timedelta(days=7)
+
+    def _reservar_en_paralelo(self, horas):
+        barrera = threading.Barrier(len(horas))
+        aceptadas, rechazadas, errores = [], [], []
+
+        def reservar(hora):
+            try:
+                barrera.wait()
+                guardar_visita(nueva_visita(self.tecnico, self.fecha, hora))
+                aceptadas.append(hora)
+            except ConflictoAgenda:
+                rechazadas.append(hora)
+            except Exception as exc:
+                errores.append(repr(exc))
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=reservar, args=(h,)) for h in horas]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        return aceptadas, rechazadas
+
+    def _inicios(self):
+        return sorted(VisitaTecnica.objects.filter(tecnico=self.tecnico).values_list("inicio", flat=True))
+
+    def test_una_sola_reserva_por_ventana(self):
+        # Todas las horas caen dentro de 3 horas entre si
+        horas = [time(8 + i % 3, (i * 10) % 60) for i in range(self.HILOS)]
+        aceptadas, rechazadas = self._reservar_en_paralelo(horas)
+        self.assertEqual(len(aceptadas), 1)
+        self.assertEqual(len(rechazadas), self.HILOS - 1)
+        self.assertEqual(len(self._inicios()), 1)
+
+    def test_sin_reservas_superpuestas(self):
+        horas = [time(8 + i // 2, 30 * (i % 2)) for i in range(2 * self.HILOS)]
+        aceptadas, _ = self._reservar_en_paralelo(horas)
+        inicios = self._inicios()
+        self.assertEqual(len(inicios), len(aceptadas))
+        self.assertGreaterEqual(len(inicios), 2)
+        for anterior, siguiente in zip(inicios, inicios[1:]):
+            self.assertGreater(siguiente - anterior, VisitaTecnica.VENTANA_CONFLICTO)
+
+
+class AsignadorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.servicio = Servicio.objects.create(titulo="Calderas")
+        self.experto = crear_tecnico("Ana", servicio=self.servicio)
+        self.otro = crear_tecnico("Beto")
+        self.desde = timezone.localdate() + timedelta(days=1)
+
+    def test_prefiere_al_tecnico_del_servicio(self):
+        asignacion = Asignador(desde=self.desde).asignar(servicio=self.servicio, hora=time(10, 0))
+        self.assertEqual(asignacion.tecnico, self.experto)
+        self.assertEqual((asignacion.fecha, asignacion.hora), (self.desde, time(10, 0)))
+
+    def test_reparte_la_carga_en_memoria(self):
+        asignador = Asignador(desde=self.desde, dias=1)
+        elegidos = [asignador.asignar(hora=time(10, 0)).tecnico for _ in range(2)]
+        self.assertCountEqual(elegidos, [self.experto, self.otro])
+
+    def test_region_habitual_desde_la_cache_compartida(self):
+        pasada = nueva_visita(self.otro, timezone.localdate() - timedelta(days=10), time(9, 0), region="Valparaiso")
+        pasada.save()
+        Asignador(desde=self.desde)
+        with CaptureQueriesContext(connection) as consultas:
+            asignador = Asignador(desde=self.desde)
+        self.assertEqual([q["sql"] for q in consultas if "GROUP BY" in q["sql"]], [])
+        self.assertEqual(asignador.regiones[self.otro.slug], {"valparaiso": 1.0})
+        self.assertEqual(asignador.asignar(region="Valparaiso", hora=time(10, 0)).tecnico, self.otro)
+
+        # Editar una visita pasada invalida la version
+        pasada.region = "Biobio"
+        pasada.save()
+        self.assertEqual(Asignador(desde=self.desde).regiones[self.otro.slug], {"biobio": 1.0})
+
+
+class AsignarVisitasPendientesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        servicio = Servicio.objects.create(titulo="Calderas")
+        crear_tecnico("Ana", servicio=servicio)
+        self.fijo = crear_tecnico("Beto")
+        usuario = User.objects.create_user(username="cliente", email="cliente@example.invalid", password="x")
+        self.cot = Cotizacion.objects.create(usuario=usuario, servicio=servicio, region="Valparaiso", comuna="Quilpue")
+
+    def test_simulacion_elige_el_mismo_tecnico_fijo(self):
+        with mock.patch.dict(SERVICE_TECH_MAP, {"calderas": self.fijo.slug}):
+            salida = StringIO()
+            call_command("asignar_visitas_pendientes", "--dry-run", stdout=salida)
+            self.assertIn(f"Cotizacion #{self.cot.pk}: {self.fijo.nombre_completo}", salida.getvalue())
+            self.assertFalse(VisitaTecnica.objects.exists())
+
+            call_command("asignar_visitas_pendientes", stdout=StringIO())
+        self.assertEqual(self.cot.visitas.get().tecnico, self.fijo)
+
+
+class IndiceComunasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        region = Region.objects.create(nombre="Región de Prueba")
+        self.comuna = Comuna.objects.create(region=region, nombre="Villa Ñandú", lat="-33.050000", lng="-71.440000")
+
+    def test_cambio_en_otro_worker_invalida_la_copia_local(self):
+        self.assertEqual(geo.coordenadas_comuna("villa nandu"), (-33.05, -71.44))
+        # Otro proceso guarda la comuna: aqui solo cambia la version compartida, la copia local sigue cargada
+        Comuna.objects.filter(pk=self.comuna.pk).update(lat="-33.000000", lng="-71.400000")
+        cache.incr(geo.CLAVE_VERSION)
+        self.assertEqual(geo.coordenadas_comuna("Villa Nandu", "Region de Prueba"), (-33.0, -71.4))
+
+    def test_guardar_comuna_incrementa_la_version(self):
+        version = geo.indice_comunas().version
+        self.comuna.lat = "-33.100000"
+        self.comuna.save()
+        indice = geo.indice_comunas()
+        self.assertGreater(indice.version, version)
+        self.assertEqual(indice.coordenadas("Villa Ñandú"), (-33.1, -71.44))
+
+
+class ReprogramarAusenciaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ausente = crear_tecnico("Ana")
+        self.reemplazo = crear_tecnico("Beto")
+        self.fecha = timezone.localdate() + timedelta(days=3)
+        self.visita = guardar_visita(nueva_visita(self.ausente, self.fecha, time(10, 0), correo="cliente@example.invalid"))
+
+    def test_reasigna_y_avisa_al_cliente_tras_confirmar(self):
+        cambios, sin_horario = planificar_ausencia(self.ausente, self.fecha, self.fecha)
+        self.assertEqual(sin_horario, [])
+        self.assertEqual([(c.tecnico, c.fecha, c.hora) for c in cambios], [(self.reemplazo, self.fecha, time(10, 0))])
+        with self.captureOnCommitCallbacks(execute=True):
+            aplicar_reprogramacion(cambios, notificar=enviar_correo_reprogramacion)
+        self.visita.refresh_from_db()
+        self.assertEqual(self.visita.tecnico, self.reemplazo)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["cliente@example.invalid"])
+        self.assertIn("Beto Prueba (antes Ana Prueba)", mail.outbox[0].body)
+
+
+class VisitasRecurrentesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tecnico = crear_tecnico()
+        # Proximo lunes (al menos manana) y las tres semanas siguientes
+        manana = timezone.localdate() + timedelta(days=1)
+        self.lunes = manana + timedelta(days=-manana.weekday() % 7)
+        self.hasta = self.lunes + timedelta(weeks=3)
+        edificio = Edificio.objects.create(nombre="Edificio Prueba", region="Valparaiso", comuna="Quilpue")
+        self.regla = VisitaRecurrente.objects.create(
+            edificio=edificio,
+            tecnico=self.tecnico,
+            frecuencia=VisitaRecurrente.Frecuencia.SEMANAL,
+            dias_semana="MO",
+            hora=time(9, 0),
+            fecha_inicio=self.lunes,
+        )
+
+    def test_hora_fuera_de_la_grilla_no_valida(self):
+        for hora in (time(9, 15), time(20, 0), time(7, 30)):
+            self.regla.hora = hora
+            with self.assertRaises(ValidationError):
+                self.regla.full_clean()
+        self.regla.hora = time(19, 30)
+        self.regla.full_clean()
+
+    def test_reporta_ocurrencias_movidas_de_hora(self):
+        guardar_visita(nueva_visita(self.tecnico, self.lunes, time(9, 0)))
+        nuevas, sin_horario, movidas = generar_visitas(self.lunes, self.hasta)
+        self.assertEqual(len(nuevas), 4)
+        self.assertEqual(sin_horario, [])
+        self.assertEqual([(v.fecha, v.hora) for v in movidas], [(self.lunes, time(12, 30))])
+
+    def test_reejecutar_no_duplica_aunque_se_reprograme(self):
+        nuevas, _, _ = generar_visitas(self.lunes, self.hasta)
+        self.assertEqual(len(nuevas), 4)
+        # La primera ocurrencia se mueve al dia de la segunda
+        primera = VisitaTecnica.objects.get(recurrencia=self.regla, fecha_ocurrencia=self.lunes)
+        primera.fecha, primera.hora = self.lunes + timedelta(weeks=1), time(15, 0)
+        guardar_visita(primera)
+        self.assertEqual(generar_visitas(self.lunes, self.hasta), ([], [], []))
+        self.assertEqual(VisitaTecnica.objects.filter(recurrencia=self.regla).count(), 4)
+
+
+class MetricasTests(TestCase):
+    """El rollup incremental debe coincidir siempre con el agregado directo sobre Cotizacion."""
+
+    def setUp(self):
+        self.hoy = timezone.localdate()
+        self.usuario = User.objects.create_user(username="cliente", email="cliente@example.invalid", password="x")
+        self.calderas = Servicio.objects.create(titulo="Calderas")
+        self.gasfiteria = Servicio.objects.create(titulo="Gasfiteria")
+
+    def cotizacion(self, servicio, presupuesto, **extra):
+        return Cotizacion.objects.create(
+            usuario=self.usuario, servicio=servicio, presupuesto_estimado=Decimal(presupuesto), region="Valparaiso", **extra
+        )
+
+    def assertCoincideConLaFuente(self):
+        for dimension, campo in (("estado", "estado"), ("servicio", "servicio_id"), ("region", "region")):
+            fuente = (
+                Cotizacion.objects.filter(creado_en__date=self.hoy)
+                .values(campo)
+                .annotate(cantidad=Count("pk"), monto=Sum("presupuesto_estimado"))
+                .order_by(campo)
+            )
+            esperado = [(f[campo], f["cantidad"], f["monto"] or 0) for f in fuente]
+            reporte = [(f[campo], f["cantidad"], f["monto"]) for f in reporte_periodo(self.hoy, self.hoy, por=(dimension,))]
+            self.assertEqual(reporte, esperado, dimension)
+
+    def test_crear_cambiar_estado_y_servicio(self):
+        a = self.cotizacion(self.calderas, "100000")
+        self.cotizacion(self.calderas, "50000")
+        c = self.cotizacion(self.gasfiteria, "20000")
+        self.assertCoincideConLaFuente()
+
+        a.estado = Cotizacion.Estado.ENVIADA
+        a.save()
+        self.assertCoincideConLaFuente()
+
+        c.servicio = self.calderas
+        c.presupuesto_estimado = Decimal("25000")
+        c.save()
+        self.assertCoincideConLaFuente()
+
+        a.delete()
+        self.assertCoincideConLaFuente()
+
+    def test_eliminar_servicio_fusiona_sus_filas(self):
+        self.cotizacion(self.calderas, "100000")
+        self.cotizacion(None, "30000")
+        self.cotizacion(self.gasfiteria, "20000", estado=Cotizacion.Estado.ENVIADA)
+        self.calderas.delete()
+        self.assertCoincideConLaFuente()
+
+    def test_compactar_corrige_cambios_masivos(self):
+        self.cotizacion(self.calderas, "100000")
+        self.cotizacion(self.gasfiteria, "20000")
+        # update() no pasa por las senales: el rollup queda desfasado hasta compactar
+        Cotizacion.objects.update(estado=Cotizacion.Estado.RECHAZADA)
+        compactar(desde=self.hoy)
+        self.assertCoincideConLaFuente()
+
+
+class BusquedaTests(TestCase):
+    """El indice lo mantienen triggers de la BD: tambien los cambios que no pasan por save()."""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user(username="cliente", email="cliente@example.invalid", password="x")
+
+    def encontradas(self, q):
+        return [c.pk for c in pagina_busqueda(Cotizacion.objects.all(), q, tamano=100).items]
+
+    def test_update_bulk_create_y_eliminar(self):
+        a = Cotizacion.objects.create(usuario=self.usuario, asunto="Mantencion de calderas")
+        self.assertEqual(self.encontradas("calderas"), [a.pk])
+
+        Cotizacion.objects.filter(pk=a.pk).update(asunto="Cambio de termo")
+        self.assertEqual(self.encontradas("calderas"), [])
+        self.assertEqual(self.encontradas("termo"), [a.pk])
+
+        Cotizacion.objects.bulk_create([Cotizacion(usuario=self.usuario, mensaje="Filtracion en el techo")])
+        self.assertEqual(len(self.encontradas("filtracion")), 1)
+
+        a.delete()
+        self.assertEqual(self.encontradas("termo"), [])
+
+    def test_cambio_de_cliente_reindexa_sus_cotizaciones(self):
+        a = Cotizacion.objects.create(usuario=self.usuario, asunto="Pintura")
+        User.objects.filter(pk=self.usuario.pk).update(first_name="Rigoberta")
+        self.assertEqual(self.encontradas("rigoberta"), [a.pk])
+
+    def test_pagina_todos_los_resultados(self):
+        Cotizacion.objects.bulk_create([Cotizacion(usuario=self.usuario, asunto=f"Gasfiteria {i}") for i in range(7)])
+        vistas, cursor = [], ""
+        for _ in range(3):
+            pagina = pagina_busqueda(Cotizacion.objects.all(), "gasfiteria", cursor, tamano=3)
+            vistas += [c.pk for c in pagina.items]
+            cursor = pagina.siguiente
+        self.assertEqual(cursor, "")
+        self.assertEqual(sorted(vistas), sorted(Cotizacion.objects.values_list("pk", flat=True)))
+        self.assertEqual(len(set(vistas)), 7)
+        anterior = pagina_busqueda(Cotizacion.objects.all(), "gasfiteria", pagina.anterior, tamano=3)
+        self.assertEqual([c.pk for c in anterior.items], vistas[3:6])
+        # Un cursor de otra busqueda no se reutiliza: vuelve a la primera pagina
+        otra = pagina_busqueda(Cotizacion.objects.all(), "otra", pagina.anterior, tamano=3)
+        self.assertEqual(otra.anterior, "")
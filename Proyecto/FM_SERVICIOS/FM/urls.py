@@ -2,9 +2,9 @@
 from django.contrib.auth import views as auth_views
 from .views import (
     inicio, nosotros, registro_view, login_view, logout_view, perfil_view,
-    perfil_editar, admin_dashboard, admin_dashboard_stats, agenda_visitas, agenda_visita_editar, agenda_visita_eliminar, tecnicos_panel,
+    perfil_editar, admin_dashboard, admin_dashboard_stats, admin_dashboard_stream, metricas_periodo, analitica_cotizaciones, agenda_visitas, agenda_visita_editar, agenda_calendario_datos, agenda_disponibilidad, agenda_ical_tecnico, agenda_ical_todos, agenda_visita_eliminar, agenda_visita_tarjeta, tecnicos_panel,
     servicios_list, servicio_detalle,
-    contacto, cotizacion_create, cotizacion_mis, cotizaciones_admin_list, cotizaciones_registro, gestion_insumos, agenda_calendario,
+    contacto, comunas_autocompletar, cotizacion_create, cotizacion_mis, cotizaciones_admin_list, cotizaciones_registro, gestion_insumos, agenda_calendario,
     cotizacion_rechazar, cotizacion_aceptar, cotizacion_enviar, cotizacion_responder, cotizacion_informe, cotizacion_pagar,
     tb_return,
     documentos_admin, documentos_list,
@@ -29,10 +29,18 @@ urlpatterns = [
     path("perfil/editar/", perfil_editar, name="perfil_editar"),
     path("administrar/", admin_dashboard, name="admin_dashboard"),
     path("administrar/stats/", admin_dashboard_stats, name="admin_stats_api"),
+    path("administrar/stats/stream/", admin_dashboard_stream, name="admin_stats_stream"),
+    path("administrar/metricas/", metricas_periodo, name="metricas_periodo"),
+    path("administrar/analitica/", analitica_cotizaciones, name="analitica_cotizaciones"),
     path("agenda/", agenda_visitas, name="agenda_visitas"),
     path("agenda/<int:pk>/editar/", agenda_visita_editar, name="agenda_visita_editar"),
     path("agenda/<int:pk>/eliminar/", agenda_visita_eliminar, name="agenda_visita_eliminar"),
+    path("agenda/<int:pk>/tarjeta/", agenda_visita_tarjeta, name="agenda_visita_tarjeta"),
     path("agenda/calendario/", agenda_calendario, name="agenda_calendario"),
+    path("agenda/calendario/datos/", agenda_calendario_datos, name="agenda_calendario_datos"),
+    path("agenda/disponibilidad/", agenda_disponibilidad, name="agenda_disponibilidad"),
+    path("agenda/ical/todos/<str:token>.ics", agenda_ical_todos, name="agenda_ical_todos"),
+    path("agenda/ical/<str:token>.ics", agenda_ical_tecnico, name="agenda_ical_tecnico"),
     path("tecnicos/", tecnicos_panel, name="tecnicos_panel"),
 
     # Servicios públicos
@@ -61,6 +69,7 @@ urlpatterns = [
 
     # Contacto
     path("contacto/", contacto, name="contacto"),
+    path("comunas/autocompletar/", comunas_autocompletar, name="comunas_autocompletar"),
     # Sección solo para administradores
     path("documentos/", documentos_admin, name="documentos_admin"),
     # Listado público de documentos
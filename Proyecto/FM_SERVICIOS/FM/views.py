@@ -10,17 +10,22 @@ from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.urls import reverse
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
 import os
 from django.utils.http import url_has_allowed_host_and_scheme
 import logging
 import re
 from django.utils.crypto import get_random_string
-import calendar
 import secrets
 import json
+import csv
+from itertools import chain
 from transbank.webpay.webpay_plus.transaction import Transaction
 from transbank.common.integration_type import IntegrationType
 from transbank.common.integration_commerce_codes import IntegrationCommerceCodes
@@ -47,17 +52,29 @@ from .models import (
     VisitaTecnica,
     Trabajo,
     Tecnico,
-    Region,
-    Comuna,
     Insumo,
 )
 from .forms import (
     RegistroForm, LoginForm, Login2FACodeForm, CotizacionForm, ContactoForm, DocumentoForm,
     PasswordCodeRequestForm, PasswordCodeVerifyForm,
     ProfileForm, CompanyForm, PasswordByQuestionForm, DocumentoEditForm, ServicioForm,
-    CHILE_REGIONES, CHILE_REGIONES_DICT,
 )
 from .email_utils import send_email
+from .agenda import ConflictoAgenda, Disponibilidad, guardar_visita, reserva_atomica, tecnico_tiene_conflicto
+from .asignacion import agendar_cotizacion
+from .rutas import ruta_del_dia
+from .reprogramacion import aplicar_reprogramacion, enviar_correo_reprogramacion, planificar_ausencia
+from .analitica import COLUMNAS, GRANULARIDADES, series_cotizaciones
+from .busqueda import pagina_busqueda
+from .paginacion import Paginador
+from .realtime import stream_stats
+from .calendario import datos_calendario, rango_mes
+from .autocompletar import buscar_comunas
+from .catalogo import get_catalogo, url_catalogo
+from .estadisticas import KPIS_VACIOS, kpis_tecnicos, stats_dashboard
+from .etiquetas import PREFIJO, filtrar, nube_etiquetas, separar
+from .metricas import DIMENSIONES as DIMENSIONES_METRICAS, SERIES as SERIES_METRICAS, reporte_periodo
+from .ical import generar_ics, resumen_feed, visitas_feed
 
 ADMIN_ACCESS_CODE = "3420"
 SIGNATURE = "\n\nSaludos,\nFM Servicios Generales"
@@ -71,14 +88,12 @@ TECHNICIAN_ACCOUNTS = {
     },
 }
 
-SERVICE_TECH_MAP = {}
 FIXED_PRICE = Decimal("50000")
 
 TECHNICOS_PREDEF = []  # Se eliminan tecnicos predefinidos; usar solo los creados en BD
 logger = logging.getLogger(__name__)
 _supabase_cached_client = None
 _supabase_client_error = False
-_DEFAULT_TAG_SEPARATOR = ","
 
 
 def _safe_storage_path(title: str | None, filename: str | None, prefix: str | None = None) -> str:
@@ -165,14 +180,7 @@ def _supabase_upload(file_or_bytes, *, bucket=None, path=None, content_type=None
 
 
 def _normalize_tags(raw: str | None) -> str:
-    tags = []
-    for chunk in (raw or "").split(_DEFAULT_TAG_SEPARATOR):
-        clean = chunk.strip()
-        if not clean:
-            continue
-        if clean.lower() not in [t.lower() for t in tags]:
-            tags.append(clean)
-    return ", ".join(tags)
+    return ", ".join(separar(raw))
 
 
 def _supabase_delete(path: str | None, *, bucket=None) -> bool:
@@ -500,6 +508,7 @@ def _find_tecnico_by_slug(slug: str):
     if not obj:
         return None
     return {
+        "id": obj.pk,
         "slug": obj.slug,
         "nombre": f"{obj.nombre} {obj.apellido or ''}".strip(),
         "especialidad": obj.especialidad or (obj.servicio.titulo if getattr(obj, "servicio", None) else "Tecnico"),
@@ -518,6 +527,7 @@ def _get_tecnico_account(user):
             )
             if tec_obj:
                 return {
+                    "id": tec_obj.pk,
                     "slug": tec_obj.slug,
                     "code": TECHNICIAN_ACCESS_CODE,
                     "nombre": f"{tec_obj.nombre} {tec_obj.apellido or ''}".strip(),
@@ -544,47 +554,6 @@ def _get_tecnico_account(user):
             }
     return None
 
-def _get_tecnico_for_service(nombre: str):
-    norm = (nombre or "").strip().lower()
-    if norm:
-        for keyword, slug in SERVICE_TECH_MAP.items():
-            if keyword in norm:
-                info = _find_tecnico_by_slug(slug)
-                if info:
-                    return info
-    obj = Tecnico.objects.filter(activo=True).order_by("nombre", "apellido", "id").first()
-    return (
-        {
-            "slug": obj.slug,
-            "nombre": f"{obj.nombre} {obj.apellido or ''}".strip(),
-            "especialidad": obj.especialidad or (obj.servicio.titulo if getattr(obj, "servicio", None) else "Tecnico"),
-            "email": obj.correo,
-        }
-        if obj
-        else None
-    )
-
-def _region_choices():
-    try:
-        regiones = Region.objects.all().order_by("nombre")
-        if regiones:
-            return [("", "Selecciona region")] + [(r.nombre, r.nombre) for r in regiones]
-    except Exception:
-        pass
-    return [("", "Selecciona region")] + [(r, r) for r, _ in CHILE_REGIONES]
-
-def _regiones_json():
-    try:
-        data = {}
-        regiones = Region.objects.prefetch_related("comunas").all()
-        if regiones:
-            for reg in regiones:
-                data[reg.nombre] = [c.nombre for c in reg.comunas.all()]
-            return json.dumps(data)
-    except Exception:
-        pass
-    return json.dumps(CHILE_REGIONES_DICT)
-
 def _agendar_visita(
     tecnico_info,
     cliente,
@@ -599,7 +568,8 @@ def _agendar_visita(
 ):
     if not tecnico_info or not tecnico_info.get("slug"):
         raise ValueError("No hay tecnicos activos disponibles. Crea al menos uno desde el panel de admin.")
-    return VisitaTecnica.objects.create(
+    visita = VisitaTecnica(
+        tecnico_id=tecnico_info.get("id"),
         tecnico_slug=tecnico_info["slug"],
         tecnico_nombre=tecnico_info["nombre"],
         cliente=cliente,
@@ -612,26 +582,8 @@ def _agendar_visita(
         notas=notas or "-",
         cotizacion=cotizacion,
     )
-
-def _tecnico_tiene_conflicto(tecnico_slug, fecha, hora, exclude_id=None) -> bool:
-    if not (tecnico_slug and fecha and hora):
-        return False
-    ventana_inicio = datetime.combine(fecha, hora) - timedelta(hours=3)
-    ventana_fin = datetime.combine(fecha, hora) + timedelta(hours=3)
-    visitas = VisitaTecnica.objects.filter(
-        tecnico_slug=tecnico_slug,
-        fecha__gte=ventana_inicio.date(),
-        fecha__lte=ventana_fin.date(),
-    )
-    if exclude_id:
-        visitas = visitas.exclude(pk=exclude_id)
-    for v in visitas:
-        if not v.hora:
-            continue
-        dt = datetime.combine(v.fecha, v.hora)
-        if ventana_inicio <= dt <= ventana_fin:
-            return True
-    return False
+    # Lanza ConflictoAgenda si otra reserva tomo el horario entre la validacion y el guardado
+    return guardar_visita(visita)
 
 def _crear_cotizacion_para_visita_manual(
     cliente: str,
@@ -702,6 +654,7 @@ def _crear_cotizacion_para_visita_manual(
             comuna=comuna or None,
             estado=Cotizacion.Estado.ACEPTADA,
             resuelto_en=timezone.now(),
+            enviada_en=timezone.now(),
         )
     except Exception as exc:
         # Intento final con correo aleatorio para no perder el registro
@@ -718,6 +671,7 @@ def _crear_cotizacion_para_visita_manual(
             comuna=comuna or None,
             estado=Cotizacion.Estado.ACEPTADA,
             resuelto_en=timezone.now(),
+            enviada_en=timezone.now(),
         )
 
 def _enviar_correo_visita_agendada(cliente, correo, fecha_dt, hora_dt, tecnico_info, direccion, region, comuna, notas):
@@ -799,27 +753,6 @@ def _enviar_correo_pago_autorizado(cot, total, request):
     except Exception:
         logger.exception("No se pudo enviar correo de pago autorizado")
 
-def _schedule_visit_for_cot(cot, fecha=None, hora=None):
-    servicio_nombre = (cot.servicio.titulo if cot.servicio else cot.asunto) or ""
-    tecnico_info = _get_tecnico_for_service(servicio_nombre)
-    cliente = cot.usuario.get_full_name() or cot.usuario.username
-    fecha_prog = fecha or (timezone.localdate() + timedelta(days=1))
-    hora_prog = hora or time(10, 0)
-    direccion = cot.lugar_servicio or "-"
-    notas = (cot.mensaje or "").strip() or f"Cotizacion #{cot.id}"
-    return _agendar_visita(
-        tecnico_info,
-        cliente,
-        fecha_prog,
-        hora_prog,
-        direccion=direccion,
-        notas=notas,
-        cotizacion=cot,
-        correo=cot.usuario.email,
-        region=cot.region,
-        comuna=cot.comuna,
-    )
-
 def _split_points(text):
     points = []
     for raw in (text or "").splitlines():
@@ -968,39 +901,25 @@ def contacto(request):
                         region=region or None,
                         comuna=comuna or None,
                     )
-                    if comuna.lower() == "cabo de hornos":
-                        cot.estado = Cotizacion.Estado.RECHAZADA
-                        cot.motivo_rechazo = "No contamos con cobertura en Cabo de Hornos."
-                        cot.resuelto_en = timezone.now()
-                        cot.save(update_fields=["estado", "motivo_rechazo", "resuelto_en"])
-                    else:
-                        visita_programada = _schedule_visit_for_cot(cot)
+                    # ContactoForm ya rechazo las comunas sin cobertura (FM.cobertura)
+                    visita_programada = agendar_cotizacion(cot)
             except Exception:
                 visita_programada = None
 
             # Aviso por correo al usuario
             correo_usuario = (form.cleaned_data.get("email") or "").strip()
             if correo_usuario:
-                comuna = (form.cleaned_data.get("comuna") or "").strip()
-                if comuna.lower() == "cabo de hornos":
-                    cuerpo_usuario = (
-                        "Hola {nombre},\n\n"
-                        "Recibimos tu solicitud, pero actualmente no contamos con cobertura en Cabo de Hornos.\n"
-                        "Si deseas coordinar un servicio en otra Ubicacion, escríbenos nuevamente.\n\n"
-                        "Gracias por considerar a FM Servicios Generales."
-                    ).format(nombre=form.cleaned_data.get("nombre") or "cliente")
-                else:
-                    fecha_visita = visita_programada.fecha.strftime("%d/%m/%Y") if visita_programada else "Por definir"
-                    hora_visita = visita_programada.hora.strftime("%H:%M") if visita_programada and visita_programada.hora else "10:00"
-                    tecnico_nombre = visita_programada.tecnico_nombre if visita_programada else "Uno de nuestros tecnicos"
-                    cuerpo_usuario = (
-                        "Hola {nombre},\n\n"
-                        "Recibimos tu solicitud correctamente y la estamos revisando. "
-                        "Pronto enviaremos la Cotizacion formal.\n\n"
-                        "Gracias por contactarnos."
-                    ).format(
-                        nombre=form.cleaned_data.get("nombre") or "cliente",
-                    )
+                fecha_visita = visita_programada.fecha.strftime("%d/%m/%Y") if visita_programada else "Por definir"
+                hora_visita = visita_programada.hora.strftime("%H:%M") if visita_programada and visita_programada.hora else "10:00"
+                tecnico_nombre = visita_programada.tecnico_nombre if visita_programada else "Uno de nuestros tecnicos"
+                cuerpo_usuario = (
+                    "Hola {nombre},\n\n"
+                    "Recibimos tu solicitud correctamente y la estamos revisando. "
+                    "Pronto enviaremos la Cotizacion formal.\n\n"
+                    "Gracias por contactarnos."
+                ).format(
+                    nombre=form.cleaned_data.get("nombre") or "cliente",
+                )
                 try:
                     send_email(
                         "Hemos recibido tu solicitud",
@@ -1062,16 +981,25 @@ def contacto(request):
                 "telefono": getattr(request.user, "telefono", "") or "",
             }
         form = ContactoForm(initial=initial)
-    # Refrescar opciones de región desde BD (si existen) y pasar comunas en JSON
-    try:
-        regiones_db = list(Region.objects.all().order_by("nombre"))
-    except Exception:
-        regiones_db = []
-    if regiones_db:
-        region_choices = [("", "Selecciona region")] + [(r.nombre, r.nombre) for r in regiones_db]
-        form.fields["region"].choices = region_choices
-    regiones_json = _regiones_json()
-    return render(request, "menu/contacto.html", {"form": form, "regiones_json": regiones_json})
+    catalogo = get_catalogo()
+    return render(
+        request,
+        "menu/contacto.html",
+        {"form": form, "regiones_json": catalogo.json, "regiones_url": url_catalogo(catalogo)},
+    )
+
+
+# Autocompletado de comunas: responde desde el indice en memoria y el navegador/CDN lo cachea
+# por URL hasta que cambia el catalogo (la firma del catalogo es el ETag)
+@condition(etag_func=lambda request: get_catalogo().firma)
+def comunas_autocompletar(request):
+    q = (request.GET.get("q") or "").strip()[:60]
+    region = (request.GET.get("region") or "").strip() or None
+    resultados = [{"comuna": comuna, "region": reg} for comuna, reg in buscar_comunas(q, region=region)]
+    resp = JsonResponse({"q": q, "resultados": resultados})
+    patch_cache_control(resp, public=True, max_age=3600)
+    return resp
+
 
 # ---------- Auth ----------
 # Registro/login con 2FA y recuperación
@@ -1415,7 +1343,7 @@ def perfil_view(request):
     }
     if tech_info:
         visitas_qs = (
-            VisitaTecnica.objects.filter(tecnico_slug=tech_info["slug"])
+            VisitaTecnica.objects.filter(tecnico__slug=tech_info["slug"])
             .select_related("cotizacion", "cotizacion__usuario", "cotizacion__servicio")
             .order_by("fecha", "hora", "id")
         )
@@ -1427,9 +1355,15 @@ def perfil_view(request):
                 vistos.add(v.cotizacion_id)
                 cotizaciones.append(v.cotizacion)
         hoy = timezone.localdate()
+        try:
+            ruta_fecha = datetime.strptime(request.GET.get("ruta_fecha") or "", "%Y-%m-%d").date()
+        except ValueError:
+            ruta_fecha = hoy
         ctx.update({
             "tecnico": tech_info,
             "visitas": visitas,
+            "ruta": ruta_del_dia(tech_info["slug"], ruta_fecha),
+            "ical_url": _ical_url_tecnico(request, tech_info["slug"]),
             "cotizaciones_asignadas": cotizaciones,
             "stats": {
                 "total_cotizaciones": len(cotizaciones),
@@ -1476,13 +1410,7 @@ def admin_dashboard(request):
         messages.warning(request, "No tienes permiso para acceder al panel de administración.")
         return redirect("index")
 
-    stats = {
-        "usuarios": User.objects.count(),
-        "clientes": User.objects.filter(rol=User.Rol.CLIENTE).count(),
-        "servicios": Servicio.objects.count(),
-        "documentos": Documento.objects.count(),
-        "cotizaciones": Cotizacion.objects.count(),
-    }
+    stats, _ = stats_dashboard()
     quick_links = [
         {"url": "documentos_admin", "label": "Documentos", "desc": "Sube, comparte, administra y revisa la biblioteca completa."},
         {"url": "servicios_admin_crud", "label": "Servicios", "desc": "Crea, edita o elimina servicios publicados."},
@@ -1498,19 +1426,196 @@ def admin_dashboard(request):
     return render(request, "menu/administrar.html", {"stats": stats, "quick_links": quick_links})
 
 
+def _stats_etag(request):
+    # Sin ETag para quien no es staff: la vista responde 403 en vez de un 304
+    if not (request.user.is_staff or request.user.is_superuser):
+        return None
+    return stats_dashboard()[1]
+
+
 @login_required
+@condition(etag_func=_stats_etag)
 def admin_dashboard_stats(request):
+    """El panel la consulta cada pocos segundos: mientras nada cambie responde 304 desde la cache."""
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    stats, _ = stats_dashboard()
+    resp = JsonResponse(stats)
+    patch_cache_control(resp, private=True, no_cache=True)
+    return resp
+
+
+@login_required
+async def admin_dashboard_stream(request):
+    """
+    Server-Sent Events con los contadores del panel: se envian solo cuando cambian. El DifusorStats del
+    proceso los recalcula una vez por cambio para todos los paneles abiertos.
+    """
+    user = await request.auser()
+    if not (user.is_staff or user.is_superuser):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    if not isinstance(request, ASGIRequest):
+        # Bajo WSGI el stream ocuparia un worker para siempre: con 204 EventSource se rinde y el panel vuelve a consultar
+        return HttpResponse(status=204)
+    resp = StreamingHttpResponse(stream_stats(), content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"  # sin buffer en nginx
+    return resp
+
+
+@login_required
+def metricas_periodo(request):
+    """
+    Reporte de cotizaciones creadas en un periodo desde el rollup MetricaDiaria.
+    ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD&por=estado,servicio,region&serie=dia|semana|mes
+    """
     if not (request.user.is_staff or request.user.is_superuser):
         return JsonResponse({"error": "forbidden"}, status=403)
-    stats = {
-        "usuarios": User.objects.count(),
-        "clientes": User.objects.filter(rol=User.Rol.CLIENTE).count(),
-        "servicios": Servicio.objects.count(),
-        "documentos": Documento.objects.count(),
-        "cotizaciones": Cotizacion.objects.count(),
-        "cotizaciones_pendientes": Cotizacion.objects.filter(estado=Cotizacion.Estado.PENDIENTE).count(),
+    hoy = timezone.localdate()
+    try:
+        desde = datetime.strptime(request.GET.get("desde") or "", "%Y-%m-%d").date() if request.GET.get("desde") else hoy.replace(day=1)
+        hasta = datetime.strptime(request.GET.get("hasta") or "", "%Y-%m-%d").date() if request.GET.get("hasta") else hoy
+    except ValueError:
+        return JsonResponse({"error": "fecha invalida, usa AAAA-MM-DD"}, status=400)
+    por = [d.strip() for d in (request.GET.get("por") or "estado").split(",") if d.strip()]
+    serie = (request.GET.get("serie") or "").strip() or None
+    if desde > hasta or any(d not in DIMENSIONES_METRICAS for d in por) or (serie and serie not in SERIES_METRICAS):
+        return JsonResponse({"error": "parametros invalidos"}, status=400)
+    filas = reporte_periodo(desde, hasta, por=por, serie=serie)
+    servicios = dict(Servicio.objects.filter(pk__in={f["servicio_id"] for f in filas if f.get("servicio_id")}).values_list("pk", "titulo")) if "servicio" in por else {}
+    resultado = []
+    for f in filas:
+        fila = {"cantidad": f["cantidad"], "monto": str(f["monto"])}
+        if serie:
+            fila["periodo"] = f["periodo"].isoformat()
+        for d in por:
+            fila[d] = f[DIMENSIONES_METRICAS[d]]
+        if "servicio" in por:
+            fila["servicio_titulo"] = servicios.get(fila["servicio"], "Sin servicio")
+        resultado.append(fila)
+    return JsonResponse(
+        {
+            "desde": desde.isoformat(),
+            "hasta": hasta.isoformat(),
+            "por": por,
+            "serie": serie,
+            "filas": resultado,
+            "total": {"cantidad": sum(f["cantidad"] for f in filas), "monto": str(sum((f["monto"] for f in filas), Decimal("0")))},
+        }
+    )
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la linea en vez de guardarla (StreamingHttpResponse)."""
+
+    def write(self, valor):
+        return valor
+
+
+@login_required
+def analitica_cotizaciones(request):
+    """
+    Series de cotizaciones por periodo de creacion: embudo ENVIADA -> ACEPTADA -> COMPLETADA, montos y
+    horas promedio hasta resolver. ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD&por=dia|semana|mes&formato=csv
+    """
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    hoy = timezone.localdate()
+    try:
+        hasta = datetime.strptime(request.GET["hasta"], "%Y-%m-%d").date() if request.GET.get("hasta") else hoy
+        desde = datetime.strptime(request.GET["desde"], "%Y-%m-%d").date() if request.GET.get("desde") else hasta - timedelta(days=89)
+    except ValueError:
+        return JsonResponse({"error": "fecha invalida, usa AAAA-MM-DD"}, status=400)
+    granularidad = (request.GET.get("por") or "dia").strip()
+    if desde > hasta or granularidad not in GRANULARIDADES:
+        return JsonResponse({"error": "parametros invalidos"}, status=400)
+    series = series_cotizaciones(desde, hasta, granularidad)
+
+    if request.GET.get("formato") == "csv":
+        writer = csv.writer(_Eco())
+        filas = ([f[c] for c in COLUMNAS] for f in series)
+        response = StreamingHttpResponse(
+            (writer.writerow(fila) for fila in chain([COLUMNAS], filas)), content_type="text/csv; charset=utf-8"
+        )
+        response["Content-Disposition"] = f'attachment; filename="cotizaciones_{granularidad}_{desde:%Y%m%d}_{hasta:%Y%m%d}.csv"'
+        return response
+
+    return JsonResponse(
+        {
+            "desde": desde.isoformat(),
+            "hasta": hasta.isoformat(),
+            "por": granularidad,
+            "series": [
+                dict(f, periodo=f["periodo"].isoformat(), monto_aceptado=str(f["monto_aceptado"]), monto_completado=str(f["monto_completado"]))
+                for f in series
+            ],
+        }
+    )
+
+
+AGENDA_VENTANAS = (("hoy", "Hoy"), ("semana", "Esta semana"))  # "rango" usa desde/hasta
+AGENDA_RANGO_MAXIMO = 366
+
+
+def _agenda_en_ventana(request):
+    """
+    Visitas de la ventana pedida (hoy, esta semana o un rango de fechas) con los filtros de tecnico, region,
+    correo y estado de la cotizacion. Los conteos por estado salen de un solo aggregate sobre la ventana.
+    Retorna (queryset, filtros, [(estado, etiqueta, cantidad)]).
+    """
+    hoy = timezone.localdate()
+    ventana = request.GET.get("ventana") or "semana"
+    desde = hasta = hoy
+    if ventana == "rango":
+        try:
+            desde = datetime.strptime(request.GET.get("desde") or "", "%Y-%m-%d").date()
+            hasta = datetime.strptime(request.GET.get("hasta") or "", "%Y-%m-%d").date()
+        except ValueError:
+            ventana = "semana"
+        else:
+            if hasta < desde:
+                desde, hasta = hasta, desde
+            hasta = min(hasta, desde + timedelta(days=AGENDA_RANGO_MAXIMO - 1))
+    if ventana == "semana":
+        desde = hoy - timedelta(days=hoy.weekday())
+        hasta = desde + timedelta(days=6)
+    elif ventana != "rango":
+        ventana = "hoy"
+    filtros = {
+        "ventana": ventana,
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "tecnico": (request.GET.get("tecnico") or "").strip(),
+        "region": (request.GET.get("region") or "").strip(),
+        "correo": (request.GET.get("correo") or "").strip(),
+        "estado": (request.GET.get("estado") or "").strip(),
     }
-    return JsonResponse(stats)
+    visitas = VisitaTecnica.objects.select_related("cotizacion").filter(fecha__gte=desde, fecha__lte=hasta)
+    if filtros["tecnico"]:
+        # Por el FK (indice tecnico, fecha, hora), no por la copia del slug
+        visitas = visitas.filter(tecnico__in=Tecnico.objects.filter(slug=filtros["tecnico"]))
+    if filtros["region"]:
+        visitas = visitas.filter(region=filtros["region"])
+    if filtros["correo"]:
+        visitas = visitas.filter(correo__icontains=filtros["correo"])
+
+    sin_estado = models.Q(cotizacion__isnull=True)
+    conteos = visitas.aggregate(
+        total=models.Count("pk"),
+        SIN_ESTADO=models.Count("pk", filter=sin_estado),
+        **{valor: models.Count("pk", filter=models.Q(cotizacion__estado=valor)) for valor in Cotizacion.Estado.values},
+    )
+    estados = [(valor, etiqueta, conteos[valor]) for valor, etiqueta in Cotizacion.Estado.choices]
+    estados.append(("SIN_ESTADO", "Sin cotización", conteos["SIN_ESTADO"]))
+    filtros["total"] = conteos["total"]
+    if filtros["estado"] == "SIN_ESTADO":
+        visitas = visitas.filter(sin_estado)
+    elif filtros["estado"] in Cotizacion.Estado.values:
+        visitas = visitas.filter(cotizacion__estado=filtros["estado"])
+    else:
+        filtros["estado"] = ""
+    filtros["filtrado"] = any(filtros[k] for k in ("tecnico", "region", "correo", "estado"))
+    return visitas, filtros, estados
 
 
 @login_required
@@ -1519,18 +1624,8 @@ def agenda_visitas(request):
         messages.warning(request, "Solo el personal autorizado puede acceder a la agenda.")
         return redirect("index")
 
-    visitas = VisitaTecnica.objects.select_related("cotizacion").all().order_by("fecha", "hora", "id")
     servicios_lista = Servicio.objects.all().order_by("orden", "titulo")
-    try:
-        regiones_db = list(Region.objects.prefetch_related("comunas").all().order_by("nombre"))
-    except Exception:
-        regiones_db = []
-    if regiones_db:
-        regiones_list = [r.nombre for r in regiones_db]
-        regiones_json = json.dumps({r.nombre: [c.nombre for c in r.comunas.all()] for r in regiones_db})
-    else:
-        regiones_list = [r for r, _ in CHILE_REGIONES]
-        regiones_json = json.dumps(CHILE_REGIONES_DICT)
+    catalogo = get_catalogo()
     if request.method == "POST":
         cliente = (request.POST.get("cliente") or "").strip()
         fecha_raw = request.POST.get("fecha") or ""
@@ -1553,32 +1648,38 @@ def agenda_visitas(request):
             hora_dt = None
         if not (cliente and fecha_dt and tecnico_info):
             messages.error(request, "Completa los campos obligatorios y selecciona un tecnico válido.")
-        elif _tecnico_tiene_conflicto(tecnico_info["slug"], fecha_dt, hora_dt):
+        elif tecnico_tiene_conflicto(tecnico_info["id"], fecha_dt, hora_dt):
             messages.error(request, "El técnico ya tiene una hora tomada dentro de 3 horas de ese horario.")
         else:
-            cotizacion = _crear_cotizacion_para_visita_manual(
-                cliente=cliente,
-                correo=correo,
-                servicio_nombre=servicio_nombre,
-                direccion=direccion,
-                region=region or None,
-                comuna=comuna or None,
-                notas=notas,
-                fecha_dt=fecha_dt,
-                hora_dt=hora_dt,
-            )
-            _agendar_visita(
-                tecnico_info,
-                cliente,
-                fecha_dt,
-                hora=hora_dt,
-                direccion=direccion or "-",
-                notas=notas,
-                correo=correo or None,
-                region=region or None,
-                comuna=comuna or None,
-                cotizacion=cotizacion,
-            )
+            try:
+                # Cotizacion y visita en la misma transaccion: si otra reserva gana el horario no queda nada a medias
+                with reserva_atomica():
+                    cotizacion = _crear_cotizacion_para_visita_manual(
+                        cliente=cliente,
+                        correo=correo,
+                        servicio_nombre=servicio_nombre,
+                        direccion=direccion,
+                        region=region or None,
+                        comuna=comuna or None,
+                        notas=notas,
+                        fecha_dt=fecha_dt,
+                        hora_dt=hora_dt,
+                    )
+                    _agendar_visita(
+                        tecnico_info,
+                        cliente,
+                        fecha_dt,
+                        hora=hora_dt,
+                        direccion=direccion or "-",
+                        notas=notas,
+                        correo=correo or None,
+                        region=region or None,
+                        comuna=comuna or None,
+                        cotizacion=cotizacion,
+                    )
+            except ConflictoAgenda as exc:
+                messages.error(request, str(exc))
+                return redirect("agenda_visitas")
             _enviar_correo_visita_agendada(
                 cliente=cliente,
                 correo=correo or None,
@@ -1593,18 +1694,26 @@ def agenda_visitas(request):
             messages.success(request, "Visita agendada correctamente.")
             return redirect("agenda_visitas")
 
+    visitas, filtros, estados = _agenda_en_ventana(request)
+    pagina = Paginador(visitas, ("fecha", "hora"), descendente=False).pagina(request.GET.get("cursor") or "")
     selected_region = request.POST.get("region") if request.method == "POST" else ""
     selected_comuna = request.POST.get("comuna") if request.method == "POST" else ""
     return render(
         request,
         "menu/agenda.html",
         {
-            "visitas": visitas,
+            "visitas": pagina.items,
+            "pagina": pagina,
+            "filtros": filtros,
+            "estados": estados,
+            "ventanas": AGENDA_VENTANAS,
+            "region_choices": catalogo.region_choices,
             "tecnicos": [{"slug": t.slug, "nombre": f"{t.nombre} {t.apellido or ''}".strip()} for t in Tecnico.objects.filter(activo=True)],
-            "regiones": regiones_list,
+            "regiones": catalogo.regiones,
             "selected_region": selected_region,
             "selected_comuna": selected_comuna,
-            "regiones_json": regiones_json,
+            "regiones_json": catalogo.json,
+            "regiones_url": url_catalogo(catalogo),
             "servicios_lista": servicios_lista,
         },
     )
@@ -1639,32 +1748,37 @@ def agenda_calendario(request):
         if not (cliente and fecha_dt and tecnico_info):
             messages.error(request, "Completa los campos obligatorios y selecciona un tecnico válido.")
             return redirect("agenda_calendario")
-        if _tecnico_tiene_conflicto(tecnico_info["slug"], fecha_dt, hora_dt):
+        if tecnico_tiene_conflicto(tecnico_info["id"], fecha_dt, hora_dt):
             messages.error(request, "El técnico ya tiene una hora tomada dentro de 3 horas de ese horario.")
             return redirect("agenda_calendario")
-        cotizacion = _crear_cotizacion_para_visita_manual(
-            cliente=cliente,
-            correo=correo,
-            servicio_nombre=servicio_nombre,
-            direccion=direccion,
-            region=region or None,
-            comuna=comuna or None,
-            notas=notas,
-            fecha_dt=fecha_dt,
-            hora_dt=hora_dt,
-        )
-        _agendar_visita(
-            tecnico_info,
-            cliente,
-            fecha_dt,
-            hora=hora_dt,
-            direccion=direccion or "-",
-            notas=notas,
-            correo=correo or None,
-            region=region or None,
-            comuna=comuna or None,
-            cotizacion=cotizacion,
-        )
+        try:
+            with reserva_atomica():
+                cotizacion = _crear_cotizacion_para_visita_manual(
+                    cliente=cliente,
+                    correo=correo,
+                    servicio_nombre=servicio_nombre,
+                    direccion=direccion,
+                    region=region or None,
+                    comuna=comuna or None,
+                    notas=notas,
+                    fecha_dt=fecha_dt,
+                    hora_dt=hora_dt,
+                )
+                _agendar_visita(
+                    tecnico_info,
+                    cliente,
+                    fecha_dt,
+                    hora=hora_dt,
+                    direccion=direccion or "-",
+                    notas=notas,
+                    correo=correo or None,
+                    region=region or None,
+                    comuna=comuna or None,
+                    cotizacion=cotizacion,
+                )
+        except ConflictoAgenda as exc:
+            messages.error(request, str(exc))
+            return redirect("agenda_calendario")
         _enviar_correo_visita_agendada(
             cliente=cliente,
             correo=correo or None,
@@ -1680,78 +1794,153 @@ def agenda_calendario(request):
         return redirect("agenda_calendario")
 
     today = timezone.localdate()
-    mes_param = (request.GET.get("mes") or "").strip()
-    try:
-        if mes_param:
-            first_day = datetime.strptime(mes_param, "%Y-%m").date().replace(day=1)
-        else:
-            first_day = today.replace(day=1)
-    except Exception:
-        first_day = today.replace(day=1)
-    _, last_day_num = calendar.monthrange(first_day.year, first_day.month)
-
-    weeks = []
-    week = []
-    start_weekday = first_day.weekday()  # 0 lunes
-    for _ in range(start_weekday):
-        week.append(None)
-    day = 1
-    while day <= last_day_num:
-        week.append(datetime(first_day.year, first_day.month, day).date())
-        if len(week) == 7:
-            weeks.append(week)
-            week = []
-        day += 1
-    if week:
-        while len(week) < 7:
-            week.append(None)
-        weeks.append(week)
-
-    last_day = first_day.replace(day=last_day_num)
-    visitas_qs = VisitaTecnica.objects.select_related("cotizacion").filter(
-        fecha__gte=first_day, fecha__lte=last_day
-    )
+    first_day = _mes_desde_param(request.GET.get("mes")) or today.replace(day=1)
     tecnico_filtro = (request.GET.get("tecnico") or "").strip()
-    if tecnico_filtro:
-        visitas_qs = visitas_qs.filter(tecnico_slug=tecnico_filtro)
-    visitas = visitas_qs.order_by("fecha", "hora")
-    visitas_por_dia = {}
-    for v in visitas:
-        visitas_por_dia.setdefault(v.fecha, []).append(v)
+    # La pagina se renderiza una vez con el mes inicial embebido; la navegacion y las
+    # actualizaciones posteriores usan agenda_calendario_datos con cursor incremental
+    datos = datos_calendario(*rango_mes(first_day), tecnico=tecnico_filtro or None)
 
-    tecnicos_total = Tecnico.objects.filter(activo=True).count()
     tecnicos = list(Tecnico.objects.filter(activo=True).order_by("nombre"))
     servicios_lista = Servicio.objects.all().order_by("orden", "titulo")
-    try:
-        regiones_db = list(Region.objects.prefetch_related("comunas").all().order_by("nombre"))
-    except Exception:
-        regiones_db = []
-    if regiones_db:
-        regiones_list = [r.nombre for r in regiones_db]
-        regiones_json = json.dumps({r.nombre: [c.nombre for c in r.comunas.all()] for r in regiones_db})
-    else:
-        regiones_list = [r for r, _ in CHILE_REGIONES]
-        regiones_json = json.dumps(CHILE_REGIONES_DICT)
+    catalogo = get_catalogo()
 
     return render(
         request,
         "menu/agenda_calendario.html",
         {
-            "weeks": weeks,
-        "today": today,
-        "first_day": first_day,
-        "prev_month": (first_day - timedelta(days=1)).replace(day=1),
-        "next_month": (first_day + timedelta(days=32)).replace(day=1),
-        "visitas_por_dia": visitas_por_dia,
-        "tecnicos_total": tecnicos_total,
+            "today": today,
+            "first_day": first_day,
+            "prev_month": (first_day - timedelta(days=1)).replace(day=1),
+            "next_month": (first_day + timedelta(days=32)).replace(day=1),
+            "tecnico_filtro": tecnico_filtro,
+            "calendario_datos": datos,
             "tecnicos": tecnicos,
             "servicios_lista": servicios_lista,
-            "regiones": regiones_list,
-            "regiones_json": regiones_json,
+            "regiones": catalogo.regiones,
+            "regiones_json": catalogo.json,
+            "regiones_url": url_catalogo(catalogo),
         },
     )
 
 
+def _mes_desde_param(valor):
+    try:
+        return datetime.strptime((valor or "").strip(), "%Y-%m").date()
+    except ValueError:
+        return None
+
+
+@login_required
+def agenda_calendario_datos(request):
+    """
+    Visitas y disponibilidad de un mes en JSON (?mes=AAAA-MM&tecnico=slug).
+    Con ?since=<cursor> devuelve solo los cambios desde la respuesta que entrego ese cursor.
+    """
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    mes_param = (request.GET.get("mes") or "").strip()
+    first_day = _mes_desde_param(mes_param) if mes_param else timezone.localdate().replace(day=1)
+    if first_day is None:
+        return JsonResponse({"error": "mes invalido, usa AAAA-MM"}, status=400)
+    since_raw = (request.GET.get("since") or "").strip()
+    since = parse_datetime(since_raw) if since_raw else None
+    if since_raw and (since is None or timezone.is_naive(since)):
+        return JsonResponse({"error": "since invalido, usa el cursor de la respuesta anterior"}, status=400)
+    tecnico = (request.GET.get("tecnico") or "").strip() or None
+    resp = JsonResponse(datos_calendario(*rango_mes(first_day), tecnico=tecnico, since=since))
+    patch_cache_control(resp, private=True, no_cache=True)
+    return resp
+
+
+@login_required
+def agenda_disponibilidad(request):
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    mes_param = (request.GET.get("mes") or "").strip()
+    try:
+        first_day = datetime.strptime(mes_param, "%Y-%m").date() if mes_param else timezone.localdate().replace(day=1)
+    except ValueError:
+        return JsonResponse({"error": "mes invalido, usa AAAA-MM"}, status=400)
+    tecnicos = Tecnico.objects.filter(activo=True).order_by("nombre", "apellido", "id")
+    tecnico_filtro = (request.GET.get("tecnico") or "").strip()
+    if tecnico_filtro:
+        tecnicos = tecnicos.filter(slug=tecnico_filtro)
+    return JsonResponse(Disponibilidad.mes(first_day, tecnicos=tecnicos).como_dict())
+
+
+def _ical_url_tecnico(request, slug):
+    token = Tecnico.objects.filter(slug=slug).values_list("ical_token", flat=True).first()
+    return request.build_absolute_uri(reverse("agenda_ical_tecnico", args=[token])) if token else ""
+
+
+def _ical_admin_token(user):
+    # Token aleatorio propio del usuario: se crea al primer uso y se rota con "regenerar_ical_todos"
+    if not user.ical_token:
+        user.regenerar_ical_token()
+    return user.ical_token
+
+
+def _ical_contexto(request, token, todos=False):
+    # Se resuelve una sola vez por request: lo usan el ETag, el Last-Modified y la vista
+    ctx = getattr(request, "_ical_ctx", None)
+    if ctx is not None:
+        return ctx
+    ctx = {"valido": False, "tecnico": None}
+    if todos:
+        ctx["valido"] = User.objects.filter(ical_token=token, is_active=True).filter(
+            models.Q(is_staff=True) | models.Q(is_superuser=True)
+        ).exists()
+    else:
+        ctx["tecnico"] = Tecnico.objects.filter(ical_token=token, activo=True).first()
+        ctx["valido"] = ctx["tecnico"] is not None
+    if ctx["valido"]:
+        slug = ctx["tecnico"].slug if ctx["tecnico"] else None
+        ctx["visitas"] = visitas_feed(ctx["tecnico"])
+        ctx["cantidad"], ctx["ultima"] = resumen_feed(ctx["visitas"], slug)
+    request._ical_ctx = ctx
+    return ctx
+
+
+def _ical_etag(request, token, todos=False):
+    ctx = _ical_contexto(request, token, todos)
+    if not ctx["valido"]:
+        return None
+    ultima = ctx["ultima"].timestamp() if ctx["ultima"] else 0
+    return f"{ctx['cantidad']}-{ultima:.6f}"
+
+
+def _ical_last_modified(request, token, todos=False):
+    ctx = _ical_contexto(request, token, todos)
+    return ctx.get("ultima")
+
+
+def _ical_response(request, token, todos=False):
+    ctx = _ical_contexto(request, token, todos)
+    if not ctx["valido"]:
+        return HttpResponse("Calendario no encontrado.", status=404, content_type="text/plain; charset=utf-8")
+    tecnico = ctx["tecnico"]
+    nombre = f"Visitas {tecnico.nombre} {tecnico.apellido or ''}".strip() if tecnico else "Visitas FM (todos los tecnicos)"
+    visitas = ctx["visitas"].select_related("cotizacion", "cotizacion__servicio").order_by("fecha", "hora", "id")
+    resp = HttpResponse(generar_ics(visitas, nombre, request.get_host()), content_type="text/calendar; charset=utf-8")
+    resp["Content-Disposition"] = f'inline; filename="{tecnico.slug if tecnico else "visitas"}.ics"'
+    # Los clientes deben revalidar siempre: el ETag permite responder 304 sin regenerar el archivo
+    patch_cache_control(resp, private=True, no_cache=True)
+    return resp
+
+
+@condition(etag_func=_ical_etag, last_modified_func=_ical_last_modified)
+def agenda_ical_tecnico(request, token):
+    return _ical_response(request, token)
+
+
+@condition(
+    etag_func=lambda request, token: _ical_etag(request, token, todos=True),
+    last_modified_func=lambda request, token: _ical_last_modified(request, token, todos=True),
+)
+def agenda_ical_todos(request, token):
+    return _ical_response(request, token, todos=True)
+
+
 @login_required
 def agenda_visita_editar(request, pk: int):
     if not (request.user.is_staff or request.user.is_superuser):
@@ -1762,16 +1951,7 @@ def agenda_visita_editar(request, pk: int):
         messages.warning(request, "No puedes editar una visita cuya cotizacion ya fue aceptada.")
         return redirect("agenda_visitas")
     servicios_lista = Servicio.objects.all().order_by("orden", "titulo")
-    try:
-        regiones_db = list(Region.objects.prefetch_related("comunas").all().order_by("nombre"))
-    except Exception:
-        regiones_db = []
-    if regiones_db:
-        regiones_list = [r.nombre for r in regiones_db]
-        regiones_json = json.dumps({r.nombre: [c.nombre for c in r.comunas.all()] for r in regiones_db})
-    else:
-        regiones_list = [r for r, _ in CHILE_REGIONES]
-        regiones_json = json.dumps(CHILE_REGIONES_DICT)
+    catalogo = get_catalogo()
     if request.method == "POST":
         cliente = (request.POST.get("cliente") or "").strip()
         fecha_raw = request.POST.get("fecha") or ""
@@ -1793,12 +1973,13 @@ def agenda_visita_editar(request, pk: int):
             hora_dt = None
         if not (cliente and fecha_dt and tecnico_info):
             messages.error(request, "Completa los campos obligatorios y selecciona un tecnico válido.")
-        elif _tecnico_tiene_conflicto(tecnico_info["slug"], fecha_dt, hora_dt, exclude_id=visita.pk):
+        elif tecnico_tiene_conflicto(tecnico_info["id"], fecha_dt, hora_dt, exclude_id=visita.pk):
             messages.error(request, "El técnico ya tiene una hora tomada dentro de 3 horas de ese horario.")
         else:
             visita.cliente = cliente
             visita.fecha = fecha_dt
             visita.hora = hora_dt
+            visita.tecnico_id = tecnico_info["id"]
             visita.tecnico_slug = tecnico_info["slug"]
             visita.tecnico_nombre = tecnico_info["nombre"]
             visita.correo = correo or None
@@ -1806,17 +1987,22 @@ def agenda_visita_editar(request, pk: int):
             visita.comuna = comuna or None
             visita.direccion = direccion or "-"
             visita.notas = notas or "-"
-            visita.save(update_fields=["cliente", "fecha", "hora", "tecnico_slug", "tecnico_nombre", "correo", "region", "comuna", "direccion", "notas"])
-            messages.success(request, "Visita actualizada.")
-            return redirect("agenda_visitas")
+            try:
+                guardar_visita(visita, update_fields=["cliente", "fecha", "hora", "tecnico", "tecnico_slug", "tecnico_nombre", "correo", "region", "comuna", "direccion", "notas"])
+            except ConflictoAgenda as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, "Visita actualizada.")
+                return redirect("agenda_visitas")
         return render(
             request,
             "menu/agenda_editar.html",
             {
                 "visita": visita,
                 "tecnicos": [{"slug": t.slug, "nombre": f"{t.nombre} {t.apellido or ''}".strip()} for t in Tecnico.objects.filter(activo=True)],
-                "regiones": CHILE_REGIONES,
-                "regiones_json": json.dumps(CHILE_REGIONES_DICT),
+                "regiones": catalogo.regiones,
+                "regiones_json": catalogo.json,
+                "regiones_url": url_catalogo(catalogo),
             },
         )
 
@@ -1829,8 +2015,9 @@ def agenda_visita_editar(request, pk: int):
         {
             "visita": visita,
             "tecnicos": [{"slug": t.slug, "nombre": f"{t.nombre} {t.apellido or ''}".strip()} for t in Tecnico.objects.filter(activo=True)],
-            "regiones": regiones_list,
-            "regiones_json": regiones_json,
+            "regiones": catalogo.regiones,
+            "regiones_json": catalogo.json,
+            "regiones_url": url_catalogo(catalogo),
             "selected_region": selected_region,
             "selected_comuna": selected_comuna,
             "servicios_lista": servicios_lista,
@@ -1849,6 +2036,15 @@ def agenda_visita_eliminar(request, pk: int):
     return redirect("agenda_visitas")
 
 
+@login_required
+def agenda_visita_tarjeta(request, pk: int):
+    """Tarjeta HTML de una visita para que la lista de la agenda la reemplace al recibir un aviso en tiempo real."""
+    if not (request.user.is_staff or request.user.is_superuser):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    visita = get_object_or_404(VisitaTecnica.objects.select_related("cotizacion"), pk=pk)
+    return render(request, "menu/partials/visita_card.html", {"visita": visita})
+
+
 @login_required
 @login_required
 @login_required
@@ -1973,6 +2169,52 @@ def tecnicos_panel(request):
                         pass
                     messages.success(request, "Técnico actualizado.")
                     return redirect("tecnicos_panel")
+        if action == "reprogramar_ausencia":
+            tec_obj = Tecnico.objects.filter(slug=(request.POST.get("tecnico_slug") or "").strip()).first()
+            try:
+                desde = datetime.strptime(request.POST.get("desde") or "", "%Y-%m-%d").date()
+                hasta = datetime.strptime(request.POST.get("hasta") or "", "%Y-%m-%d").date()
+            except ValueError:
+                desde = hasta = None
+            if not tec_obj or not desde or not hasta or hasta < desde:
+                messages.error(request, "Selecciona un técnico y un rango de fechas válido.")
+                return redirect("tecnicos_panel")
+            cambios, sin_horario = planificar_ausencia(tec_obj, desde, hasta, reasignar=bool(request.POST.get("reasignar")))
+            detalle = "; ".join(
+                f"{c.visita.cliente}: {c.fecha_anterior:%d/%m} -> {c.fecha:%d/%m} {c.hora:%H:%M} ({c.tecnico_nombre})"
+                for c in cambios[:10]
+            )
+            if request.POST.get("simular"):
+                messages.info(request, f"Vista previa: {len(cambios)} visita(s) se moverían. {detalle}")
+            elif cambios:
+                try:
+                    aplicar_reprogramacion(cambios, notificar=enviar_correo_reprogramacion)
+                except ConflictoAgenda as exc:
+                    messages.error(request, str(exc))
+                    return redirect(f"{reverse('tecnicos_panel')}?tecnico={tec_obj.slug}")
+                messages.success(request, f"{len(cambios)} visita(s) reprogramadas y clientes notificados. {detalle}")
+            if sin_horario:
+                messages.warning(
+                    request,
+                    f"{len(sin_horario)} visita(s) sin horario disponible; reprográmalas a mano: "
+                    + ", ".join(f"{v.cliente} ({v.fecha:%d/%m})" for v in sin_horario[:10]),
+                )
+            if not (cambios or sin_horario):
+                messages.info(request, "El técnico no tiene visitas futuras en ese rango.")
+            return redirect(f"{reverse('tecnicos_panel')}?tecnico={tec_obj.slug}")
+        if action == "regenerar_ical":
+            tec_obj = Tecnico.objects.filter(slug=(request.POST.get("tecnico_slug") or "").strip()).first()
+            if not tec_obj:
+                messages.error(request, "Selecciona un tecnico válido.")
+            else:
+                tec_obj.regenerar_ical_token()
+                messages.success(request, "Enlace de calendario regenerado. El enlace anterior dejó de funcionar.")
+                return redirect(f"{reverse('tecnicos_panel')}?tecnico={tec_obj.slug}")
+        if action == "regenerar_ical_todos":
+            request.user.regenerar_ical_token()
+            messages.success(request, "Enlace del calendario general regenerado. El enlace anterior dejó de funcionar.")
+            slug_sel = (request.POST.get("tecnico_slug") or "").strip()
+            return redirect(f"{reverse('tecnicos_panel')}?tecnico={slug_sel}" if slug_sel else reverse("tecnicos_panel"))
         if action == "eliminar_tecnico":
             slug_borrar = (request.POST.get("tecnico_slug") or "").strip()
             if not slug_borrar:
@@ -2038,17 +2280,36 @@ def tecnicos_panel(request):
             "correo": "",
         }
 
-    visitas_filtradas = VisitaTecnica.objects.filter(tecnico_slug=selected["slug"]).order_by("fecha", "hora", "id") if selected and selected.get("slug") else VisitaTecnica.objects.none()
-    hoy = timezone.localdate()
-    total_visitas = visitas_filtradas.count()
-    visitas_hoy = visitas_filtradas.filter(fecha=hoy).count()
-    visitas_proximas = visitas_filtradas.filter(fecha__gte=hoy).count()
-    pendientes = visitas_filtradas.filter(cotizacion__estado=Cotizacion.Estado.PENDIENTE).count()
-    aceptadas = visitas_filtradas.filter(cotizacion__estado=Cotizacion.Estado.ACEPTADA).count()
-    proceso_pago = visitas_filtradas.filter(cotizacion__estado=Cotizacion.Estado.PROCESO_PAGO).count()
-    completadas = visitas_filtradas.filter(cotizacion__estado=Cotizacion.Estado.COMPLETADA).count()
-    finalizadas = 0
+    selected_obj = next((t for t in tecnicos_db if t.slug == selected.get("slug")), None)
+    visitas_filtradas = (
+        VisitaTecnica.objects.filter(tecnico=selected_obj)
+        .select_related("tecnico", "cotizacion", "cotizacion__servicio")
+        .order_by("fecha", "hora", "id")
+        if selected_obj
+        else VisitaTecnica.objects.none()
+    )
+    # KPIs de todos los tecnicos en una consulta agrupada y cacheada: alimentan las insignias y el comparativo
+    kpis = kpis_tecnicos()
+    por_id = {t.slug: t.pk for t in tecnicos_db}
+    for entry in tecnicos_list:
+        entry["kpis"] = kpis.get(por_id.get(entry["slug"]), KPIS_VACIOS)
+    ranking = (
+        sorted(tecnicos_list, key=lambda t: (-t["kpis"]["completadas"], -t["kpis"]["proximas"], t["nombre"]))
+        if is_admin
+        else []
+    )
+    stats = dict(kpis.get(selected_obj.pk, KPIS_VACIOS) if selected_obj else KPIS_VACIOS, finalizadas=0)
     servicios_publicos = Servicio.objects.all().order_by("orden", "titulo")
+    ical_url = (
+        request.build_absolute_uri(reverse("agenda_ical_tecnico", args=[selected_obj.ical_token]))
+        if selected_obj and selected_obj.ical_token
+        else ""
+    )
+    ical_todos_url = (
+        request.build_absolute_uri(reverse("agenda_ical_todos", args=[_ical_admin_token(request.user)]))
+        if is_admin
+        else ""
+    )
 
     return render(
         request,
@@ -2058,21 +2319,15 @@ def tecnicos_panel(request):
             "tecnicos_all": tecnicos_list,
             "selected": selected,
             "visitas": visitas_filtradas,
-            "stats": {
-                "total": total_visitas,
-                "hoy": visitas_hoy,
-                "proximas": visitas_proximas,
-                "pendientes": pendientes,
-                "aceptadas": aceptadas,
-                "completadas": completadas,
-                "proceso_pago": proceso_pago,
-                "finalizadas": finalizadas,
-            },
-            "region_choices": [("", "Selecciona region")] + [(r, r) for r, _ in CHILE_REGIONES],
+            "stats": stats,
+            "ranking": ranking,
+            "region_choices": get_catalogo().region_choices,
             "servicios": servicios_publicos,
             "servicio_filter": servicio_filter,
             "tech_messages": messages.get_messages(request),
             "is_admin": is_admin,
+            "ical_url": ical_url,
+            "ical_todos_url": ical_todos_url,
         },
     )
 
@@ -2103,21 +2358,62 @@ def cotizacion_mis(request):
             c.tiene_trabajo = False
     return render(request, "menu/cotizacion_mis.html", {"cotizaciones": cotizaciones})
 
+def _filtrar_cotizaciones(request, cotizaciones, campo_fecha):
+    """
+    Filtros comunes de los listados de cotizaciones: servicio (slug), region y rango de fechas sobre campo_fecha.
+    El texto libre (q) no se aplica aqui: lo resuelve _pagina_cotizaciones con la busqueda por relevancia.
+    """
+    filtros = {
+        "servicio": (request.GET.get("servicio") or "").strip(),
+        "region": (request.GET.get("region") or "").strip(),
+        "desde": (request.GET.get("desde") or "").strip(),
+        "hasta": (request.GET.get("hasta") or "").strip(),
+        "q": (request.GET.get("q") or "").strip(),
+    }
+    if filtros["servicio"]:
+        cotizaciones = cotizaciones.filter(servicio__slug=filtros["servicio"])
+    if filtros["region"]:
+        cotizaciones = cotizaciones.filter(region=filtros["region"])
+    tz = timezone.get_current_timezone()
+    for clave, lookup, extra in (("desde", "gte", timedelta(0)), ("hasta", "lt", timedelta(days=1))):
+        try:
+            dia = datetime.strptime(filtros[clave], "%Y-%m-%d")
+        except ValueError:
+            filtros[clave] = ""
+            continue
+        # Limites como datetime (no __date) para que el filtro use el indice del campo
+        cotizaciones = cotizaciones.filter(**{f"{campo_fecha}__{lookup}": timezone.make_aware(dia + extra, tz)})
+    return cotizaciones, filtros
+
+
+def _pagina_cotizaciones(request, cotizaciones, filtros, campo):
+    # Con texto libre se ordena por relevancia (busqueda de texto completo); sin el, por fecha. Ambas paginan por cursor
+    if filtros["q"]:
+        return pagina_busqueda(cotizaciones, filtros["q"], request.GET.get("cursor") or "")
+    return Paginador(cotizaciones, campo).pagina(request.GET.get("cursor") or "")
+
+
 @login_required
 def cotizaciones_admin_list(request):
     if not (request.user.is_staff or request.user.is_superuser):
         messages.warning(request, "No tienes permiso para ver las cotizaciones.")
         return redirect("index")
-    cotizaciones = (
-        Cotizacion.objects.select_related("usuario", "servicio", "edificio")
-        .filter(estado=Cotizacion.Estado.PENDIENTE)
-        .order_by("-creado_en")
+    cotizaciones, filtros = _filtrar_cotizaciones(
+        request,
+        Cotizacion.objects.select_related("usuario", "servicio", "edificio").filter(estado=Cotizacion.Estado.PENDIENTE),
+        "creado_en",
     )
+    pagina = _pagina_cotizaciones(request, cotizaciones, filtros, "creado_en")
     return render(
         request,
         "menu/cotizaciones_admin.html",
         {
-            "cotizaciones": cotizaciones,
+            "cotizaciones": pagina.items,
+            "pagina": pagina,
+            "filtros": filtros,
+            "servicios": Servicio.objects.order_by("orden", "titulo"),
+            "region_choices": get_catalogo().region_choices,
+            "stats": stats_dashboard()[0],
             "tecnicos": [{"slug": t.slug, "nombre": f"{t.nombre} {t.apellido or ''}".strip(), "especialidad": t.especialidad or (t.servicio.titulo if getattr(t, 'servicio', None) else "")} for t in Tecnico.objects.filter(activo=True)],
         },
     )
@@ -2163,16 +2459,20 @@ def cotizacion_enviar(request, pk: int):
     except ValueError:
         hora_dt = None
 
-    # Validar conflicto de agenda (si se envía fecha/hora)
-    if fecha_dt and hora_dt and _tecnico_tiene_conflicto(tecnico_info["slug"], fecha_dt, hora_dt):
+    visita = cot.visitas.order_by("fecha", "hora", "id").first()
+
+    # Validar conflicto de agenda (si se envía fecha/hora), sin contar la propia visita
+    if fecha_dt and hora_dt and tecnico_tiene_conflicto(
+        tecnico_info["id"], fecha_dt, hora_dt, exclude_id=visita.pk if visita else None
+    ):
         messages.error(request, "El técnico ya tiene una hora tomada dentro de 3 horas de ese horario.")
         return redirect("cotizaciones_admin")
 
     # Actualizar o crear visita asociada con tecnico/fecha/hora
-    visita = cot.visitas.order_by("fecha", "hora", "id").first()
     if not visita:
-        visita = VisitaTecnica.objects.create(
+        visita = VisitaTecnica(
             cotizacion=cot,
+            tecnico_id=tecnico_info["id"],
             tecnico_slug=tecnico_info["slug"],
             tecnico_nombre=tecnico_info["nombre"],
             cliente=cot.usuario.get_full_name() or cot.usuario.username,
@@ -2184,19 +2484,27 @@ def cotizacion_enviar(request, pk: int):
             direccion=cot.lugar_servicio or "-",
             notas=cot.mensaje or "-",
         )
+        update_fields = None
     else:
+        visita.tecnico_id = tecnico_info["id"]
         visita.tecnico_slug = tecnico_info["slug"]
         visita.tecnico_nombre = tecnico_info["nombre"]
         visita.fecha = fecha_dt or visita.fecha
         visita.hora = hora_dt or visita.hora
         visita.correo = cot.usuario.email or visita.correo
-        visita.save(update_fields=["tecnico_slug", "tecnico_nombre", "fecha", "hora", "correo"])
+        update_fields = ["tecnico", "tecnico_slug", "tecnico_nombre", "fecha", "hora", "correo"]
+    try:
+        guardar_visita(visita, update_fields=update_fields)
+    except ConflictoAgenda as exc:
+        messages.error(request, str(exc))
+        return redirect("cotizaciones_admin")
 
     cot.presupuesto_estimado = precio
     cot.estado = Cotizacion.Estado.ENVIADA
     cot.resuelto_en = None
+    cot.enviada_en = cot.enviada_en or timezone.now()
     cot.motivo_rechazo = ""
-    cot.save(update_fields=["presupuesto_estimado", "estado", "resuelto_en", "motivo_rechazo"])
+    cot.save(update_fields=["presupuesto_estimado", "estado", "resuelto_en", "enviada_en", "motivo_rechazo"])
 
     # Correo al cliente
     correo_usuario = (cot.usuario.email or visita.correo or "").strip()
@@ -2249,12 +2557,30 @@ def cotizaciones_registro(request):
     if not (request.user.is_staff or request.user.is_superuser):
         messages.warning(request, "No tienes permiso para ver el registro.")
         return redirect("index")
-    cotizaciones = (
-        Cotizacion.objects.select_related("usuario", "servicio", "edificio")
-        .exclude(estado=Cotizacion.Estado.PENDIENTE)
-        .order_by("-resuelto_en", "-creado_en")
+    cotizaciones = Cotizacion.objects.select_related("usuario", "servicio", "edificio").exclude(
+        estado=Cotizacion.Estado.PENDIENTE
+    )
+    estado = (request.GET.get("estado") or "").strip()
+    if estado in Cotizacion.Estado.values and estado != Cotizacion.Estado.PENDIENTE:
+        cotizaciones = cotizaciones.filter(estado=estado)
+    else:
+        estado = ""
+    cotizaciones, filtros = _filtrar_cotizaciones(request, cotizaciones, "resuelto_en")
+    filtros["estado"] = estado
+    # Las que no tienen resuelto_en (p. ej. reenviadas al cliente) van al final, ordenadas por id
+    pagina = _pagina_cotizaciones(request, cotizaciones, filtros, "resuelto_en")
+    return render(
+        request,
+        "menu/cotizaciones_registro.html",
+        {
+            "cotizaciones": pagina.items,
+            "pagina": pagina,
+            "filtros": filtros,
+            "estados": [(v, l) for v, l in Cotizacion.Estado.choices if v != Cotizacion.Estado.PENDIENTE],
+            "servicios": Servicio.objects.order_by("orden", "titulo"),
+            "region_choices": get_catalogo().region_choices,
+        },
     )
-    return render(request, "menu/cotizaciones_registro.html", {"cotizaciones": cotizaciones})
 
 
 @login_required
@@ -2368,7 +2694,7 @@ def cotizacion_responder(request, pk: int):
 
         visita = cot.visitas.order_by("fecha", "hora", "id").first()
         if not visita:
-            visita = _schedule_visit_for_cot(cot)
+            visita = agendar_cotizacion(cot)
 
         correo = (cot.usuario.email or "").strip()
         if correo:
@@ -2520,7 +2846,8 @@ def cotizacion_aceptar(request, pk: int):
     cot.estado = Cotizacion.Estado.ACEPTADA
     cot.motivo_rechazo = ""
     cot.resuelto_en = timezone.now()
-    update_fields = ["estado", "motivo_rechazo", "resuelto_en"]
+    cot.enviada_en = cot.enviada_en or cot.resuelto_en
+    update_fields = ["estado", "motivo_rechazo", "resuelto_en", "enviada_en"]
     if precio_decimal is not None:
         cot.presupuesto_estimado = precio_decimal
         update_fields.append("presupuesto_estimado")
@@ -2528,7 +2855,7 @@ def cotizacion_aceptar(request, pk: int):
 
     visita = cot.visitas.order_by("fecha", "hora", "id").first()
     if not visita:
-        visita = _schedule_visit_for_cot(cot)
+        visita = agendar_cotizacion(cot)
 
     correo = (cot.usuario.email or "").strip()
     if correo:
@@ -2587,7 +2914,7 @@ def cotizacion_informe(request, pk: int):
         messages.error(request, "Solo puedes generar informe para una Cotizacion aceptada.")
         return redirect("cotizaciones_admin")
     if tech_info:
-        has_visit = cot.visitas.filter(tecnico_slug=tech_info["slug"]).exists()
+        has_visit = cot.visitas.filter(tecnico__slug=tech_info["slug"]).exists()
         if not has_visit:
             messages.error(request, "No tienes visitas asignadas en esta Cotizacion.")
             return redirect("tecnicos_panel")
@@ -3014,31 +3341,51 @@ def documentos_admin(request):
     if filtro_cat:
         docs = docs.filter(categoria=filtro_cat)
     if filtro_tag:
-        docs = docs.filter(tags__icontains=filtro_tag)
-    docs = docs.order_by("-creado_en")
+        docs = filtrar(docs, filtro_tag)
+    docs = docs.prefetch_related("etiquetas").order_by("-creado_en")
     return render(
         request,
         "menu/documentos_admin.html",
-        {"form": form, "docs": docs, "filtro_cat": filtro_cat, "filtro_tag": filtro_tag, "categorias": Documento.Categoria},
+        {
+            "form": form,
+            "docs": docs,
+            "filtro_cat": filtro_cat,
+            "filtro_tag": filtro_tag,
+            "categorias": Documento.Categoria,
+            "nube": nube_etiquetas(),
+            "prefijo": PREFIJO,
+        },
     )
 
 
 def documentos_list(request):
     if request.user.is_authenticated and (request.user.is_staff or request.user.is_superuser):
         docs = Documento.objects.all()
+        nube = nube_etiquetas()
+    elif request.user.is_authenticated:
+        docs = Documento.objects.filter(subido_por=request.user)
+        nube = nube_etiquetas(request.user.pk)
     else:
-        docs = Documento.objects.filter(subido_por=request.user) if request.user.is_authenticated else Documento.objects.none()
+        docs = Documento.objects.none()
+        nube = []
     filtro_cat = request.GET.get("categoria") or ""
     filtro_tag = (request.GET.get("tag") or "").strip()
     if filtro_cat:
         docs = docs.filter(categoria=filtro_cat)
     if filtro_tag:
-        docs = docs.filter(tags__icontains=filtro_tag)
-    docs = docs.order_by("-creado_en")
+        docs = filtrar(docs, filtro_tag)
+    docs = docs.prefetch_related("etiquetas").order_by("-creado_en")
     return render(
         request,
         "menu/documentos_list.html",
-        {"docs": docs, "filtro_cat": filtro_cat, "filtro_tag": filtro_tag, "categorias": Documento.Categoria},
+        {
+            "docs": docs,
+            "filtro_cat": filtro_cat,
+            "filtro_tag": filtro_tag,
+            "categorias": Documento.Categoria,
+            "nube": nube,
+            "prefijo": PREFIJO,
+        },
     )
 
 
@@ -3051,7 +3398,9 @@ def documento_editar(request, pk: int):
     if request.method == 'POST':
         form = DocumentoEditForm(request.POST, instance=doc)
         if form.is_valid():
-            form.save()
+            doc = form.save(commit=False)
+            doc.tags = _normalize_tags(form.cleaned_data.get("tags"))
+            doc.save()
             messages.success(request, "Documento actualizado correctamente.")
             return redirect('documentos_list')
     else:
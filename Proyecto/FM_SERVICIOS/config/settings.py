@@ -72,10 +72,10 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    'FM.apps.FMConfig',          # antes de staticfiles: su collectstatic exporta el catalogo de regiones
     'django.contrib.staticfiles',
 
     'django.contrib.postgres',   # utilidades de Postgres
-    'FM.apps.FMConfig',
 ]
 
 MIDDLEWARE = [
@@ -113,6 +113,26 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# Avisos de agenda en tiempo real (FM.realtime). El broker en memoria sirve con un solo worker ASGI;
+# con varios procesos usa FM.realtime.BrokerRedis y FM_REALTIME_REDIS_URL
+FM_REALTIME_BROKER = os.environ.get('FM_REALTIME_BROKER', 'FM.realtime.BrokerMemoria')
+FM_REALTIME_REDIS_URL = os.environ.get('FM_REALTIME_REDIS_URL', 'redis://localhost:6379/0')
+
+# Cache compartida por todos los workers: catalogo, cobertura, estadisticas, analitica, rutas y etiquetas
+# guardan ahi su version, asi que una edicion en un proceso invalida la copia de los demas.
+# Con FM_CACHE_URL=redis://... usa Redis (requiere el paquete redis); si no, la tabla fm_cache de la base
+# (la crea la migracion 0033).
+# Una cache por proceso (LocMemCache) no sirve con mas de un worker: FM.checks la rechaza en produccion.
+FM_CACHE_URL = os.environ.get('FM_CACHE_URL', '')
+if FM_CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': FM_CACHE_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'fm_cache'}}
+
+# Panel de administracion: sobre este numero de filas (Postgres) los totales usan el estimado de pg_class; 0 = siempre exacto
+FM_DASHBOARD_CONTEO_APROXIMADO = int(os.environ.get('FM_DASHBOARD_CONTEO_APROXIMADO', '0'))
 
 
 def _database_from_url(url: str) -> dict:
@@ -137,6 +157,7 @@ def _database_from_url(url: str) -> dict:
         return {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / db_path,
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
         }
     raise ValueError(f'Esquema de base de datos no soportado: {scheme}')
 
@@ -163,6 +184,8 @@ else:
         DATABASES['default'] = {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Toma el lock de escritura al abrir la transaccion: serializa reservas de agenda entre procesos
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
         }
     else:
         DATABASES['default'] = {
@@ -175,6 +198,10 @@ else:
             'OPTIONS': {'sslmode': 'require'},
         }
 
+# Las pruebas de reservas concurrentes abren una conexion por hilo: en SQLite la BD de pruebas debe ser un archivo
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('TEST', {'NAME': BASE_DIR / 'test_db.sqlite3'})
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -203,7 +230,11 @@ _project_static = BASE_DIR / 'static'
 if _project_static.exists():
     STATICFILES_DIRS.append(_project_static)
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# STATICFILES_STORAGE ya no existe desde Django 5.1: la storage de WhiteNoise se declara en STORAGES
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'